@@ -0,0 +1,153 @@
+"""
+Build or compile many pieces with a pool of worker processes.
+
+For building, the parent process loads everything a worker needs (templates,
+validation vocabularies, the lilypond probe) before the pool is created. On
+platforms with fork the workers inherit that state copy-on-write, so each one
+starts warm without re-importing or re-reading anything. Compiling only runs
+lilypond, so its workers start cold.
+"""
+import gc
+import importlib
+import multiprocessing
+import os
+import subprocess
+import traceback
+from pathlib import Path
+
+# modules the workers would otherwise import lazily
+WARM_MODULES = ('lilyskel.yaml_interface', 'lilyskel.render', 'num2words',
+                'titlecase')
+
+
+def preload():
+    """Load everything the batch workers use into this process."""
+    from lilyskel import render, info, mutopia, lyinstall, exceptions
+    for module in WARM_MODULES:
+        importlib.import_module(module)
+    env = render.get_env()
+    for template in env.list_templates(extensions=['ly', 'ily']):
+        env.get_template(template)
+    try:
+        lyinstall.probe()
+    except exceptions.LilypondError:
+        pass
+    # these may have to be downloaded. A failure here is not fatal, the
+    # workers will try again if they actually need them.
+    for getter in (info.get_allowed_notes, info.get_allowed_modes,
+                   mutopia.get_styles, mutopia.get_licenses):
+        try:
+            getter()
+        except (OSError, AttributeError):
+            pass
+    # move everything loaded so far out of the collector's reach so the
+    # workers' garbage collection doesn't dirty the shared pages.
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def get_pool(workers, warm=True):
+    """
+    Returns a process pool whose workers start with preloaded state.
+
+    :param workers: the number of worker processes.
+    :param warm: (optional) False for a plain pool without preloading.
+    """
+    if not warm:
+        return multiprocessing.Pool(workers)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        preload()
+        return multiprocessing.get_context('fork').Pool(workers)
+    # without fork each worker has to load for itself.
+    return multiprocessing.get_context('spawn').Pool(workers,
+                                                     initializer=preload)
+
+
+def _build_one(job):
+    """Worker: render one config file. Returns (config, error or None)."""
+    from lilyskel import yaml_interface, render
+    config, target_dir, flags, extra_includes, trusted = job
+    # rendering changes directory and a failed job doesn't change back. The
+    # worker goes on to other jobs, so it has to.
+    old_dir = os.getcwd()
+    try:
+        piece = yaml_interface.read_config(Path(config), trusted=trusted)
+        render.render_all(piece, location=Path(target_dir), flags=flags,
+                          extra_includes=extra_includes)
+    except Exception:  # pylint: disable=broad-except
+        return config, traceback.format_exc()
+    finally:
+        os.chdir(old_dir)
+    return config, None
+
+
+def _compile_one(job):
+    """Worker: run lilypond on one file. Returns (file, error or None)."""
+    from lilyskel import lyinstall
+    lyfile, binary = job
+    lyfile = Path(lyfile)
+    run_ly = subprocess.run([binary, lyfile.name], cwd=str(lyfile.parents[0]),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if run_ly.returncode != 0:
+        return str(lyfile), run_ly.stderr.decode(lyinstall.ENCODING)
+    return str(lyfile), None
+
+
+def _run(pool, func, jobs, workers):
+    chunksize = max(1, len(jobs) // (workers * 4))
+    return list(pool.imap_unordered(func, jobs, chunksize))
+
+
+def build_all(configs, target_root=None, workers=None, flags=None,
+              extra_includes=[], trusted=False):
+    """
+    Build the file skeletons for many config files in parallel.
+
+    :param configs: paths of config files.
+    :param target_root: (optional) each piece is built in a directory named
+        after its config file under target_root. Defaults to the directory
+        of each config file. Configs that would be built in the same
+        directory as an earlier one fail without being built.
+    :param workers: the number of worker processes. Defaults to cpu count.
+    :param flags: the part rendering flags. (see render.make_instrument)
+    :param trusted: skip validating the config files.
+    :return: list of (config, error) tuples. error is None on success.
+    """
+    from lilyskel import render
+    workers = workers or multiprocessing.cpu_count()
+    flags = flags or render.FLAGS
+    jobs = []
+    results = []
+    # target directory -> the config built there
+    targets = {}
+    for config in configs:
+        config = Path(config).resolve()
+        target_dir = Path(target_root or config.parents[0],
+                          config.stem).resolve()
+        if target_dir in targets:
+            results.append((str(config), "{} is already built from {}".format(
+                target_dir, targets[target_dir])))
+            continue
+        targets[target_dir] = config
+        jobs.append((str(config), str(target_dir), flags, extra_includes,
+                     trusted))
+    if jobs:
+        with get_pool(workers) as pool:
+            results.extend(_run(pool, _build_one, jobs, workers))
+    return results
+
+
+def compile_all(lyfiles, workers=None):
+    """
+    Run lilypond on many files in parallel.
+
+    :param lyfiles: paths of lilypond files.
+    :param workers: the number of worker processes. Defaults to cpu count.
+    :return: list of (lyfile, error) tuples. error is None on success.
+    """
+    from lilyskel import lyinstall
+    workers = workers or multiprocessing.cpu_count()
+    binary = lyinstall.find_binary()
+    jobs = [(str(lyfile), binary) for lyfile in lyfiles]
+    with get_pool(workers, warm=False) as pool:
+        return _run(pool, _compile_one, jobs, workers)
@@ -0,0 +1,296 @@
+"""
+Bulk import of database rows from CSV or JSON lines files.
+
+`lilyskel db import TABLE FILE` reads the file a row at a time. Rows for the
+instruments, composers and ensembles tables are checked by building the
+Instrument, Composer or Ensemble they describe. Rows for other tables, such as
+the title and tempo words, only need a name or a word. A row whose name is
+already in the table, or earlier in the file, is skipped. The rest are
+inserted BATCH_SIZE at a time, and the database file is written once.
+"""
+import csv
+import json
+from pathlib import Path
+import attr
+from lilyskel import db_interface
+from lilyskel import exceptions
+from lilyskel.info import Composer
+from lilyskel.lynames import Instrument, normalize_name, VALID_CLEFS
+
+BATCH_SIZE = 1000
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+TRUE_WORDS = {'true', 'yes', 'y', '1'}
+FALSE_WORDS = {'false', 'no', 'n', '0', ''}
+
+
+@attr.s
+class ImportReport:
+    """What an import did with the rows of a file."""
+    added = attr.ib(default=0)
+    duplicates = attr.ib(default=0)
+    invalid = attr.ib(default=0)
+    errors = attr.ib(default=attr.Factory(list))
+
+
+def _fields(row):
+    """The fields of a row that have a value. Empty CSV cells count as
+    missing."""
+    if not isinstance(row, dict):
+        raise exceptions.InvalidRowError("a row must be an object")
+    if None in row:
+        raise exceptions.InvalidRowError("the row has more cells than the "
+                                         "header")
+    return {key: value for key, value in row.items()
+            if value is not None and value != ''}
+
+
+def _check_keys(fields, allowed):
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        raise exceptions.InvalidRowError("unknown fields: {}".format(
+            ', '.join(sorted(unknown))))
+    if not fields.get('name'):
+        raise exceptions.InvalidRowError("'name' is required")
+
+
+def _boolean(value):
+    """A boolean from JSON or from a CSV cell."""
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in TRUE_WORDS:
+        return True
+    if str(value).strip().lower() in FALSE_WORDS:
+        return False
+    raise exceptions.InvalidRowError(
+        "'{}' is not true or false".format(value))
+
+
+def _clef(value):
+    """A clef, or a list of clefs for an instrument with several staves.
+    Like `db add instrument`, a string of several clefs is split on
+    whitespace: 'treble bass'."""
+    if isinstance(value, str):
+        value = value.split()
+        if len(value) == 1:
+            value = value[0]
+    clefs = value if isinstance(value, list) else [value]
+    for clef in clefs:
+        if clef not in VALID_CLEFS:
+            raise exceptions.InvalidRowError(
+                "'{}' is not a valid clef".format(clef))
+    return value
+
+
+def instrument_row(row, db):
+    """
+    Check a row of the instruments table.
+
+    :param row: dict of the row's fields.
+    :param db: the TinyDB being imported into.
+    :return: the dict to store.
+    """
+    fields = _fields(row)
+    _check_keys(fields, [field.name for field in attr.fields(Instrument)
+                         if field.init])
+    if 'keyboard' in fields:
+        fields['keyboard'] = _boolean(fields['keyboard'])
+    clef = _clef(fields.pop('clef')) if 'clef' in fields else None
+    try:
+        instrument = Instrument(**fields)
+    except (TypeError, AttributeError):
+        raise exceptions.InvalidRowError("names must be strings")
+    # the validator only takes a single clef, so a list is set afterwards
+    # like Instrument.load_from_db does.
+    if clef is not None:
+        instrument.clef = clef
+    return instrument.db_data()
+
+
+def composer_row(row, db):
+    """
+    Check a row of the composers table.
+
+    :param row: dict of the row's fields.
+    :param db: the TinyDB being imported into.
+    :return: the dict to store.
+    """
+    fields = _fields(row)
+    _check_keys(fields, [field.name for field in attr.fields(Composer)])
+    try:
+        return Composer(**fields).dump()
+    except TypeError:
+        raise exceptions.InvalidRowError("the name must be a string")
+
+
+def _ensemble_member(member):
+    """An instrument of an ensemble row: a {'name', 'number'} dict, or a
+    string like 'violin' or 'violin:2'."""
+    if isinstance(member, str):
+        name, _, number = member.partition(':')
+        member = {'name': name, 'number': number.strip() or None}
+    if not isinstance(member, dict) or not member.get('name'):
+        raise exceptions.InvalidRowError(
+            "'{}' is not an instrument".format(member))
+    number = member.get('number')
+    try:
+        number = int(number) if number is not None else None
+    except ValueError:
+        raise exceptions.InvalidRowError(
+            "'{}' is not an instrument number".format(number))
+    return {'name': normalize_name(member['name']), 'number': number}
+
+
+def ensemble_row(row, db):
+    """
+    Check a row of the ensembles table. Its instruments must already be in
+    the database. In a CSV file they are written 'violin:1; violin:2; viola'.
+
+    :param row: dict of the row's fields.
+    :param db: the TinyDB being imported into.
+    :return: the dict to store.
+    """
+    fields = _fields(row)
+    _check_keys(fields, ['name', 'instruments'])
+    members = fields.get('instruments', [])
+    if isinstance(members, str):
+        members = [member for member in members.split(';') if member.strip()]
+    if not isinstance(members, list) or not members:
+        raise exceptions.InvalidRowError("an ensemble needs instruments")
+    members = [_ensemble_member(member) for member in members]
+    known = db_interface.name_index(db.table('instruments'))
+    missing = [member['name'] for member in members
+               if member['name'] not in known]
+    if missing:
+        raise exceptions.MissingInstrumentError(
+            "not in the instruments table: {}".format(', '.join(missing)))
+    return {'name': normalize_name(fields['name']), 'instruments': members}
+
+
+def plain_row(row, db):
+    """
+    Check a row of any other table: it needs a name or a word.
+
+    :param row: dict of the row's fields.
+    :param db: the TinyDB being imported into.
+    :return: the dict to store.
+    """
+    fields = _fields(row)
+    if not fields.get('name') and not fields.get('word'):
+        raise exceptions.InvalidRowError("'name' or 'word' is required")
+    return fields
+
+
+SCHEMAS = {
+    'instruments': instrument_row,
+    'composers': composer_row,
+    'ensembles': ensemble_row,
+}
+
+
+def _key(data):
+    """The name or word a row is known by, as in the table's indexes."""
+    name = data.get('name', data.get('word'))
+    return normalize_name(name) if 'name' in data and isinstance(
+        name, str) else name
+
+
+def file_format(path, fmt=None):
+    """
+    Returns the format of a file, 'csv' or 'jsonl'.
+
+    :param path: the path of the file.
+    :param fmt: (optional) the format given by the user.
+    :raises ValueError: if it is neither.
+    """
+    suffix = Path(path).suffix.lower()
+    if fmt is None and suffix == '.json':
+        raise ValueError("'{}' looks like a JSON file. Rows are read from "
+                         "JSON lines, one object per line: name it .jsonl or "
+                         "pass the format.".format(path))
+    fmt = fmt or FORMATS.get(suffix)
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError("Can't tell the format of '{}', it should be csv or "
+                         "jsonl.".format(path))
+    return fmt
+
+
+def read_rows(path, fmt):
+    """
+    Yield the rows of a file one at a time, as (line number, row). A JSON
+    line that can't be parsed is yielded as an InvalidRowError.
+
+    :param path: the path of the file.
+    :param fmt: 'csv' or 'jsonl'.
+    """
+    with open(path, 'r', newline='', encoding='utf-8') as infile:
+        if fmt == 'csv':
+            reader = csv.DictReader(infile)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_num, line in enumerate(infile, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except ValueError as err:
+                yield line_num, exceptions.InvalidRowError(
+                    "not valid JSON ({})".format(err))
+
+
+def import_rows(db, tablename, rows, batch_size=BATCH_SIZE):
+    """
+    Check and insert rows into a table, skipping names already there.
+
+    :param db: a TinyDB object.
+    :param tablename: the table to import into.
+    :param rows: iterable of (line number, row).
+    :param batch_size: (optional) how many rows to insert at a time.
+    :return: an ImportReport.
+    """
+    table = db.table(tablename)
+    check = SCHEMAS.get(tablename, plain_row)
+    report = ImportReport()
+    seen = set(db_interface.name_index(table))
+    seen.update(db_interface.field_index(table, 'word').documents)
+    pending = []
+    with db_interface.batch(db):
+        for line_num, row in rows:
+            try:
+                if isinstance(row, exceptions.InvalidRowError):
+                    raise row
+                data = check(row, db)
+            except (exceptions.InvalidRowError,
+                    exceptions.MissingInstrumentError) as err:
+                report.invalid += 1
+                report.errors.append("line {}: {}".format(
+                    line_num, err.args[0] if err.args else err))
+                continue
+            if _key(data) in seen:
+                report.duplicates += 1
+                continue
+            seen.add(_key(data))
+            pending.append(data)
+            if len(pending) >= batch_size:
+                report.added += len(db_interface.insert_multiple(table,
+                                                                 pending))
+                pending = []
+        if pending:
+            report.added += len(db_interface.insert_multiple(table, pending))
+    return report
+
+
+def import_file(db, tablename, path, fmt=None, batch_size=BATCH_SIZE):
+    """
+    Import a CSV or JSON lines file into a table. See import_rows.
+
+    :param db: a TinyDB object.
+    :param tablename: the table to import into.
+    :param path: the path of the file.
+    :param fmt: (optional) 'csv' or 'jsonl', otherwise taken from the
+        file's extension.
+    :param batch_size: (optional) how many rows to insert at a time.
+    :return: an ImportReport.
+    """
+    return import_rows(db, tablename, read_rows(path, file_format(path, fmt)),
+                       batch_size)
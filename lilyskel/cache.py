@@ -0,0 +1,59 @@
+"""Small on-disk json cache for data that is slow to compute or download."""
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+def cache_dir():
+    """
+    Returns the directory used for lilyskel's caches.
+    Respects LILYSKEL_CACHE_DIR and XDG_CACHE_HOME, otherwise ~/.cache/lilyskel
+    """
+    if os.environ.get('LILYSKEL_CACHE_DIR'):
+        return Path(os.environ['LILYSKEL_CACHE_DIR'])
+    base = os.environ.get('XDG_CACHE_HOME') or Path(os.path.expanduser('~'),
+                                                    '.cache')
+    return Path(base, 'lilyskel')
+
+
+def cache_path(name):
+    """Returns the path of the cache file called 'name'."""
+    return Path(cache_dir(), name)
+
+
+def load(name):
+    """
+    Load a cache file.
+
+    :param name: the name of the cache file.
+    :return: the cached data or None if it is missing or unreadable.
+    """
+    try:
+        with open(cache_path(name), 'r') as cachefile:
+            return json.load(cachefile)
+    except (OSError, ValueError):
+        return None
+
+
+def dump(name, data):
+    """
+    Atomically write data to a cache file. Failure to write is not an error,
+    the data will just be recomputed next time.
+
+    :param name: the name of the cache file.
+    :param data: json serializable data.
+    """
+    path = cache_path(name)
+    try:
+        os.makedirs(path.parents[0], exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=path.parents[0], prefix=name,
+                                       suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'w') as tmpfile:
+            json.dump(data, tmpfile)
+        os.replace(tmppath, path)
+    except OSError:
+        os.remove(tmppath)
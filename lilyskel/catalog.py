@@ -0,0 +1,162 @@
+"""
+A local index of the mutopia catalog, to spot pieces that are already there.
+
+`lilyskel mutopia index DIR` reads a dump of the catalog: the .rdf files
+mutopia publishes with every piece, or saved piece-info .html pages. Only the
+composer, opus, title and id of each piece are kept, keyed by a folded
+(composer surname, opus, title), so that a piece is looked up in one dict
+access whatever the spelling of its composer.
+"""
+import re
+import xml.etree.ElementTree as ElementTree
+from pathlib import Path
+from lilyskel import cache
+from lilyskel import matching
+
+CACHE_NAME = 'mutopia_catalog.json'
+INDEX_VERSION = 1
+# the namespace of the fields in mutopia's rdf files
+MP_NAMESPACE = 'http://www.mutopiaproject.org/piece-data/0.1/'
+FIELDS = ('composer', 'opus', 'title', 'id')
+
+# contents of the index file, read once per process
+INDEX = None
+
+
+def piece_key(composer, opus, title):
+    """
+    Returns the index key of a piece.
+
+    :param composer: a composer name, mutopia's ('BeethovenLv') or ours
+        ('Ludwig van Beethoven').
+    :param opus: the opus, e.g. 'Op. 67'.
+    :param title: the title.
+    """
+    composer = matching.fold(matching.surname(composer or ''))
+    opus = re.sub(r'^opus', 'op', matching.fold(opus or ''))
+    return '|'.join([composer, opus, matching.fold(title or '')])
+
+
+def parse_rdf(path):
+    """
+    Read the pieces described in an rdf file.
+
+    :param path: the path of the file.
+    :return: list of dicts with the FIELDS.
+    """
+    pieces = []
+    for description in ElementTree.parse(str(path)).getroot():
+        piece = {field: (description.findtext(
+            '{{{ns}}}{field}'.format(ns=MP_NAMESPACE, field=field)) or '')
+                 .strip() for field in FIELDS}
+        if piece['title']:
+            pieces.append(piece)
+    return pieces
+
+
+def parse_html(path):
+    """
+    Read the pieces in a saved html page. Every table with 'Title:' and
+    'Composer:' rows counts as one piece.
+
+    :param path: the path of the file.
+    :return: list of dicts with the FIELDS.
+    """
+    from bs4 import BeautifulSoup
+    with open(path, 'r', encoding='utf-8', errors='replace') as page:
+        soup = BeautifulSoup(page.read(), 'html.parser')
+    pieces = []
+    for table in soup.find_all('table'):
+        piece = dict.fromkeys(FIELDS, '')
+        for row in table.find_all('tr'):
+            cells = row.find_all(['th', 'td'])
+            if len(cells) < 2:
+                continue
+            label = cells[0].get_text().strip().rstrip(':').lower()
+            if label in ('piece id', 'mutopia id'):
+                label = 'id'
+            if label in piece:
+                piece[label] = cells[1].get_text().strip()
+        if piece['title'] and piece['composer']:
+            pieces.append(piece)
+    return pieces
+
+
+PARSERS = {'.rdf': parse_rdf, '.html': parse_html, '.htm': parse_html}
+
+
+def build_index(directory):
+    """
+    Index every rdf and html file under directory and save the index.
+
+    :param directory: the directory of the catalog dump.
+    :return: the number of pieces indexed.
+    """
+    # pylint: disable=global-statement
+    global INDEX
+    pieces = {}
+    count = 0
+    for path in sorted(Path(directory).rglob('*')):
+        parser = PARSERS.get(path.suffix.lower())
+        if parser is None:
+            continue
+        try:
+            found = parser(path)
+        except (ElementTree.ParseError, OSError):
+            continue
+        for piece in found:
+            key = piece_key(piece['composer'], piece['opus'], piece['title'])
+            entry = [piece[field] for field in FIELDS]
+            # the same piece may be in the dump more than once
+            if not any(entry == other or entry[-1] and entry[-1] == other[-1]
+                       for other in pieces.setdefault(key, [])):
+                pieces[key].append(entry)
+                count += 1
+    INDEX = {'version': INDEX_VERSION, 'pieces': pieces}
+    cache.dump(CACHE_NAME, INDEX)
+    return count
+
+
+def _load_index():
+    """Read the index file, once. Returns None if there is none."""
+    # pylint: disable=global-statement
+    global INDEX
+    if INDEX is None:
+        INDEX = cache.load(CACHE_NAME)
+    if not INDEX or INDEX.get('version') != INDEX_VERSION:
+        return None
+    return INDEX
+
+
+def find(composer, opus, title):
+    """
+    Returns the catalog pieces with the same composer, opus and title.
+
+    :param composer: a composer name.
+    :param opus: the opus.
+    :param title: the title.
+    :return: list of dicts with the FIELDS, empty without an index.
+    """
+    index = _load_index()
+    if index is None:
+        return []
+    return [dict(zip(FIELDS, entry)) for entry
+            in index['pieces'].get(piece_key(composer, opus, title), [])]
+
+
+def duplicates(piece):
+    """
+    Returns the catalog pieces that match a Piece.
+
+    :param piece: an info.Piece.
+    """
+    composer = piece.headers.composer
+    return find(composer.mutopianame or composer.name, piece.opus,
+                piece.headers.title)
+
+
+def warn_duplicates(piece):
+    """Print a warning for each catalog piece that matches a Piece."""
+    for found in duplicates(piece):
+        print("Warning: mutopia already has {title} {opus} by {composer} "
+              "({id}).".format(**found))
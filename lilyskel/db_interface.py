@@ -1,25 +1,166 @@
 """Methods for dealing with tinydb database."""
+from contextlib import contextmanager
 from pathlib import Path
+import json
 import os
 import shutil
+import stat
+import tempfile
+import weakref
 from tinydb import TinyDB, Query
+from tinydb.database import Document, Table
+from tinydb.middlewares import Middleware
+from tinydb.storages import Storage
 from . import exceptions
+from . import matching
 
 here = Path(__file__).parents[0]
 def_path = Path(os.path.expanduser('~'), '.local', 'share', 'lilyskel', 'db.json')
 
+# table -> (stamp, {name: document}), see name_index
+NAME_INDEXES = weakref.WeakKeyDictionary()
+# table -> (stamp, {field: FieldIndex}), see field_index
+FIELD_INDEXES = weakref.WeakKeyDictionary()
+
+
+class AtomicJSONStorage(Storage):
+    """
+    Stores the data in a JSON file, replacing the whole file on every write
+    so that it is never left half written.
+
+    :param path: the path of the file.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__()
+        self.path = Path(path)
+        self.kwargs = kwargs
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as dbfile:
+                text = dbfile.read()
+        except FileNotFoundError:
+            return None
+        return json.loads(text) if text else None
+
+    def write(self, data):
+        fd, tmppath = tempfile.mkstemp(dir=self.path.parents[0],
+                                       prefix=self.path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as tmpfile:
+                json.dump(data, tmpfile, **self.kwargs)
+                tmpfile.flush()
+                os.fsync(tmpfile.fileno())
+            # mkstemp makes the file readable by its owner only
+            try:
+                os.chmod(tmppath, stat.S_IMODE(os.stat(self.path).st_mode))
+            except FileNotFoundError:
+                pass
+            os.replace(tmppath, self.path)
+        except BaseException:
+            os.remove(tmppath)
+            raise
+
+
+class BatchingMiddleware(Middleware):
+    """
+    Holds the writes made during a batch in memory and writes them to the
+    storage once, when the batch ends. If the outermost batch ends with an
+    exception they are dropped instead. Outside of a batch every write goes
+    straight to the storage. See batch.
+    """
+
+    def __init__(self, storage_cls=AtomicJSONStorage):
+        super().__init__(storage_cls)
+        self.depth = 0
+        self.pending = None
+        self.dirty = False
+
+    @contextmanager
+    def batch(self):
+        """Batch the writes made inside the with block. Batches nest."""
+        self.depth += 1
+        try:
+            yield self
+        except BaseException:
+            if self.depth == 1:
+                self.discard()
+            raise
+        finally:
+            self.depth -= 1
+            if not self.depth:
+                self.flush()
+
+    def flush(self):
+        """Write the pending data, if anything changed."""
+        if self.dirty:
+            self.storage.write(self.pending)
+        self.pending = None
+        self.dirty = False
+
+    def discard(self):
+        """Drop the pending data."""
+        self.pending = None
+        self.dirty = False
+
+    def read(self):
+        if not self.depth:
+            return self.storage.read()
+        if self.pending is None:
+            self.pending = self.storage.read() or {}
+        return self.pending
+
+    def write(self, data):
+        if not self.depth:
+            self.storage.write(data)
+            return
+        self.pending = data
+        self.dirty = True
+
+    def close(self):
+        self.flush()
+        self.storage.close()
+
 
 def init_db(path=None):
     """
     Initializes the database.
     :param path: (optional) the path of the database.
-    :return: TinyDB of common instruments and composers
+    :return: TinyDB of common instruments and composers, writing through a
+        BatchingMiddleware.
     """
     db_path = path or def_path
     db_path = Path(db_path)
     if not db_path.parents[0].exists():
         os.makedirs(db_path.parents[0])
-    return TinyDB(db_path)
+    return TinyDB(db_path, storage=BatchingMiddleware(AtomicJSONStorage))
+
+
+@contextmanager
+def batch(db):
+    """
+    Write everything db's tables write inside the with block to its file
+    once, at the end. If the block raises, nothing it wrote is kept. Databases
+    not made by init_db write as usual.
+
+    :param db: a TinyDB object.
+    """
+    # tinydb keeps the storage it was given here
+    storage = getattr(db, '_storage', None)
+    if isinstance(storage, BatchingMiddleware):
+        try:
+            with storage.batch():
+                yield db
+        except BaseException:
+            if not storage.depth:
+                # the tables' indexes and query caches saw the dropped writes
+                for table in db._table_cache.values():
+                    _forget(table)
+                    table.clear_cache()
+            raise
+    else:
+        yield db
 
 
 def bootstrap_db(path=None):
@@ -65,11 +206,8 @@ def explore_table(table, search=None):
         if not isinstance(search, tuple):
             raise TypeError('search must be a tuple (field, value)')
         field, term = search
-        q = Query()
-        # Search[field]: look specified field, lambda val: return the value
-        # from the db if the term is found in it.
         try:
-            items = table.search(q[field].test(lambda val: term in val))
+            items = search_table(table, field, term)
         except AttributeError as err:
             raise TypeError("table may not be a tinydb table ", err)
     for item in items:
@@ -80,6 +218,84 @@ def explore_table(table, search=None):
     return founditems
 
 
+def search_table(table, field, term):
+    """
+    Returns the documents of a table whose field contains term, in table
+    order. Tinydb tables are searched through a FieldIndex.
+
+    :param table: the tinydb table object to search.
+    :param field: the field to search in.
+    :param term: the value to search for.
+    """
+    if isinstance(table, Table):
+        return field_index(table, field).search(term)
+    q = Query()
+    # Search[field]: look specified field, lambda val: return the value
+    # from the db if the term is found in it.
+    return table.search(q[field].test(lambda val: term in val))
+
+
+class FieldIndex:
+    """
+    The documents of a table by the trigrams of one field, for substring
+    search. Only the documents that hold all the trigrams of a term are
+    checked for it. Documents whose field isn't a string are checked on
+    every search.
+
+    :param documents: iterable of documents.
+    :param field: the field to index.
+    """
+
+    def __init__(self, documents, field):
+        self.field = field
+        self.values = matching.TrigramIndex()
+        self.documents = {}
+        self.others = []
+        for data in documents:
+            self.add(data)
+
+    def add(self, data):
+        """Add a document to the index, if it has the field."""
+        if self.field not in data:
+            return
+        value = data[self.field]
+        if isinstance(value, str):
+            self.values.add(value)
+            self.documents.setdefault(value, []).append(data)
+        else:
+            self.others.append(data)
+
+    def search(self, term):
+        """
+        Returns the documents whose field contains term, by document id.
+
+        :param term: the value to search for.
+        """
+        found = [data for value in self.values.containing(term)
+                 for data in self.documents[value]]
+        found += [data for data in self.others
+                  if term in data[self.field]]
+        return sorted(found, key=lambda data: data.doc_id)
+
+
+def field_index(table, field):
+    """
+    Returns the FieldIndex of a field of a table, reading the table the first
+    time and kept current by the write functions below. See name_index for
+    writes made some other way.
+
+    :param table: a tinydb table.
+    :param field: the field to index.
+    """
+    indexes = _cached(FIELD_INDEXES, table)
+    if indexes is None:
+        indexes = {}
+        FIELD_INDEXES[table] = (_stamp(table), indexes)
+    if field not in indexes:
+        indexes[field] = FieldIndex(table.all(), field)
+    return indexes[field]
+
+
 def load_name_from_table(name, db, tablename, extra_searches=None):
     """
     Load data with specified 'name' from the specified 'db' table.
@@ -92,13 +308,241 @@ def load_name_from_table(name, db, tablename, extra_searches=None):
 
     :return: dict of data from database
     """
-    q = Query()
-    # get an object matching name from the db.
     dbtable = db.table(tablename)
-    data = dbtable.get(q.name == name)
+    if isinstance(dbtable, Table):
+        data = name_index(dbtable).get(_name_key(name))
+    else:
+        q = Query()
+        data = dbtable.get(q.name == name)
     if data is None:
         raise exceptions.DataNotFoundError(
             "'{name}' is not in the '{table}' table.".format(name=name,
                                                              table=tablename)
         )
     return data
+
+
+def name_index(table):
+    """
+    Returns the documents of a table by normalized name, read from the table
+    once and kept current by the write functions below. The first document
+    with a name wins, as with table.get. The documents are shared, don't
+    modify them.
+
+    Writes made some other way, by another TinyDB object or straight through
+    the table, are noticed when the database file's inode, modification time
+    or size changes, and the table is read again. A database that isn't kept
+    in a file can only be written through the functions below.
+
+    :param table: a tinydb table.
+    :return: dict of name -> document.
+    """
+    index = _cached(NAME_INDEXES, table)
+    if index is None:
+        stamp = _stamp(table)
+        index = {}
+        for data in table.all():
+            _index_document(index, data)
+        NAME_INDEXES[table] = (stamp, index)
+    return index
+
+
+def _name_key(name):
+    # lynames imports this module, so normalize_name can't be imported above
+    from .lynames import normalize_name
+    return normalize_name(name)
+
+
+def _index_document(index, data):
+    name = data.get('name')
+    if isinstance(name, str):
+        index.setdefault(_name_key(name), data)
+
+
+def _stamp(table):
+    """
+    Returns the (inode, modification time, size) of the file a table is
+    stored in, or None if it isn't stored in a file.
+
+    :param table: a tinydb table.
+    """
+    # tables read through a StorageProxy of the database's storage
+    storage = getattr(getattr(table, '_storage', None), '_storage', None)
+    if isinstance(storage, Middleware):
+        storage = storage.storage
+    path = getattr(storage, 'path', None)
+    if path is None:
+        # tinydb's JSONStorage keeps the file open instead
+        path = getattr(getattr(storage, '_handle', None), 'name', None)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(str(path))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _cached(indexes, table):
+    """The indexes of a table, unless its file changed since they were
+    made."""
+    entry = indexes.get(table)
+    if entry is not None and entry[0] == _stamp(table):
+        return entry[1]
+    indexes.pop(table, None)
+    return None
+
+
+def _index_new(table, before, documents):
+    """
+    Add newly inserted documents to the indexes of their table. Indexes that
+    weren't current before the insert are dropped instead.
+
+    :param table: a tinydb table.
+    :param before: the table's _stamp from before the insert.
+    :param documents: the inserted Documents.
+    """
+    stamp = _stamp(table)
+    for indexes in (NAME_INDEXES, FIELD_INDEXES):
+        entry = indexes.get(table)
+        if entry is None:
+            continue
+        if entry[0] != before:
+            del indexes[table]
+            continue
+        indexes[table] = (stamp, entry[1])
+    name_idx = NAME_INDEXES.get(table, (None, None))[1]
+    field_idxs = FIELD_INDEXES.get(table, (None, {}))[1]
+    for data in documents:
+        if name_idx is not None:
+            _index_document(name_idx, data)
+        for field_idx in field_idxs.values():
+            field_idx.add(data)
+
+
+def _forget(table):
+    """Drop the indexes of a table after documents in it changed."""
+    NAME_INDEXES.pop(table, None)
+    FIELD_INDEXES.pop(table, None)
+
+
+def insert(table, data):
+    """
+    Insert a document into a table.
+
+    :param table: a tinydb table.
+    :param data: dict to insert.
+    :return: the id of the new document.
+    """
+    before = _stamp(table)
+    doc_id = table.insert(data)
+    _index_new(table, before, [Document(dict(data), doc_id)])
+    return doc_id
+
+
+def insert_multiple(table, documents):
+    """
+    Insert several documents into a table at once.
+
+    :param table: a tinydb table.
+    :param documents: list of dicts to insert.
+    :return: list of the ids of the new documents.
+    """
+    before = _stamp(table)
+    doc_ids = table.insert_multiple(documents)
+    _index_new(table, before, [Document(dict(data), doc_id)
+                       for data, doc_id in zip(documents, doc_ids)])
+    return doc_ids
+
+
+def update(table, fields, cond=None, doc_ids=None):
+    """
+    Update documents in a table. See tinydb's Table.update.
+
+    :param table: a tinydb table.
+    :param fields: dict of fields to set.
+    :param cond: (optional) a tinydb query selecting the documents.
+    :param doc_ids: (optional) list of the ids of the documents.
+    """
+    result = table.update(fields, cond=cond, doc_ids=doc_ids)
+    _forget(table)
+    return result
+
+
+def upsert(table, data, cond):
+    """
+    Update the documents in a table matching cond, or insert data if there
+    are none.
+
+    :param table: a tinydb table.
+    :param data: dict to insert or update with.
+    :param cond: a tinydb query.
+    """
+    result = table.upsert(data, cond)
+    _forget(table)
+    return result
+
+
+def remove(table, cond=None, doc_ids=None):
+    """
+    Remove documents from a table. See tinydb's Table.remove.
+
+    :param table: a tinydb table.
+    :param cond: (optional) a tinydb query selecting the documents.
+    :param doc_ids: (optional) list of the ids of the documents.
+    """
+    result = table.remove(cond=cond, doc_ids=doc_ids)
+    _forget(table)
+    return result
+
+
+def load_name_match(db, kind, query, version):
+    """
+    Load a stored guess at the mutopia name for query.
+
+    :param db: a TinyDB object
+    :param kind: 'instrument' or 'composer'
+    :param query: the name that was matched.
+    :param version: the version of the mutopia list the match must be from.
+    :return: (match, score), or None if there is no match from that version.
+    """
+    q = Query()
+    data = db.table('name_matches').get(
+        (q.kind == kind) & (q.query == query) & (q.version == version))
+    if data is None:
+        return None
+    return data['match'], data['score']
+
+
+def save_name_match(db, kind, query, match, score, version):
+    """
+    Store a guess at the mutopia name for query, replacing an older one.
+
+    :param db: a TinyDB object
+    :param kind: 'instrument' or 'composer'
+    :param query: the name that was matched.
+    :param match: the mutopia name it was matched to.
+    :param score: the score of the match, out of 100.
+    :param version: the version of the mutopia list it was matched against.
+    """
+    q = Query()
+    upsert(db.table('name_matches'),
+           {'kind': kind, 'query': query, 'match': match, 'score': score,
+            'version': version},
+           (q.kind == kind) & (q.query == query))
+
+
+def prune_name_matches(db, versions):
+    """
+    Remove the stored guesses made against outdated mutopia lists.
+
+    :param db: a TinyDB object
+    :param versions: dict of kind -> the current version of its list.
+    :return: the number of guesses removed.
+    """
+    table = db.table('name_matches')
+    stale = [data.doc_id for data in table.all()
+             if data.get('version') != versions.get(data.get('kind'))]
+    if stale:
+        remove(table, doc_ids=stale)
+    return len(stale)
@@ -11,6 +11,11 @@ class MissingInstrumentError(KeyError):
     pass
 
 
+class InvalidRowError(ValueError):
+    """Raised when a row being imported doesn't fit its table."""
+    pass
+
+
 class MutopiaError(AttributeError):
     """Raised when a desired mutopia value is not in their lists."""
     pass
@@ -19,3 +24,18 @@ class MutopiaError(AttributeError):
 class InvalidClef(AttributeError):
     """Raised when an unsupported clef is entered."""
     pass
+
+
+class LilypondError(OSError):
+    """Raised when a lilypond installation can't be found or probed."""
+    pass
+
+
+class FetchError(OSError):
+    """Raised when a download fails or runs out of time."""
+    pass
+
+
+class OfflineError(FetchError):
+    """Raised when offline and the data isn't cached or bundled."""
+    pass
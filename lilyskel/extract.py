@@ -0,0 +1,164 @@
+"""
+Pull a few elements out of a web page without parsing all of it.
+
+The response is read in chunks and fed to an incremental parser that only
+keeps the markup of the wanted elements. Reading stops as soon as the last
+one is complete, and only those fragments are handed to BeautifulSoup.
+"""
+import codecs
+import re
+from collections import namedtuple
+from html import escape
+from html.parser import HTMLParser
+from lilyskel import fetch
+
+CHUNK_SIZE = 8192
+# the charset declared in a page's <meta> tags, which must be in the first
+# HEAD_SIZE bytes
+HEAD_SIZE = 1024
+META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([-\w.:]+)', re.I)
+
+# an element named tag whose attributes include attrs.
+Target = namedtuple('Target', ['tag', 'attrs'])
+
+
+def target(tag, attrs=None):
+    """
+    Describe an element to extract.
+
+    :param tag: the tag name, e.g. 'table'
+    :param attrs: (optional) dict of attributes the element must have.
+    """
+    return Target(tag, attrs or {})
+
+
+class Extractor(HTMLParser):
+    """Collects the markup of each target, in document order."""
+
+    def __init__(self, targets):
+        super().__init__(convert_charrefs=True)
+        self.targets = list(targets)
+        self.found = []
+        self.parts = None
+        self.depth = 0
+
+    @property
+    def done(self):
+        """True once every target has been collected."""
+        return len(self.found) == len(self.targets)
+
+    def _matches(self, tag, attrs):
+        curr = self.targets[len(self.found)]
+        return (tag == curr.tag
+                and all(attrs.get(key) == value
+                        for key, value in curr.attrs.items()))
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = dict(attrs)
+        if self.parts is None:
+            if not self._matches(tag, attrs):
+                return
+            self.parts = []
+        # only tags of the target's name are counted so that unclosed tags
+        # like <li> or <p> inside it can't throw off where it ends.
+        if tag == self.targets[len(self.found)].tag:
+            self.depth += 1
+        self.parts.append(self.get_starttag_text())
+
+    def handle_startendtag(self, tag, attrs):
+        if self.parts is not None:
+            self.parts.append(self.get_starttag_text())
+        else:
+            self.handle_starttag(tag, attrs)
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.parts is None:
+            return
+        self.parts.append('</{}>'.format(tag))
+        if tag == self.targets[len(self.found)].tag:
+            self.depth -= 1
+            if self.depth == 0:
+                self.found.append(''.join(self.parts))
+                self.parts = None
+
+    def handle_data(self, data):
+        if self.parts is not None:
+            self.parts.append(escape(data, quote=False))
+
+
+def from_chunks(chunks, targets):
+    """
+    Extract the targets from an iterable of text chunks.
+
+    :param chunks: iterable of str.
+    :param targets: list of Target.
+    :return: list with a BeautifulSoup fragment (or None if it wasn't found)
+        for each target.
+    """
+    from bs4 import BeautifulSoup
+    extractor = Extractor(targets)
+    for chunk in chunks:
+        extractor.feed(chunk)
+        if extractor.done:
+            break
+    fragments = extractor.found + [None] * (len(targets)
+                                            - len(extractor.found))
+    return [BeautifulSoup(fragment, 'html.parser') if fragment is not None
+            else None for fragment in fragments]
+
+
+def _encoding(response, head):
+    """
+    The encoding of a page: the charset in its Content-Type header, or else
+    in a <meta> tag, or else guessed from the start of the page. requests
+    reports ISO-8859-1 for any text without a charset, so its encoding is
+    only used when the header names one.
+    """
+    if 'charset' in response.headers.get('Content-Type', '').lower():
+        encoding = response.encoding
+    else:
+        meta = META_CHARSET.search(head)
+        if meta:
+            encoding = meta.group(1).decode('ascii')
+        else:
+            from requests.compat import chardet
+            encoding = chardet.detect(head)['encoding']
+    try:
+        encoding = codecs.lookup(encoding or 'utf-8').name
+    except LookupError:
+        return 'utf-8'
+    # an ascii start says nothing about the rest of the page
+    return 'utf-8' if encoding == 'ascii' else encoding
+
+
+def _decoded(response, chunk_size):
+    chunks = fetch.iter_content(response, chunk_size)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= HEAD_SIZE:
+            break
+    decoder = codecs.getincrementaldecoder(_encoding(response, head))(
+        errors='replace')
+    yield decoder.decode(head)
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def from_response(response, targets, chunk_size=CHUNK_SIZE):
+    """
+    Extract the targets from a (streamed) response, reading no further than
+    the end of the last one.
+
+    :param response: a requests response, preferably opened with stream=True.
+    :param targets: list of Target.
+    :return: see from_chunks.
+    """
+    try:
+        return from_chunks(_decoded(response, chunk_size), targets)
+    finally:
+        response.close()
@@ -0,0 +1,171 @@
+"""
+Shared HTTP client for everything lilyskel downloads.
+
+All requests go through one pooled requests.Session so connections to a host
+are reused. Every call is bounded: each attempt has a timeout, failed attempts
+are retried a limited number of times with exponential backoff, and the whole
+call gives up once its overall deadline has passed. A streamed body read
+with iter_content is held to the same deadline. Callers that have cached
+data should catch FetchError and fall back to it.
+
+In offline mode (`lilyskel --offline` or LILYSKEL_OFFLINE=1) no request is
+made at all and get raises OfflineError immediately.
+"""
+import os
+import threading
+import time
+from lilyskel import exceptions
+
+# seconds allowed for a single attempt (connect and each read)
+TIMEOUT = float(os.environ.get('LILYSKEL_HTTP_TIMEOUT', 10))
+# seconds allowed for a whole call including retries
+DEADLINE = float(os.environ.get('LILYSKEL_HTTP_DEADLINE', 30))
+RETRIES = 2
+BACKOFF = 0.5
+POOL_SIZE = 8
+
+# set by `lilyskel --offline`, see is_offline
+OFFLINE = False
+SESSION = None
+LOCK = threading.Lock()
+# hits are 304 Not Modified responses, misses are full downloads. fallbacks
+# are counted by the callers that use cached data after a failure.
+STATS = {'requests': 0, 'hits': 0, 'misses': 0, 'retries': 0, 'failures': 0,
+         'fallbacks': 0, 'latency': 0.0, 'max_latency': 0.0}
+
+
+def is_offline():
+    """True if lilyskel must not use the network."""
+    return OFFLINE or os.environ.get('LILYSKEL_OFFLINE', '') not in ('', '0')
+
+
+def set_offline(offline=True):
+    """Switch offline mode on or off for this process."""
+    # pylint: disable=global-statement
+    global OFFLINE
+    OFFLINE = offline
+
+
+def get_session():
+    """Returns the shared session, creating it on first use."""
+    # pylint: disable=global-statement
+    global SESSION
+    with LOCK:
+        if SESSION is None:
+            import requests
+            SESSION = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            SESSION.mount('http://', adapter)
+            SESSION.mount('https://', adapter)
+        return SESSION
+
+
+def count(name, value=1):
+    """Add value to one of the counters in STATS."""
+    with LOCK:
+        STATS[name] += value
+
+
+def stats():
+    """Returns a copy of the counters with the mean latency added."""
+    with LOCK:
+        current = dict(STATS)
+    current['mean_latency'] = (current['latency'] / current['requests']
+                               if current['requests'] else 0.0)
+    return current
+
+
+def _record(start):
+    latency = time.monotonic() - start
+    with LOCK:
+        STATS['requests'] += 1
+        STATS['latency'] += latency
+        STATS['max_latency'] = max(STATS['max_latency'], latency)
+
+
+def get(url, headers=None, timeout=None, deadline=None, stream=False):
+    """
+    GET a url with bounded retries.
+
+    :param url: the url to get.
+    :param headers: (optional) request headers.
+    :param timeout: (optional) seconds allowed per attempt. (default TIMEOUT)
+    :param deadline: (optional) seconds allowed for the whole call, including
+        retries. (default DEADLINE)
+    :param stream: (optional) don't download the body up front. Read it with
+        iter_content so that the deadline still applies.
+    :return: the response. A 304 Not Modified is returned, not raised.
+    :raises FetchError: if no successful response arrived before the
+        deadline or after RETRIES retries, or the server refused the request.
+    :raises OfflineError: in offline mode.
+    """
+    import requests
+    if is_offline():
+        count('failures')
+        raise exceptions.OfflineError(
+            'lilyskel is offline and {url} is not cached. Run without '
+            '--offline or unset LILYSKEL_OFFLINE to download it.'.format(
+                url=url))
+    timeout = TIMEOUT if timeout is None else timeout
+    give_up = time.monotonic() + (DEADLINE if deadline is None else deadline)
+    session = get_session()
+    response, error = None, 'deadline passed'
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            count('retries')
+            # back off before the next attempt, but not past the deadline.
+            time.sleep(max(0, min(BACKOFF * 2 ** (attempt - 1),
+                                  give_up - time.monotonic())))
+        remaining = give_up - time.monotonic()
+        if remaining <= 0:
+            break
+        start = time.monotonic()
+        try:
+            response = session.get(url, headers=headers,
+                                   timeout=min(timeout, remaining),
+                                   stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            error = err
+            continue
+        finally:
+            _record(start)
+        if response.status_code < 500:
+            break
+        # give the streamed connection back to the pool.
+        response.close()
+        response, error = None, 'server error'
+    if response is None:
+        count('failures')
+        raise exceptions.FetchError('Could not get {url}: {error}'.format(
+            url=url, error=error))
+    if response.status_code >= 400:
+        response.close()
+        count('failures')
+        raise exceptions.FetchError('Could not get {url}: {status}'.format(
+            url=url, status=response.status_code))
+    count('hits' if response.status_code == 304 else 'misses')
+    # what is left of the deadline is for reading the body, see iter_content
+    response.deadline = give_up
+    return response
+
+
+def iter_content(response, chunk_size):
+    """
+    Yield the body of a streamed response from get in chunks, until the
+    deadline of that get call passes. Each read may still take up to the
+    attempt's timeout.
+
+    :param response: a response returned by get.
+    :param chunk_size: the number of bytes to read at a time.
+    :raises FetchError: if the deadline passes before the end of the body.
+    """
+    give_up = getattr(response, 'deadline', None)
+    for chunk in response.iter_content(chunk_size):
+        if give_up is not None and time.monotonic() > give_up:
+            response.close()
+            count('failures')
+            raise exceptions.FetchError(
+                'Could not get {url}: deadline passed while reading'.format(
+                    url=getattr(response, 'url', 'the page')))
+        yield chunk
@@ -0,0 +1,361 @@
+"""
+Fuzzy string scoring, compatible with fuzzywuzzy's WRatio.
+
+The scores are built on the indel similarity of two strings (twice their
+longest common subsequence over their total length), which is what
+fuzzywuzzy computes with python-Levenshtein. The longest common subsequence
+is found bit-parallel: the positions of each character of one string are
+kept as bit masks, so each character of the other string costs a few integer
+operations instead of a row of a dynamic programming table.
+
+Choices are processed (cleaned, tokenized, sorted) once when a Choices is
+made, not on every query, and a choice that can't beat the best score so far
+or the cutoff is skipped before it is scored.
+"""
+import heapq
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# fuzzywuzzy's force_ascii only drops these
+_LATIN1 = {code: None for code in range(128, 256)}
+_NON_WORD = re.compile(r'(?ui)\W')
+
+UNBASE_SCALE = .95
+PARTIAL_SCALE = .90
+
+
+def full_process(text):
+    """
+    Clean a string for scoring like fuzzywuzzy's full_process with
+    force_ascii: drop latin-1 letters, turn everything but letters and digits
+    into spaces, lowercase and strip.
+
+    :param text: a string.
+    """
+    return _NON_WORD.sub(' ', text.translate(_LATIN1)).lower().strip()
+
+
+@lru_cache(maxsize=4096)
+def _masks(text):
+    """Returns character -> bit mask of its positions in text."""
+    masks = {}
+    for pos, char in enumerate(text):
+        masks[char] = masks.get(char, 0) | 1 << pos
+    return masks
+
+
+def lcs_length(first, second, masks=None):
+    """
+    Returns the length of the longest common subsequence of two strings.
+
+    :param first: a string.
+    :param second: a string.
+    :param masks: (optional) _masks(first), if it is already known.
+    """
+    if masks is None:
+        masks = _masks(first)
+    full = (1 << len(first)) - 1
+    row = full
+    for char in second:
+        matches = row & masks.get(char, 0)
+        row = ((row + matches) | (row - matches)) & full
+    return len(first) - bin(row).count('1')
+
+
+def _ratio(first, second, masks=None):
+    """Indel similarity out of 1, without fuzzywuzzy's special cases."""
+    total = len(first) + len(second)
+    return 2 * lcs_length(first, second, masks) / total if total else 0
+
+
+def ratio(first, second):
+    """
+    Returns the indel similarity of two processed strings, out of 100.
+
+    :param first: a string.
+    :param second: a string.
+    """
+    if first == second:
+        return 100
+    if not first or not second:
+        return 0
+    return int(round(100 * _ratio(first, second)))
+
+
+def _levenshtein_deltas(first, second):
+    """
+    Runs the bit-parallel Levenshtein distance of Myers and Hyyrö over two
+    strings. D is the distance table, with a row per character of first and a
+    column per character of second. The return value has one
+    (VP, VN, HP, HN) tuple of bit vectors per column. Bit i - 1 of VP or VN
+    is set where D[i][j] - D[i - 1][j] is +1 or -1. Bit i - 1 of HP or HN is
+    set where D[i][j] - D[i][j - 1] is +1 or -1.
+    """
+    masks = _masks(first)
+    full = (1 << len(first)) - 1
+    vp, vn = full, 0
+    deltas = []
+    for char in second:
+        match = masks.get(char, 0) | vn
+        diagonal = (((match & vp) + vp) ^ vp) | match
+        hp = (vn | ~(diagonal | vp)) & full
+        hn = vp & diagonal
+        shifted_hp = (hp << 1 | 1) & full
+        shifted_hn = (hn << 1) & full
+        vp = (shifted_hn | ~(diagonal | shifted_hp)) & full
+        vn = shifted_hp & diagonal
+        deltas.append((vp, vn, hp, hn))
+    return deltas
+
+
+def matching_blocks(first, second):
+    """
+    Returns the (first_pos, second_pos, length) runs that a minimal
+    Levenshtein alignment of two strings keeps unchanged, ending with
+    (len(first), len(second), 0). The alignment is the one python-Levenshtein
+    picks: common prefix and suffix kept, and in between, walking back from
+    the end, a deletion from first is preferred over a substitution, then an
+    insertion, and a match comes last.
+
+    :param first: a string.
+    :param second: a string.
+    """
+    prefix = 0
+    while (prefix < min(len(first), len(second))
+           and first[prefix] == second[prefix]):
+        prefix += 1
+    suffix = 0
+    while (suffix < min(len(first), len(second)) - prefix
+           and first[-1 - suffix] == second[-1 - suffix]):
+        suffix += 1
+    middle1 = first[prefix:len(first) - suffix]
+    middle2 = second[prefix:len(second) - suffix]
+    deltas = _levenshtein_deltas(middle1, middle2)
+
+    def down(row, col):
+        """D[row][col] - D[row - 1][col]"""
+        if not col:
+            return 1
+        vp, vn, _, _ = deltas[col - 1]
+        return (vp >> row - 1 & 1) - (vn >> row - 1 & 1)
+
+    def across(row, col):
+        """D[row][col] - D[row][col - 1]"""
+        if not row:
+            return 1
+        _, _, hp, hn = deltas[col - 1]
+        return (hp >> row - 1 & 1) - (hn >> row - 1 & 1)
+
+    # the kept positions are collected from the end backwards
+    kept = [(pos + len(first) - suffix, pos + len(second) - suffix)
+            for pos in reversed(range(suffix))]
+    row, col = len(middle1), len(middle2)
+    while row or col:
+        if row and down(row, col) == 1:
+            row -= 1
+        elif (row and col and middle1[row - 1] != middle2[col - 1]
+              and down(row, col) + across(row - 1, col) == 1):
+            row, col = row - 1, col - 1
+        elif col and across(row, col) == 1:
+            col -= 1
+        else:
+            row, col = row - 1, col - 1
+            kept.append((row + prefix, col + prefix))
+    kept.extend((pos, pos) for pos in reversed(range(prefix)))
+    blocks = []
+    for pos1, pos2 in reversed(kept):
+        if blocks and blocks[-1][0] + blocks[-1][2] == pos1 \
+                and blocks[-1][1] + blocks[-1][2] == pos2:
+            blocks[-1][2] += 1
+        else:
+            blocks.append([pos1, pos2, 1])
+    return [tuple(block) for block in blocks] + [(len(first), len(second),
+                                                  0)]
+
+
+def partial_ratio(first, second):
+    """
+    Returns how well the shorter string matches the substring of the longer
+    one it lines up with, out of 100. Like fuzzywuzzy, only the alignments
+    of the matching blocks are tried.
+
+    :param first: a string.
+    :param second: a string.
+    """
+    if first == second:
+        return 100
+    if not first or not second:
+        return 0
+    shorter, longer = sorted([first, second], key=len)
+    masks = _masks(shorter)
+    best = 0
+    for pos1, pos2, _ in matching_blocks(shorter, longer):
+        start = max(0, pos2 - pos1)
+        score = _ratio(shorter, longer[start:start + len(shorter)], masks)
+        if score > .995:
+            return 100
+        best = max(best, score)
+    return int(round(100 * best))
+
+
+def _partial_bound(first, second):
+    """
+    The highest partial_ratio two strings could get: no window can share
+    more with the shorter string than the whole longer string does.
+    """
+    if first == second:
+        return 100
+    shorter, longer = sorted([first, second], key=len)
+    if not shorter:
+        return 0
+    common = lcs_length(shorter, longer)
+    return int(round(200 * common / (len(shorter) + common)))
+
+
+# a string cleaned for scoring, with its tokens sorted and as a set
+Prepared = namedtuple('Prepared', ['text', 'sorted', 'tokens'])
+
+
+def prepare(text):
+    """
+    Clean a string and split it into tokens, once, for scoring.
+
+    :param text: a string.
+    """
+    text = full_process(text)
+    tokens = text.split()
+    return Prepared(text, ' '.join(sorted(tokens)), frozenset(tokens))
+
+
+def _token_pairs(first, second):
+    """The strings fuzzywuzzy's token set comparison scores against each
+    other."""
+    common = ' '.join(sorted(first.tokens & second.tokens))
+    only1 = (common + ' ' + ' '.join(sorted(first.tokens - second.tokens)))
+    only2 = (common + ' ' + ' '.join(sorted(second.tokens - first.tokens)))
+    only1, only2 = only1.strip(), only2.strip()
+    return [(common, only1), (common, only2), (only1, only2)]
+
+
+def _wratio(first, second, floor=0):
+    """
+    wratio of two Prepared strings. Parts of the score that can't raise it
+    above floor are skipped, so a result at or below floor may be too low.
+    """
+    if not first.text or not second.text:
+        return 0
+    best = ratio(first.text, second.text)
+    length_ratio = max(len(first.text), len(second.text)) / min(
+        len(first.text), len(second.text))
+    if length_ratio < 1.5:
+        # the token scores are scaled down, so they can't beat this.
+        if max(best, floor) >= 100 * UNBASE_SCALE:
+            return best
+        pairs = [(first.sorted, second.sorted)]
+        if first.text != second.text:
+            pairs += _token_pairs(first, second)
+        return int(round(max([best] + [ratio(*pair) * UNBASE_SCALE
+                                        for pair in pairs])))
+    scale = .6 if length_ratio > 8 else PARTIAL_SCALE
+    pairs = [((first.text, second.text), scale),
+             ((first.sorted, second.sorted), UNBASE_SCALE * scale)]
+    pairs += [(pair, UNBASE_SCALE * scale)
+              for pair in _token_pairs(first, second)]
+    scores = {}
+    for pair, weight in pairs:
+        if pair not in scores:
+            if _partial_bound(*pair) * weight <= max(best, floor):
+                continue
+            scores[pair] = partial_ratio(*pair)
+        best = max(best, scores[pair] * weight)
+    return int(round(best))
+
+
+def wratio(first, second):
+    """
+    Returns fuzzywuzzy's weighted ratio of two strings, out of 100: the best
+    of the plain, token sort and token set similarities, using partial
+    matches when one string is much longer than the other.
+
+    :param first: a string.
+    :param second: a string.
+    """
+    return _wratio(prepare(first), prepare(second))
+
+
+class Choices:
+    """
+    A list of choices, prepared once for scoring against many queries.
+
+    :param choices: iterable of strings.
+    :param prepared: (optional) list of the choices already prepared.
+    """
+
+    def __init__(self, choices, prepared=None):
+        self.choices = list(choices)
+        if prepared is None:
+            prepared = [prepare(choice) for choice in self.choices]
+        self.prepared = prepared
+
+    def __len__(self):
+        return len(self.choices)
+
+    def scores(self, query, score_cutoff=0):
+        """
+        Yield (choice, score) for every choice scoring at least score_cutoff,
+        in order.
+
+        :param query: the string to match.
+        :param score_cutoff: (optional) the lowest score to yield.
+        """
+        query = prepare(query)
+        # anything rounding to less than the cutoff needn't be exact
+        floor = score_cutoff - .5 - 1e-9
+        for choice, prepared in zip(self.choices, self.prepared):
+            score = _wratio(query, prepared, floor)
+            if score >= score_cutoff:
+                yield choice, score
+
+
+def _choices(choices):
+    return choices if isinstance(choices, Choices) else Choices(choices)
+
+
+def extract_one(query, choices, score_cutoff=0):
+    """
+    Returns the (choice, score) that matches query best, the first one if
+    several score the same, or None if none scores at least score_cutoff.
+    Chooses like fuzzywuzzy.process.extractOne.
+
+    :param query: the string to match.
+    :param choices: a Choices or an iterable of strings.
+    :param score_cutoff: (optional) the lowest acceptable score.
+    """
+    choices = _choices(choices)
+    query = prepare(query)
+    best = None
+    for choice, prepared in zip(choices.choices, choices.prepared):
+        # a later choice has to beat the best so far to replace it
+        needed = score_cutoff if best is None else best[1] + 1
+        score = _wratio(query, prepared, needed - .5 - 1e-9)
+        if score >= needed:
+            best = choice, score
+            if score == 100:
+                break
+    return best
+
+
+def extract(query, choices, limit=5, score_cutoff=0):
+    """
+    Returns the limit best (choice, score) for query, best first.
+
+    :param query: the string to match.
+    :param choices: a Choices or an iterable of strings.
+    :param limit: (optional) how many to return, None for all.
+    :param score_cutoff: (optional) the lowest acceptable score.
+    """
+    scores = _choices(choices).scores(query, score_cutoff)
+    if limit is None:
+        return sorted(scores, key=lambda item: item[1], reverse=True)
+    return heapq.nlargest(limit, scores, key=lambda item: item[1])
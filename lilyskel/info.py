@@ -1,25 +1,25 @@
 """Classes for files and file info."""
-import itertools
 from collections import namedtuple
+from contextlib import contextmanager
 
-import bs4
+import hashlib
+import json
 import re
-import requests
-import subprocess
-from pathlib import Path
 import sys
 import attr
-from fuzzywuzzy import process
 from lilyskel.lynames import Instrument, Ensemble
 from lilyskel import mutopia
 from lilyskel import exceptions
+from lilyskel import fuzzy
 from lilyskel import db_interface
+from lilyskel import lyinstall
+from lilyskel import matching
+from lilyskel import pitches
 
 ENCODING = sys.stdout.encoding
 KeySignature = namedtuple('KeySignature', ['note', 'mode'])
 ALLOWED_NOTES = None
 ALLOWED_MODES = None
-LANGUAGES = None
 
 
 @attr.s
@@ -46,20 +46,34 @@ class Composer:
         self.shortname = sname
         return sname
 
-    def get_mutopia_name(self, guess=False):
+    def get_mutopia_name(self, guess=False, db=None):
         """
         Get the mutopia name for a composer.
         :param guess: if True, a guess will be made at the mutopia name of a
             composer.
+        :param db: (optional) a TinyDB object. A guess stored in it is used
+            instead of guessing again, and a new guess is stored.
         """
         if self.mutopianame is not None:
             return self.mutopianame
         elif guess:
-            mutopia_composers = mutopia.get_composers()
             namelist = self.name.split()
             lname = namelist.pop()
-            name, _ = process.extractOne(self.name, mutopia_composers)
-            if lname not in name:
+            match = None
+            if db is not None:
+                version = mutopia.list_version('composer')
+                match = db_interface.load_name_match(db, 'composer',
+                                                     self.name, version)
+            if match is None:
+                # only the closest few composers by shared trigrams are scored.
+                match = matching.best_match(self.name,
+                                            mutopia.composer_index())
+                if match is not None and db is not None:
+                    db_interface.save_name_match(db, 'composer', self.name,
+                                                 *match, version)
+            name = match[0] if match else ''
+            if lname not in name and name not in \
+                    mutopia.composer_index().lookup(self.name):
                 raise exceptions.MutopiaError("No matching composer found.")
             self.mutopianame = name
             return name
@@ -75,6 +89,19 @@ class Composer:
         :param db: a TinyDB instance
         """
         table = db.table('composers')
+        # spelling variants and names without diacritics are found by their
+        # keys, without searching the table.
+        index = matching.index_of(db_interface.explore_table(
+            table, search=('name', '')))
+        found = index.lookup(name)
+        if found:
+            if len(found) > 1:
+                found[0], _ = fuzzy.extract_one(name, index.choices(found))
+            data = db_interface.load_name_from_table(found[0], db=db,
+                                                     tablename='composers')
+            return cls(name=data['name'],
+                       mutopianame=data.get('mutopianame'),
+                       shortname=data.get('shortname'))
         name_parts = name.split(' ')
         lname = name_parts.pop()
         comps = db_interface.explore_table(table=table, search=('name', lname))
@@ -107,7 +134,7 @@ class Composer:
         """
         comp_table = db.table('composers')
         data = attr.asdict(self)
-        comp_table.insert(data)
+        db_interface.insert(comp_table, data)
 
     @classmethod
     def load(cls, datadict):
@@ -144,30 +171,40 @@ class Headers(object):
     mutopiaheaders = attr.ib(default=None)
 
     def add_mutopia_headers(self, mu_headers, guess_composer=False,
-                            instruments=None):
+                            instruments=None, db=None):
         """
         Add mutopia headers.
         :param mu_headers: a MutopiaHeaders object
         :param guess_composer: Whether to guess at the mutopiacomposer if not set.
+        :param db: (optional) a TinyDB object with stored guesses at mutopia
+            names.
 
         Note: This will overwrite the copyright to match the license.
         """
         # pylint: disable=no-member
         mu_headers.composer = self.composer.get_mutopia_name(
-            guess=guess_composer)
+            guess=guess_composer, db=db)
         # pylint: enable=no-member
         if instruments is None:
             instruments = mu_headers.instrument_list
 
+        # the instruments without a mutopia name are matched together.
+        unnamed = [instrument for instrument in instruments
+                   if instrument.mutopianame is None]
+        matches = mutopia.match_instruments(
+            (instrument.name for instrument in unnamed), db=db)
+        for instrument in unnamed:
+            instrument.mutopianame = matches[instrument.name]
+
         # converts list of instruments to mutopia friendly string
-        # instruments.sort()
         mutopia_instrument_names =\
             set([instrument.get_mutopia_name() for
              instrument in instruments])
         mutopia_names_list = list(mutopia_instrument_names)
         mutopia_names_list.sort()
-        instruments = ', '.join(mutopia_names_list)
-        mu_headers.instruments = instruments
+        mu_headers.instruments = ', '.join(mutopia_names_list)
+        mu_headers.fingerprint = mutopia_fingerprint(self.composer,
+                                                     instruments)
         self.copyright = mu_headers.license
         self.mutopiaheaders = mu_headers
 
@@ -186,8 +223,19 @@ class Headers(object):
         for key, value in datadict.items():
             setattr(newheaders, key, value)
         if mutopiaheaders:
-            newheaders.add_mutopia_headers(mutopiaheaders,
-                                           instruments=instruments)
+            if instruments is not None:
+                # the stored list is plain dicts, use the loaded instruments
+                mutopiaheaders.instrument_list = instruments
+            # the stored mutopia names are reused unless the composer or
+            # instruments they were resolved from have changed.
+            if (mutopiaheaders.fingerprint is not None
+                    and mutopiaheaders.fingerprint == mutopia_fingerprint(
+                        comp, instruments if instruments is not None
+                        else mutopiaheaders.instrument_list)):
+                newheaders.mutopiaheaders = mutopiaheaders
+            else:
+                newheaders.add_mutopia_headers(mutopiaheaders,
+                                               instruments=instruments)
         return newheaders
 
     def dump(self):
@@ -199,6 +247,19 @@ class Headers(object):
         return attr.asdict(self)
 
 
+def mutopia_fingerprint(composer, instruments):
+    """
+    Returns a fingerprint of what the mutopia composer and instruments headers
+    are computed from, to tell whether stored values are still current.
+    :param composer: a Composer
+    :param instruments: list of Instruments or their dumped dicts.
+    """
+    data = [composer.name, composer.mutopianame]
+    data.extend(ins if isinstance(ins, dict) else attr.asdict(ins)
+                for ins in instruments)
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
 def convert_ensemble(instruments):
     """Returns list of instruments for mutopia headers."""
     if isinstance(instruments, Ensemble):
@@ -227,6 +288,8 @@ class MutopiaHeaders:
     moreinfo = attr.ib(default=None)
     instruments = attr.ib(init=False,
                           validator=attr.validators.instance_of(str))
+    # see mutopia_fingerprint
+    fingerprint = attr.ib(init=False, default=None)
 
     @instrument_list.validator
     def validate_instruments(self, attribute, value):
@@ -247,7 +310,7 @@ class MutopiaHeaders:
     @composer.validator
     def _validate_composer(self, attribute, value):
         """Calls validate_mutopia with field 'mutopiacomposer'"""
-        mutopia.validate_mutopia(data=comp, field='mutopiacomposer')
+        mutopia.validate_mutopia(data=value, field='mutopiacomposer')
 
     @license.validator
     def _validate_license(self, attribute, value):
@@ -263,60 +326,45 @@ class MutopiaHeaders:
         return newclass
 
 
+@contextmanager
+def skip_validation():
+    """
+    Context manager that builds objects without running their validators,
+    for data that was already validated, like a saved config. Validators are
+    switched off for the whole process while it is active.
+    """
+    previous = attr.get_run_validators()
+    attr.set_run_validators(False)
+    try:
+        yield
+    finally:
+        attr.set_run_validators(previous)
+
+
 def convert_key(keyinfo):
     return KeySignature(keyinfo[0], keyinfo[1])
 
 
-def get_allowed_notes():
+def get_allowed_notes(language=None):
+    """
+    Returns the set of note names lilypond accepts.
+    :param language: (optional) only the names valid in this language.
+    """
     global ALLOWED_NOTES
+    if language is not None:
+        return pitches.language_notes(language)
     if ALLOWED_NOTES:
         return ALLOWED_NOTES
-    docpage = requests.get('http://lilypond.org/doc/v2.18/Documentation/notation/writing-pitches')
-    soup = bs4.BeautifulSoup(docpage.text, 'html.parser')
-    tables = soup.find_all('table')
-    note_name_table = None
-    for table in tables:
-        if "Note Names" in table.text:
-            note_name_table = table
-            break
-    note_name_p = note_name_table.find_all('p')
-    base_note_names = []
-    for item in note_name_p:
-        item_as_list = item.text.strip().split(' ')
-        if len(item_as_list) == 8:
-            base_note_names.extend(item_as_list)
-    base_note_names = list(set(base_note_names))
-    for table in tables:
-        if "sharp" in table.text:
-            curr_table = table
-            break
-    note_suffixes_p = curr_table.find_all('p')
-    note_suffixes_table = []
-    for item in note_suffixes_p:
-        if '-' in item.text:
-            # print('item found')
-            clean = item.text.strip().replace('-', '').split('/')
-            note_suffixes_table.extend(clean)
-    note_suffixes_table = list(set(note_suffixes_table))
-    note_suffixes_table.append('')
-    ALLOWED_NOTES = [pair[0] + pair[1] for pair in itertools.product(base_note_names, note_suffixes_table)]
+    ALLOWED_NOTES, _ = pitches.load()
     return ALLOWED_NOTES
 
 
 def get_allowed_modes():
+    """Returns the set of modes lilypond accepts."""
     global ALLOWED_MODES
     if ALLOWED_MODES:
         return ALLOWED_MODES
-    docpage2 = requests.get('http://lilypond.org/doc/v2.18/Documentation/notation/displaying-pitches')
-    soup = bs4.BeautifulSoup(docpage2.text, "html.parser")
-    all_ps = soup.find_all('p')
-    curr_p = None
-    for a_p in all_ps:
-        if 'mode' in a_p.text and 'key signature' in a_p.text:
-            curr_p = a_p
-            break
-    mode_ps = curr_p.find_all('code')
-    ALLOWED_MODES = [item.text.replace('\\', '') for item in mode_ps if '\\' in item.text]
+    _, ALLOWED_MODES = pitches.load()
     return ALLOWED_MODES
 
 
@@ -352,25 +400,15 @@ class Movement:
 
 
 def get_valid_languages():
-    global LANGUAGES
-    if LANGUAGES:
-        return LANGUAGES
-    langfile = Path('/usr', 'share', 'lilypond', get_vers(), 'scm',
-                    'define-note-names.scm')
-    with open(langfile, 'rb') as file_:
-        content = file_.read()
-    langs = re.findall(r'Language: ([^\s]*)', content.decode(ENCODING),
-                       re.M | re.I)
-    LANGUAGES = [lang.lower() for lang in langs]
-    return LANGUAGES
+    """Returns the note name languages of the selected lilypond, or the
+    bundled ones if its data directory wasn't found."""
+    return lyinstall.probe().languages or sorted(pitches.BUNDLED_LANGUAGES)
 
 
 def get_vers():
-    run_ly = subprocess.run(['lilypond', '--version'],
-                            stdout=subprocess.PIPE)
-    matchvers = re.search(r'LilyPond ([^\n]*)',
-                          run_ly.stdout.decode(ENCODING))
-    return matchvers.group(1)
+    """Returns the version of the selected lilypond."""
+    return lyinstall.probe().version
+
 
 @attr.s
 class Piece:
@@ -382,7 +420,7 @@ class Piece:
     instruments = attr.ib()
     language = attr.ib(default=None)
     opus = attr.ib(default=None)
-    movements = attr.ib(default=[Movement(num=1)])
+    movements = attr.ib(default=attr.Factory(lambda: [Movement(num=1)]))
 
     @version.validator
     def validate_version(self, _attribute, value):
@@ -400,7 +438,7 @@ class Piece:
             return
         if value.lower() not in get_valid_languages():
             raise AttributeError("Language is not valid. Must be one of "
-                                 "{}".format(', '.join(languages)))
+                                 "{}".format(', '.join(get_valid_languages())))
 
     @movements.validator
     def movements_validator(self, _attribute, value):
@@ -411,6 +449,13 @@ class Piece:
             raise err
         if not isinstance(value[0], Movement):
             raise err
+        notes = get_allowed_notes(self.language)
+        for mov in value:
+            if mov.key.note not in notes:
+                raise AttributeError(
+                    "The key of movement {num}, {note}, is not a note name "
+                    "in {lang}.".format(num=mov.num, note=mov.key.note,
+                                        lang=self.language))
 
     @instruments.validator
     def validate_instrument_list(self, _attribute, value):
@@ -443,9 +488,29 @@ class Piece:
             "movements": [mov.dump() for mov in self.movements]
         }
 
+    def validate(self):
+        """
+        Run the validators of the piece and everything in it. Needed after
+        loading with trusted=True to check the data after all.
+        """
+        parts = [self.headers, self.headers.composer,
+                 self.headers.mutopiaheaders, self]
+        if isinstance(self.instruments, list):
+            parts.extend(self.instruments)
+        parts.extend(self.movements)
+        for part in parts:
+            if part is not None:
+                attr.validate(part)
+
     @classmethod
-    def load(cls, datadict):
-        """Load class from dict."""
+    def load(cls, datadict, trusted=False):
+        """
+        Load class from dict.
+        :param trusted: if True, skip the validators. (see skip_validation)
+        """
+        if trusted:
+            with skip_validation():
+                return cls.load(datadict)
         instruments = [Instrument.load(ins)
                        for ins in datadict.pop('instruments')]
         return cls(
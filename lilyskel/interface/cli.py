@@ -1,23 +1,42 @@
+"""
+Command line entry point.
+
+Only click and the standard library are imported at module level. Each command
+imports what it needs when it runs so that `lilyskel --help` and `lilyskel
+build` don't pay for prompt_toolkit, requests, bs4, etc.
+"""
 import shutil
 from pathlib import Path
 import click
 import tempfile
-from prompt_toolkit import prompt
-from prompt_toolkit.completion import PathCompleter
 import os
 
-from lilyskel import yaml_interface, db_interface, info, lynames, render
-from lilyskel.interface.common import YNValidator, answered_yes
-from lilyskel.interface.edit_prompts import edit_prompt
 from .update_db_manually import db
 
 TEMP = tempfile.gettempdir()
 PATHSAVE = Path(TEMP, "lilyskel_path")
 
 
+def prompt(*args, **kwargs):
+    """Wrapper that imports prompt_toolkit only when a prompt is shown."""
+    from prompt_toolkit import prompt as pt_prompt
+    return pt_prompt(*args, **kwargs)
+
+
 @click.group()
-def cli():
-    pass
+@click.option("--lilypond", "lilypond_bin", required=False, default=None,
+              help="lilypond binary to use when several versions are "
+                   "installed.")
+@click.option("--offline", is_flag=True, default=False,
+              help="Don't use the network, only cached and bundled data. "
+                   "Can also be set with LILYSKEL_OFFLINE=1.")
+def cli(lilypond_bin, offline):
+    if lilypond_bin:
+        from lilyskel import lyinstall
+        lyinstall.select(lilypond_bin)
+    if offline:
+        from lilyskel import fetch
+        fetch.set_offline()
 
 
 @cli.command()
@@ -28,6 +47,7 @@ def cli():
         "path to new directory, defaults to current working directory."))
 def init(filename, path):
     """Create the configuration file and set the directory"""
+    from lilyskel.interface.common import YNValidator
     if ".yaml" not in filename:
         filename = filename + ".yaml"
     filepath = Path(path, filename)
@@ -49,6 +69,10 @@ def init(filename, path):
               help="Path to tinydb.")
 def edit(file_path, db_path):
     """Create and edit piece information"""
+    from prompt_toolkit.completion import PathCompleter
+    from lilyskel import yaml_interface, db_interface
+    from lilyskel.interface.common import YNValidator
+    from lilyskel.interface.edit_prompts import edit_prompt
     if not file_path:
         try:
             with open(PATHSAVE, "r") as savepath:
@@ -60,6 +84,8 @@ def edit(file_path, db_path):
         piece = yaml_interface.read_config(Path(file_path))
         print('loaded piece')
         print(piece)
+        from lilyskel import catalog
+        catalog.warn_duplicates(piece)
     except (ValueError, FileNotFoundError, AttributeError):
         piece = None
     db = db_interface.init_db(db_path)
@@ -83,7 +109,11 @@ def edit(file_path, db_path):
 @click.option("--key-in-partname", is_flag=True, default=False, help="Include keys in names of parts.")
 @click.option("--compress-full-bar-rests", is_flag=True, default=False,
               help="Set compress_full_bar_rests in part files.")
-def build(file_path, target_dir, extra_includes, key_in_partname, compress_full_bar_rests):
+@click.option("--no-validate", is_flag=True, default=False,
+              help="Trust the config file and skip validating it.")
+def build(file_path, target_dir, extra_includes, key_in_partname, compress_full_bar_rests, no_validate):
+    """Build the file skeleton from a config file"""
+    from lilyskel import yaml_interface, render
     target_dir = Path(target_dir)
     if not file_path:
         possible_configs = [possible for possible in os.listdir(target_dir)
@@ -93,26 +123,136 @@ def build(file_path, target_dir, extra_includes, key_in_partname, compress_full_
             raise SystemExit(1)
         elif len(possible_configs) == 1:
             print(f"Config file found: {possible_configs[0]}")
+            from lilyskel.interface.common import YNValidator, answered_yes
             use = prompt("Use this config? ", default='Y', validator=YNValidator())
             if answered_yes(use):
                 file_path = possible_configs[0]
             else:
                 print("Please specify a config file with -f or change to the directory it is in.")
                 raise SystemExit(1)
-    piece = yaml_interface.read_config(Path(file_path))
+    piece = yaml_interface.read_config(Path(file_path), trusted=no_validate)
+    from lilyskel import catalog
+    catalog.warn_duplicates(piece)
     # piece = info.Piece.load(config_data)
-    lyglobal = lynames.LyName('global')
-    include_paths = []
     flags = {"key_in_partname": key_in_partname, "compress_full_bar_rests": compress_full_bar_rests}
-    global_file = render.make_global(lyglobal, piece, location=target_dir)
-    include_paths.extend(global_file)
-    for instrument in piece.instruments:
-        new_includes = render.make_instrument(instrument=instrument, lyglobal=lyglobal,
-                                              piece=piece, location=target_dir, flags=flags)
-        include_paths.extend(new_includes)
-    render.render_includes(include_paths, piece, extra_includes=extra_includes, location=target_dir)
-    render.render_defs(piece, location=target_dir)
-    render.render_score(piece, piece.instruments, lyglobal, path_prefix=Path('.'))
+    render.render_all(piece, location=target_dir, flags=flags, extra_includes=extra_includes)
+
+
+@cli.group()
+@click.option("-j", "--workers", type=int, default=None,
+              help="Number of worker processes, defaults to the number of CPUs.")
+@click.pass_context
+def batch(ctx, workers):
+    """Build or compile many pieces in parallel"""
+    ctx.obj = {"workers": workers}
+
+
+def _report(results):
+    """Print batch results and exit non-zero if anything failed."""
+    failed = [(path, err) for path, err in results if err is not None]
+    for path, err in failed:
+        print(f"{path} failed:\n{err}")
+    print(f"{len(results) - len(failed)} succeeded, {len(failed)} failed.")
+    if failed:
+        raise SystemExit(1)
+
+
+@batch.command("build")
+@click.argument("configs", nargs=-1, required=True)
+@click.option("-t", "--target-root", required=False, default=None,
+              help="Build each piece in a directory named after its config "
+                   "file here. Defaults to the config file's directory.")
+@click.option("--key-in-partname", is_flag=True, default=False, help="Include keys in names of parts.")
+@click.option("--compress-full-bar-rests", is_flag=True, default=False,
+              help="Set compress_full_bar_rests in part files.")
+@click.option("--no-validate", is_flag=True, default=False,
+              help="Trust the config files and skip validating them.")
+@click.pass_context
+def batch_build(ctx, configs, target_root, key_in_partname, compress_full_bar_rests, no_validate):
+    """Build the file skeletons for several config files"""
+    from lilyskel import batch as batch_
+    flags = {"key_in_partname": key_in_partname, "compress_full_bar_rests": compress_full_bar_rests}
+    _report(batch_.build_all(configs, target_root=target_root,
+                             workers=ctx.obj["workers"], flags=flags,
+                             trusted=no_validate))
+
+
+@batch.command("compile")
+@click.argument("lyfiles", nargs=-1, required=True)
+@click.pass_context
+def batch_compile(ctx, lyfiles):
+    """Run lilypond on several files"""
+    from lilyskel import batch as batch_
+    _report(batch_.compile_all(lyfiles, workers=ctx.obj["workers"]))
+
+
+@cli.group()
+def lilypond():
+    """Inspect installed lilypond versions"""
+    pass
+
+
+@lilypond.command("list")
+def list_lilyponds():
+    """List lilypond installations found on PATH"""
+    from lilyskel import lyinstall, exceptions
+    try:
+        current = lyinstall.find_binary()
+    except exceptions.LilypondError:
+        current = None
+    for binary in lyinstall.find_binaries():
+        try:
+            installation = lyinstall.probe(binary)
+        except exceptions.LilypondError as err:
+            print(f"  {binary}: {err}")
+            continue
+        marker = '*' if binary == current else ' '
+        print(f"{marker} {installation.version}\t{binary}\t"
+              f"{installation.datadir or 'no data directory found'}")
+
+
+@lilypond.command()
+def refresh():
+    """Regenerate the note and mode tables from the lilypond docs"""
+    from lilyskel import pitches
+    notes, modes = pitches.refresh()
+    print(f"Cached {len(notes)} note names and {len(modes)} modes.")
+
+
+@cli.group()
+def mutopia():
+    """Manage the cached mutopia vocabularies"""
+    pass
+
+
+@mutopia.command("refresh")
+@click.option("--force", is_flag=True, default=False,
+              help="Download the pages even if they haven't changed.")
+@click.option("-d", "--db-path", required=False, default=None,
+              help="Path to tinydb.")
+def refresh_mutopia(force, db_path):
+    """Revalidate the cached licenses, styles, composers and instruments"""
+    from lilyskel import mutopia as mutopia_
+    from lilyskel import db_interface
+    mutopia_.refresh(force=force)
+    print(f"{len(mutopia_.get_licenses())} licenses, "
+          f"{len(mutopia_.get_styles())} styles, "
+          f"{len(mutopia_.get_composers())} composers and "
+          f"{len(mutopia_.get_instruments())} instruments cached.")
+    if Path(db_path or db_interface.def_path).exists():
+        removed = mutopia_.prune_matches(db_interface.init_db(db_path))
+        if removed:
+            print(f"Removed {removed} outdated name guesses.")
+
+
+@mutopia.command("index")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+def index_mutopia(directory):
+    """Index a dump of the mutopia catalog (rdf or html files) to warn about
+    pieces that are already there"""
+    from lilyskel import catalog
+    count = catalog.build_index(directory)
+    print(f"Indexed {count} pieces.")
 
 
 # adding commands from other files
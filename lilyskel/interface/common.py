@@ -27,6 +27,24 @@ class InsensitiveCompleter(Completer):
                 yield Completion(word, start_position=start)
 
 
+class PrefixCompleter(Completer):
+    """
+    Complete the word being typed from a vocabulary, ignoring case. Every
+    prefix is indexed up front, so each keystroke is a single lookup.
+    """
+    def __init__(self, word_list):
+        self._index = {}
+        for word in dict.fromkeys(word_list):
+            lower = word.lower()
+            for end in range(len(lower) + 1):
+                self._index.setdefault(lower[:end], []).append(word)
+
+    def get_completions(self, document, complete_event):
+        current = document.text.split(' ')[-1]
+        for word in self._index.get(current.lower(), ()):
+            yield Completion(word, start_position=-len(current))
+
+
 class YNValidator(Validator):
     """Validates Yes/No responses in prompt_toolkit"""
     def validate(self, document):
@@ -183,6 +201,20 @@ def create_ensemble(name, db, instruments_to_add=[]):
     return new_ens
 
 
+class IsNumberValidator(Validator):
+    """Validates that a response is empty or an integer."""
+    def validate(self, document):
+        text = document.text
+        if not text:
+            return
+        if not text.isdigit():
+            raise ValidationError(message="Must be integer")
+        try:
+            int(text)
+        except ValueError as err:
+            raise ValidationError(message=err)
+
+
 class IndexValidator(Validator):
     """Validates indexes of lists."""
     def __init__(self, max_len, allow_empty=True):
@@ -1,17 +1,44 @@
-import bs4
 import os
-import requests
+import threading
+from pathlib import Path
 from prompt_toolkit import prompt
 from prompt_toolkit.completion import WordCompleter
 from prompt_toolkit.validation import Validator, ValidationError
 from titlecase import titlecase
 
-from lilyskel import info, yaml_interface, db_interface, mutopia, exceptions, lynames
+from lilyskel import info, yaml_interface, db_interface, mutopia, exceptions, lynames, matching, catalog
 from lilyskel.interface import common
-from lilyskel.interface.common import YNValidator, InsensitiveCompleter, IndexValidator, create_instrument, \
-    instruments_with_indexes, reorder_instruments, answered_yes, INVALID, BOLD, END
+from lilyskel.interface.common import YNValidator, InsensitiveCompleter, PrefixCompleter, IndexValidator, \
+    create_instrument, instruments_with_indexes, reorder_instruments, answered_yes, INVALID, BOLD, END
 
 TEMPO_WORDS = []
+# tempo words shipped with lilyskel, one per line
+TEMPO_WORDS_FILE = Path(Path(__file__).parents[1], 'tempowords.dat')
+
+
+def prefetch():
+    """
+    Start loading the remote vocabularies the prompts use in background
+    threads, so they are ready (or in flight) by the time a prompt needs them.
+    The getters are safe to call while a prefetch is running; they wait for
+    it instead of downloading again.
+
+    :return: the started threads.
+    """
+    def quietly(getter):
+        # failures are ignored here, the prompt will try again and report it.
+        try:
+            getter()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    threads = []
+    for getter in (mutopia.get_licenses, mutopia.get_instruments,
+                   info.get_allowed_notes, info.get_allowed_modes):
+        thread = threading.Thread(target=quietly, args=(getter,), daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
 
 
 def edit_prompt(piece, config_path, db, path_save):
@@ -21,6 +48,7 @@ def edit_prompt(piece, config_path, db, path_save):
     :param config_path: The path to the configuration file being worked on.
     :return:
     """
+    prefetch()
     prompt_help = (
         "\nYou can now add score information. Available modes are:\n"
         f"{BOLD}header:{END}\t\tadd title, composer, etc.\n"
@@ -67,7 +95,7 @@ def edit_prompt(piece, config_path, db, path_save):
             save = prompt("Save file before exiting? ", default='Y', validator=YNValidator())
             if answered_yes(save):
                 print('Saving File')
-                save_config(infodict, config_path)
+                save_config(infodict, config_path, db)
             try:
                 os.remove(path_save)
             except FileNotFoundError:
@@ -75,7 +103,7 @@ def edit_prompt(piece, config_path, db, path_save):
             print("Exiting")
             raise SystemExit(0)
         elif command.lower().strip() == "save":
-            save_config(infodict, config_path)
+            save_config(infodict, config_path, db)
             print("Saved")
         elif command.lower().strip() == "help":
             print(prompt_help)
@@ -94,7 +122,9 @@ def edit_prompt(piece, config_path, db, path_save):
         elif command.lower()[0:2] == 'mo':
             if "movements" not in infodict:
                 infodict["movements"] = []
-            infodict["movements"] = movement_prompt(infodict["movements"])
+            infodict["movements"] = movement_prompt(infodict["movements"],
+                                                    infodict.get("language"),
+                                                    db=db)
         elif command.lower()[0:2] == 'mu':
             if "mutopia_headers" not in infodict:
                 infodict["mutopia_headers"] = None
@@ -109,10 +139,11 @@ def edit_prompt(piece, config_path, db, path_save):
             print(INVALID)
 
 
-def save_config(infodict, config_path):
+def save_config(infodict, config_path, db=None):
     if 'mutopia_headers' in infodict:
         infodict['headers'].add_mutopia_headers(infodict['mutopia_headers'],
-                                                instruments=infodict['instruments'])
+                                                instruments=infodict['instruments'],
+                                                db=db)
     new_piece = info.Piece.init_version(
         headers=infodict['headers'],
         instruments=infodict['instruments'],
@@ -120,6 +151,7 @@ def save_config(infodict, config_path):
         opus=infodict["opus"],
         movements=infodict.get('movements', None)
     )
+    catalog.warn_duplicates(new_piece)
     yaml_interface.write_config(config_path, new_piece)
 
 
@@ -196,10 +228,9 @@ def composer_prompt(db):
     composers = db_interface.explore_table(db.table("composers"),
                                            search=("name", ""))
     comp = prompt("Enter Composer: ", completer=InsensitiveCompleter(composers))
-    matches = []
-    for item in composers:
-        if comp in item:
-            matches.append(item)
+    index = matching.index_of(composers)
+    # spelling variants are found by their keys if no name contains comp
+    matches = index.containing(comp) or index.lookup(comp)
     if matches:
         load = prompt(f"Would you like to load {comp} from the database? ",
                       default='Y', validator=YNValidator())
@@ -221,7 +252,7 @@ def composer_prompt(db):
     new_comp = info.Composer(comp)
     guess_short_name = new_comp.get_short_name()
     try:
-        guess_mutopia_name = new_comp.get_mutopia_name(guess=True)
+        guess_mutopia_name = new_comp.get_mutopia_name(guess=True, db=db)
     except AttributeError:
         guess_mutopia_name = ''
     new_comp.shortname = prompt("Enter the abbreviated name of the composer: ",
@@ -433,23 +464,29 @@ def print_movements(mov_list):
         print(f"{mov.num}. {mov.tempo} in {mov.key.note} {mov.key.mode}")
 
 
-def get_tempo_words():
+def _read_words(path):
+    with open(path, 'r', encoding='utf-8') as wordfile:
+        return [line.strip() for line in wordfile if line.strip()]
+
+
+def get_tempo_words(db=None):
+    """
+    Returns the tempo words for completion, without duplicates: the bundled
+    ones, then those in the file named by $LILYSKEL_TEMPO_WORDS (one per
+    line), then the 'tempowords' table of the database.
+
+    :param db: (optional) the database.
+    """
     global TEMPO_WORDS
-    if TEMPO_WORDS:
+    if not TEMPO_WORDS:
+        words = _read_words(TEMPO_WORDS_FILE)
+        if os.environ.get('LILYSKEL_TEMPO_WORDS'):
+            words.extend(_read_words(os.environ['LILYSKEL_TEMPO_WORDS']))
+        TEMPO_WORDS = list(dict.fromkeys(words))
+    if db is None or 'tempowords' not in db.tables():
         return TEMPO_WORDS
-    wiki = requests.get('https://en.wikipedia.org/wiki/Tempo')
-    wiki_soup = bs4.BeautifulSoup(wiki.text, "html.parser")
-    tempos = []
-    for title in ['Basic_tempo_markings', 'French_tempo_markings',
-                  'German_tempo_markings']:
-        title = wiki_soup.find(id=title)
-        tempos_soup = title.find_next('ul')
-        tempos_temp = []
-        for item in tempos_soup.find_all('i'):
-            tempos_temp.extend(titlecase(item.text).split(' '))
-        tempos.extend(tempos_temp)
-    TEMPO_WORDS = tempos
-    return TEMPO_WORDS
+    return list(dict.fromkeys(TEMPO_WORDS + db_interface.explore_table(
+        db.table('tempowords'), search=('word', ''))))
 
 
 class ModeValidator(Validator):
@@ -461,14 +498,17 @@ class ModeValidator(Validator):
 
 
 class NoteValidator(Validator):
+    def __init__(self, language=None):
+        self.notes = info.get_allowed_notes(language)
+
     def validate(self, document):
         if not document.text:
             raise ValidationError(message="Response Required", cursor_position=0)
-        if document.text not in info.get_allowed_notes():
+        if document.text not in self.notes:
             raise ValidationError(message="Invalid note", cursor_position=0)
 
 
-def movement_prompt(curr_movements):
+def movement_prompt(curr_movements, language=None, db=None):
     if curr_movements:
         print("Movements in piece: ")
         print_movements(curr_movements)
@@ -483,7 +523,7 @@ def movement_prompt(curr_movements):
     )
     print(prompt_help)
     command_completer = WordCompleter(['create', 'delete', 'print', 'edit', 'help', 'done'])
-    tempo_completer = InsensitiveCompleter(get_tempo_words())
+    tempo_completer = PrefixCompleter(get_tempo_words(db))
     mode_completer = WordCompleter(info.get_allowed_modes())
     while True:
         command = prompt("Movements> ", completer=command_completer)
@@ -497,7 +537,7 @@ def movement_prompt(curr_movements):
             new_mov_num = len(curr_movements) + 1
             new_mov_tempo = prompt("Enter tempo (optional): ", completer=tempo_completer)
             new_mov_time = prompt("Enter time signature (optional): ")
-            new_mov_key_note = prompt("Enter key note: ", validator=NoteValidator())
+            new_mov_key_note = prompt("Enter key note: ", validator=NoteValidator(language))
             new_mov_key_mode = prompt("Enter key mode: ", completer=mode_completer, validator=ModeValidator())
             new_mov_key = info.KeySignature(note=new_mov_key_note, mode=new_mov_key_mode)
             curr_movements.append(info.Movement(num=new_mov_num, tempo=new_mov_tempo, time=new_mov_time,
@@ -510,7 +550,7 @@ def movement_prompt(curr_movements):
             curr_movements[mov_num-1].tempo = prompt("Enter tempo (optional): ", completer=tempo_completer,
                                                      default=working_mov.tempo)
             curr_movements[mov_num-1].time = prompt("Enter time signature (optional): ", default=working_mov.time)
-            new_key_note = prompt("Enter key note: ", validator=NoteValidator(),
+            new_key_note = prompt("Enter key note: ", validator=NoteValidator(language),
                                                         default=working_mov.key.note)
             new_key_mode = prompt("Enter key mode: ", completer=mode_completer,
                                                         validator=ModeValidator(), default=working_mov.key.mode)
@@ -1,14 +1,25 @@
-import better_exceptions
-import click
-from titlecase import titlecase
-from prompt_toolkit import prompt
-from tinydb import Query
+"""
+Commands for directly editing the database.
 
+Like cli.py, this is imported for `lilyskel --help`, so the prompt and
+scraping machinery is imported inside the commands that use it.
+"""
+import click
 
-from lilyskel.info import Composer
-from lilyskel.exceptions import MutopiaError
 from lilyskel import db_interface
-from lilyskel.interface.common import *
+
+
+def prompt(*args, **kwargs):
+    """Wrapper that imports prompt_toolkit only when a prompt is shown."""
+    from prompt_toolkit import prompt as pt_prompt
+    return pt_prompt(*args, **kwargs)
+
+
+def get_db(ctx):
+    """Open the database on first access and keep it on the context."""
+    if 'DB' not in ctx.obj:
+        ctx.obj['DB'] = db_interface.init_db(ctx.obj.get('DB_PATH'))
+    return ctx.obj['DB']
 
 
 @click.group()
@@ -16,9 +27,11 @@ from lilyskel.interface.common import *
 @click.pass_context
 def db(ctx, db_path):
     """Directly interface with the database."""
+    # pylint: disable=unused-import
+    import better_exceptions
     if not ctx.obj:
         ctx.obj = {}
-    ctx.obj['DB'] = db_interface.init_db(db_path)
+    ctx.obj['DB_PATH'] = db_path
 
 
 @db.group()
@@ -31,7 +44,8 @@ def add():
 @click.pass_context
 def instrument(ctx):
     """Add an instrument to the database"""
-    db_ = ctx.obj['DB']
+    from lilyskel.lynames import Instrument
+    db_ = get_db(ctx)
     name = input("Instrument Name (lower): ")
     abbr = input("Instrument Abbreviation: ")
     clef = input("Instrument clef: ") or "treble"
@@ -64,11 +78,13 @@ def instrument(ctx):
 @click.pass_context
 def composer(ctx, name):
     """Add composer to the database."""
-    db_ = ctx.obj['DB']
+    from lilyskel.info import Composer
+    from lilyskel.exceptions import MutopiaError
+    db_ = get_db(ctx)
     newcomp = Composer(name)
     try:
         mutopianame = input(
-            f"Assumed Mutopia Name is {newcomp.get_mutopia_name(guess=True)}"
+            f"Assumed Mutopia Name is {newcomp.get_mutopia_name(guess=True, db=db_)}"
             " Is this correct? [Y/n] "
         ) or "Y"
         if mutopianame[0].lower() == 'n':
@@ -96,12 +112,12 @@ def fromfile(ctx, table, infile):
     :param infile:
     :return:
     """
-    db_ = ctx.obj['DB']
+    db_ = get_db(ctx)
     with open(infile, "r") as data:
         items = data.readlines()
     table_obj = db_.table(table)
-    for item in items:
-        table_obj.insert({"word": item.strip()})
+    db_interface.insert_multiple(table_obj,
+                                 [{"word": item.strip()} for item in items])
 
     print(table_obj.all())
 
@@ -112,25 +128,16 @@ def fromfile(ctx, table, infile):
 @click.pass_context
 def ensemble(ctx, name, instrument):
     """Add an ensemble to the database"""
-    db_ = ctx.obj['DB']
+    from lilyskel.interface.common import create_ensemble
+    db_ = get_db(ctx)
     new_ens = create_ensemble(name, db_, instrument)
     print(new_ens)
 
 
-class IsNumberValidator(Validator):
-    def validate(self, document):
-        text = document.text
-        if not text:
-            return
-        if not text.isdigit():
-            raise ValidationError(message="Must be integer")
-        try:
-            int(text)
-        except ValueError as err:
-            raise ValidationError(message=err)
-
-
 def db_instrument_prompt(instruments, ins_list, db_):
+    from lilyskel.lynames import Instrument, normalize_name
+    from lilyskel.interface.common import InsensitiveCompleter, \
+        IsNumberValidator, YNValidator, manual_instrument
     ins_completer = InsensitiveCompleter(instruments)
     while True:
         new_ins_name = prompt("Enter an instrument, blank to finish: ", completer=ins_completer)
@@ -153,6 +160,30 @@ def db_instrument_prompt(instruments, ins_list, db_):
     return ins_list
 
 
+@db.command(name="import")
+@click.argument("table")
+@click.argument("infile", type=click.Path(exists=True, dir_okay=False))
+@click.option("-f", "--format", "fmt", type=click.Choice(["csv", "jsonl"]),
+              help="file format, if the extension doesn't say")
+@click.option("-b", "--batch-size", type=click.IntRange(min=1),
+              default=1000, show_default=True,
+              help="rows inserted at a time")
+@click.pass_context
+def import_(ctx, table, infile, fmt, batch_size):
+    """Import rows from a CSV or JSON lines file into a table"""
+    from lilyskel import bulk_import
+    try:
+        fmt = bulk_import.file_format(infile, fmt)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="INFILE")
+    report = bulk_import.import_file(get_db(ctx), table, infile, fmt=fmt,
+                                     batch_size=batch_size)
+    for error in report.errors:
+        print(error)
+    print(f"Added {report.added} rows to {table}, skipped "
+          f"{report.duplicates} duplicates and {report.invalid} invalid rows.")
+
+
 @db.command()
 @click.argument("table", required=True)
 @click.argument("field", required=True)
@@ -160,7 +191,7 @@ def db_instrument_prompt(instruments, ins_list, db_):
 @click.pass_context
 def search(ctx, table, field, term):
     """Search the database"""
-    db_ = ctx.obj['DB']
+    db_ = get_db(ctx)
     print(db_interface.explore_table(db_.table(table), search=(field, term)))
 
 
@@ -171,12 +202,12 @@ def search(ctx, table, field, term):
 @click.pass_context
 def delete(ctx, table, field, search_term):
     """Find and delete an item from a table"""
-    table = ctx.obj['DB'].table(table)
+    from lilyskel.interface.common import IndexValidator
+    table = get_db(ctx).table(table)
     if not search_term:
         search_term = prompt(f"Enter a search term for table {table}")
-    q = Query()
     try:
-        items = table.search(q[field].test(lambda val: search_term in val))
+        items = db_interface.search_table(table, field, search_term)
     except AttributeError as err:
         print("Invalid table or db.")
     for num, item in enumerate(items):
@@ -185,5 +216,5 @@ def delete(ctx, table, field, search_term):
         choice = prompt("Type number to delete or [enter] to finish: ", validator=IndexValidator(len(items)))
         if not choice:
             return
-        table.remove(doc_ids=[items[int(choice)].doc_id])
+        db_interface.remove(table, doc_ids=[items[int(choice)].doc_id])
 
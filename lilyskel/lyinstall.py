@@ -0,0 +1,172 @@
+"""
+Find lilypond installations and what they support.
+
+Probing a binary runs `lilypond --version` and reads define-note-names.scm, so
+the results are cached on disk keyed by the binary's real path and mtime and
+$LILYPOND_DATADIR. An upgrade changes the mtime and triggers a new probe. A
+probe that finds no data directory isn't kept on disk, so data installed later
+is found by the next run.
+"""
+import os
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+import attr
+from lilyskel import cache
+from lilyskel import exceptions
+
+ENCODING = sys.stdout.encoding or 'utf-8'
+CACHE_NAME = 'lilypond.json'
+# binary chosen with select() (e.g. from `lilyskel --lilypond`)
+SELECTED = None
+# probe key (see probe) -> Installation, for this process
+PROBED = {}
+
+
+@attr.s
+class Installation:
+    """What we know about one installed lilypond."""
+    binary = attr.ib(validator=attr.validators.instance_of(str))
+    version = attr.ib(validator=attr.validators.instance_of(str))
+    datadir = attr.ib(default=None)
+    languages = attr.ib(default=attr.Factory(list))
+
+    def dump(self):
+        return attr.asdict(self)
+
+
+def select(binary):
+    """
+    Choose the lilypond binary used by probe().
+
+    :param binary: a path or a command name on PATH. None resets to default.
+    """
+    # pylint: disable=global-statement
+    global SELECTED
+    SELECTED = binary
+
+
+def find_binary(binary=None):
+    """
+    Returns the absolute path of the lilypond binary to use.
+    Order: 'binary', select(), $LILYSKEL_LILYPOND, `lilypond` on PATH.
+    """
+    binary = (binary or SELECTED or os.environ.get('LILYSKEL_LILYPOND')
+              or 'lilypond')
+    found = shutil.which(binary)
+    if found is None:
+        raise exceptions.LilypondError(
+            "'{}' was not found. Is lilypond installed?".format(binary))
+    return os.path.realpath(found)
+
+
+def find_binaries():
+    """
+    Find all lilypond binaries on PATH, including versioned ones such as
+    lilypond-2.24.
+
+    :return: sorted list of real paths
+    """
+    binaries = set()
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            if not re.match(r'^lilypond(-[0-9][0-9.]*)?$', name):
+                continue
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                binaries.add(os.path.realpath(path))
+    return sorted(binaries)
+
+
+def probe(binary=None):
+    """
+    Returns the Installation for a lilypond binary, from memory, the disk cache
+    or by running it.
+
+    :param binary: (optional) the binary to probe. See find_binary.
+    """
+    real = find_binary(binary)
+    key = '{}:{}:{}'.format(real, os.stat(real).st_mtime,
+                            os.environ.get('LILYPOND_DATADIR', ''))
+    if key in PROBED:
+        return PROBED[key]
+    cached = cache.load(CACHE_NAME) or {}
+    if key in cached:
+        installation = Installation(**cached[key])
+    else:
+        installation = _run_probe(real)
+        if installation.datadir is not None:
+            # drop stale entries for this binary
+            cached = {k: v for k, v in cached.items()
+                      if v.get('binary') != real}
+            cached[key] = installation.dump()
+            cache.dump(CACHE_NAME, cached)
+    PROBED[key] = installation
+    return installation
+
+
+def _run_probe(binary):
+    """Actually run lilypond and look for its data."""
+    run_ly = subprocess.run([binary, '--version'], stdout=subprocess.PIPE)
+    matchvers = re.search(r'LilyPond ([0-9][^\s]*)',
+                          run_ly.stdout.decode(ENCODING))
+    if matchvers is None:
+        raise exceptions.LilypondError(
+            "Could not read the version of '{}'".format(binary))
+    version = matchvers.group(1)
+    datadir = find_datadir(binary, version)
+    languages = []
+    if datadir is not None:
+        languages = read_languages(datadir)
+    return Installation(binary=binary, version=version,
+                        datadir=str(datadir) if datadir else None,
+                        languages=languages)
+
+
+def find_datadir(binary, version):
+    """
+    Find the data directory (the one containing scm/) of an installation.
+
+    :param binary: real path of the lilypond binary.
+    :param version: its version string.
+    :return: a Path or None
+    """
+    parents = Path(binary).parents
+    candidates = []
+    if os.environ.get('LILYPOND_DATADIR'):
+        candidates.append(Path(os.environ['LILYPOND_DATADIR']))
+    # a binary in / (or a bare name) has no prefix to look under
+    if len(parents) > 1:
+        candidates.extend([
+            Path(parents[1], 'share', 'lilypond', version),
+            Path(parents[1], 'share', 'lilypond', 'current'),
+        ])
+    candidates.extend([
+        Path('/usr', 'share', 'lilypond', version),
+        Path('/usr', 'local', 'share', 'lilypond', version),
+    ])
+    for candidate in candidates:
+        if Path(candidate, 'scm', 'define-note-names.scm').exists():
+            return candidate
+    return None
+
+
+def read_languages(datadir):
+    """Read the available note name languages from an installation."""
+    langfile = Path(datadir, 'scm', 'define-note-names.scm')
+    with open(langfile, 'rb') as file_:
+        content = file_.read()
+    from lilyskel import pitches
+    langs = [lang.lower() for lang
+             in re.findall(r'Language: ([^\s]*)', content.decode(ENCODING),
+                           re.M | re.I)]
+    # aliases like español only appear as names in the alist
+    langs.extend(lang for lang in pitches.parse_note_names(
+        content.decode(ENCODING)) if lang not in langs)
+    return langs
@@ -1,11 +1,9 @@
 """Classes for names of files and directories."""
 import re
 import attr
-from fuzzywuzzy import process
-from num2words import num2words
-from titlecase import titlecase
 from lilyskel import exceptions
 from lilyskel import mutopia
+from lilyskel import db_interface
 from lilyskel.db_interface import load_name_from_table, explore_table
 
 
@@ -19,6 +17,7 @@ def normalize_name(name):
 
 def _form_num(num, *, form):
     """Return either a number or a number word."""
+    from num2words import num2words
     if form == 'num':
         return str(num)
     elif form == 'word':
@@ -175,6 +174,7 @@ class Instrument(LyName):
         :param key: (bool) Specifies whether to include key/transposition in name.
         """
         # pylint: disable=no-member
+        from titlecase import titlecase
         name = titlecase(' '.join(self.name.split('_')))
         # _roman is only needed if self was initialized with a number.
         if not key:
@@ -237,22 +237,27 @@ class Instrument(LyName):
         :param db: a tinydb instance to insert into.
         """
         ins_table = db.table('instruments')
-        data = attr.asdict(self,
+        db_interface.insert(ins_table, self.db_data())
+
+    def db_data(self):
+        """Returns the dict stored for the Instrument in the database."""
+        return attr.asdict(self,
                            filter=attr.filters.exclude(
                                attr.fields(Instrument)._roman,
                                attr.fields(Instrument)._numword,
                                attr.fields(Instrument).number
                            ))
-        ins_table.insert(data)
 
-    def get_mutopia_name(self):
-        """Gets the mutopia version of the Instrument's name."""
+    def get_mutopia_name(self, db=None):
+        """
+        Gets the mutopia version of the Instrument's name.
+
+        :param db: (optional) a TinyDB object with stored guesses.
+        """
         if self.mutopianame is not None:
             return self.mutopianame
-        instrs = mutopia.get_instruments()
-        choice, _ = process.extractOne(self.name, instrs)
-        self.mutopianame = choice
-        return choice
+        self.mutopianame = mutopia.match_instrument(self.name, db=db)
+        return self.mutopianame
 
     @classmethod
     def load(cls, input_):
@@ -279,6 +284,7 @@ class Ensemble:
         yield from self.instruments
 
     def pretty_name(self):
+        from titlecase import titlecase
         return titlecase(' '.join(self.name.split('_')))
 
     def add_instrument(self, ins_name, *, db=None, number=None, abbr='',
@@ -355,10 +361,13 @@ class Ensemble:
         ins_table = db.table('instruments')
         data = dict(name=self.name)
         data['instruments'] = []
-        for instrument in self.instruments:
-            # if the instrument isn't in the database
-            if not explore_table(ins_table, search=('name', instrument.name)):
-                instrument.add_to_db(db)
-            data['instruments'].append(
-                {'name': instrument.name, 'number': instrument.number})
-        ens_table.insert(data)
+        # the new instruments and the ensemble are written together.
+        with db_interface.batch(db):
+            for instrument in self.instruments:
+                # if the instrument isn't in the database
+                if not explore_table(ins_table,
+                                     search=('name', instrument.name)):
+                    instrument.add_to_db(db)
+                data['instruments'].append(
+                    {'name': instrument.name, 'number': instrument.number})
+            db_interface.insert(ens_table, data)
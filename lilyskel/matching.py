@@ -0,0 +1,376 @@
+"""
+Candidate indexes for matching names against long lists.
+
+Fuzzy scoring a guess against every name in a list gets slow as
+the list grows. A TrigramIndex maps each three letter sequence to the names
+containing it, so the few names that share the most of them with a query can
+be found by looking at only those names. The expensive scoring is then done
+on that shortlist.
+
+Spelling variants of the same composer (Tchaikovsky, Chaikovsky,
+Čajkovskij) share few trigrams, so every name is also indexed by keys: the
+whole name with diacritics folded away, and a Metaphone-style phonetic key of
+the surname. A query with a known key is answered by a dict lookup before any
+scoring. Different people can share a surname, so a name found by its sound
+alone must also agree with the query's initials.
+
+To resolve many names at once, a TrigramMatrix holds the trigram counts of
+every candidate as sparse vectors and scores a whole batch of queries by
+cosine similarity in a single pass over its postings.
+"""
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+from lilyskel import fuzzy
+
+# how many candidates are handed on to fuzzy scoring
+SHORTLIST = 20
+# lowest cosine similarity (out of 100) match_all accepts
+THRESHOLD = 40
+# lowest fuzzy score of a name found by its surname's sound alone
+SOUND_SCORE = 70
+
+
+# letters NFKD doesn't decompose, or whose usual transliteration isn't just the
+# base letter
+TRANSLITERATIONS = str.maketrans({
+    'č': 'ch', 'ć': 'ch', 'š': 'sh', 'ś': 'sh', 'ž': 'zh', 'ź': 'zh',
+    'ł': 'l', 'ø': 'o', 'æ': 'ae', 'œ': 'oe', 'ß': 'ss', 'đ': 'd', 'þ': 'th',
+})
+# applied in order to a folded surname before it is reduced to consonants
+PHONETIC_RULES = [
+    (r'(ij|yj|ii)$', 'y'),
+    (r'([aeiou])j', r'\1y'),
+    (r'tch|tsch|kh|sch|sh|ch', 'X'),
+    (r'zh', 'X'),
+    (r'ph|ff$|v|w', 'f'),
+    (r'ck|q|c(?![eiy])|g', 'k'),
+    (r'c|z|x', 's'),
+    (r'd', 't'),
+    (r'b', 'p'),
+    (r'j', 'y'),
+]
+
+
+def fold(text):
+    """
+    Lowercase, transliterate and strip diacritics and everything but letters
+    and digits, so that 'Čajkovskij, P.' is 'chajkovskijp'.
+
+    :param text: a string.
+    """
+    text = text.lower().translate(TRANSLITERATIONS)
+    return ''.join(char for char in unicodedata.normalize('NFKD', text)
+                   if char.isalnum() and not unicodedata.combining(char))
+
+
+def surname(name):
+    """
+    Returns the surname in a name: the last word, or the part before the
+    initials of a mutopia name like 'BeethovenLv'.
+
+    :param name: a composer name.
+    """
+    words = name.split()
+    if len(words) > 1:
+        return words[-1]
+    camel = re.match(r'(.*[a-z])[A-Z]', name)
+    return camel.group(1) if camel else name
+
+
+def initials(name):
+    """
+    Returns the folded initials of the given names in a name, so that
+    'Carl Philipp Emanuel Bach', 'C. P. E. Bach' and mutopia's 'BachCPE' all
+    give 'cpe'.
+
+    :param name: a composer name.
+    """
+    words = name.split()
+    if len(words) > 1:
+        given = re.findall(r'[^\W\d_]+', ' '.join(words[:-1]))
+        return ''.join(fold(part)[:1] for part in given)
+    return fold(name[len(surname(name)):])
+
+
+def same_person(query, name):
+    """
+    Whether a name whose surname sounds like query's can be the person
+    query names: their initials agree, or, if either has no given names,
+    they score at least SOUND_SCORE.
+
+    :param query: the name looked up.
+    :param name: a name with the same sound key.
+    """
+    mine, theirs = initials(query), initials(name)
+    if mine and theirs:
+        return mine.startswith(theirs) or theirs.startswith(mine)
+    return fuzzy.wratio(query, name) >= SOUND_SCORE
+
+
+def phonetic(text):
+    """
+    Returns a Metaphone-style key of text: its consonant sounds, with similar
+    ones merged and repeats collapsed, so that Rachmaninoff, Rachmaninov and
+    Rakhmaninov all give 'RXMNF'.
+
+    :param text: a word, usually a surname.
+    """
+    text = fold(text)
+    for pattern, replacement in PHONETIC_RULES:
+        text = re.sub(pattern, replacement, text)
+    # vowels only count at the start, where they are all alike
+    first = re.sub(r'[aeiouy]', 'a', text[:1])
+    key = (first + re.sub(r'[aeiouyh]', '', text[1:])).upper()
+    return re.sub(r'(.)\1+', r'\1', key)
+
+
+def name_keys(name):
+    """
+    Returns the lookup keys of a name: its folded form and the phonetic key
+    of its surname.
+
+    :param name: a composer name.
+    """
+    keys = {'fold:' + fold(name)}
+    sound = phonetic(surname(name))
+    if sound:
+        keys.add('sound:' + sound)
+    return keys
+
+
+def trigrams(text):
+    """
+    Returns the set of three letter sequences in text, lowercased. Text
+    shorter than three letters is its own trigram.
+
+    :param text: a string.
+    """
+    text = text.lower()
+    if len(text) < 3:
+        return {text} if text else set()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    An inverted index from trigrams to names, and from name keys to names.
+
+    :param names: (optional) iterable of names to index.
+    """
+
+    def __init__(self, names=()):
+        self.names = []
+        self.postings = {}
+        self.keys = {}
+        self._ids = {}
+        # name -> fuzzy.Prepared, filled as names are scored
+        self._prepared = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        """Add a name to the index, unless it is already there."""
+        if name in self._ids:
+            return
+        name_id = len(self.names)
+        self._ids[name] = name_id
+        self.names.append(name)
+        for gram in trigrams(name):
+            self.postings.setdefault(gram, []).append(name_id)
+        for key in name_keys(name):
+            self.keys.setdefault(key, []).append(name)
+
+    def folded(self, query):
+        """
+        Returns the names spelled like query apart from case and diacritics.
+
+        :param query: a name.
+        """
+        return list(self.keys.get('fold:' + fold(query), ()))
+
+    def lookup(self, query):
+        """
+        Returns the names spelled like query apart from case and diacritics,
+        or else those whose surname sounds like query's and that can be the
+        same person (see same_person).
+
+        :param query: a name.
+        """
+        found = self.folded(query)
+        if found:
+            return found
+        sound = phonetic(surname(query))
+        return [name for name in self.keys.get('sound:' + sound, ())
+                if same_person(query, name)] if sound else []
+
+    def choices(self, names):
+        """
+        Returns a fuzzy.Choices of some of the names, each prepared for
+        scoring only the first time it is asked for.
+
+        :param names: list of names.
+        """
+        prepared = []
+        for name in names:
+            if name not in self._prepared:
+                self._prepared[name] = fuzzy.prepare(name)
+            prepared.append(self._prepared[name])
+        return fuzzy.Choices(names, prepared)
+
+    def shortlist(self, query, limit=SHORTLIST):
+        """
+        Returns up to limit names sharing the most trigrams with query, best
+        first. Names sharing none are never returned.
+
+        :param query: the string to match.
+        :param limit: (optional) how many names to return.
+        """
+        shared = {}
+        for gram in trigrams(query):
+            for name_id in self.postings.get(gram, ()):
+                shared[name_id] = shared.get(name_id, 0) + 1
+        best = heapq.nlargest(limit, shared.items(),
+                              key=lambda item: (item[1], -item[0]))
+        return [self.names[name_id] for name_id, _ in best]
+
+    def containing(self, term):
+        """
+        Returns the names that contain term, in the order they were added.
+
+        :param term: the substring to look for (case sensitive).
+        """
+        if len(term) < 3:
+            return [name for name in self.names if term in name]
+        ids = None
+        # intersect the shortest posting lists first.
+        for gram in sorted(trigrams(term),
+                           key=lambda gram: len(self.postings.get(gram, ()))):
+            posting = self.postings.get(gram, ())
+            ids = set(posting) if ids is None else ids.intersection(posting)
+            if not ids:
+                return []
+        return [self.names[name_id] for name_id in sorted(ids)
+                if term in self.names[name_id]]
+
+
+def best_match(query, index, limit=SHORTLIST):
+    """
+    Returns the (name, score) in index that fuzzy matches query best, or None
+    if no name shares anything with it. A single name spelled like query is
+    taken as it is. Otherwise names found by index.lookup are preferred, the
+    trigram shortlist is only scored if there are none.
+
+    :param query: the string to match.
+    :param index: a TrigramIndex.
+    :param limit: (optional) how many candidates to score.
+    """
+    candidates = index.folded(query)
+    if len(candidates) == 1:
+        return candidates[0], 100
+    candidates = (candidates or index.lookup(query)
+                  or index.shortlist(query, limit))
+    if not candidates:
+        return None
+    return fuzzy.extract_one(query, index.choices(candidates))
+
+
+# tuple of names -> TrigramIndex, see index_of
+INDEXES = {}
+# how many lists index_of keeps indexes of
+INDEXES_KEPT = 8
+
+
+def index_of(names):
+    """
+    Returns a TrigramIndex of names, reusing the one built for the same list
+    before.
+
+    :param names: list of names.
+    """
+    key = tuple(names)
+    if key not in INDEXES:
+        if len(INDEXES) >= INDEXES_KEPT:
+            INDEXES.clear()
+        INDEXES[key] = TrigramIndex(key)
+    return INDEXES[key]
+
+
+def trigram_counts(text):
+    """
+    Returns a Counter of the trigrams of text, lowercased, with separators
+    unified and the ends padded so that word boundaries count.
+
+    :param text: a string.
+    """
+    text = ' {} '.format(re.sub(r'[-_\s]+', ' ', text.lower()).strip())
+    return Counter(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class TrigramMatrix:
+    """
+    The trigram count vectors of a list of candidates, stored by trigram.
+
+    :param candidates: iterable of candidate names.
+    """
+
+    def __init__(self, candidates):
+        self.candidates = list(candidates)
+        self.postings = {}
+        norms = []
+        for cand_id, candidate in enumerate(self.candidates):
+            counts = trigram_counts(candidate)
+            for gram, num in counts.items():
+                self.postings.setdefault(gram, []).append((cand_id, num))
+            norms.append(math.sqrt(sum(num * num for num in counts.values())))
+        self.norms = norms
+
+    def match_all(self, queries, threshold=THRESHOLD):
+        """
+        Returns the best candidate for each query.
+
+        Duplicate queries are scored once. Each query's dot products with all
+        candidates are accumulated from the postings of its own trigrams, so
+        candidates sharing nothing with it cost nothing.
+
+        :param queries: iterable of names to match.
+        :param threshold: (optional) lowest acceptable score, out of 100.
+        :return: dict of query -> (candidate, score), or None if no candidate
+            scored at least threshold.
+        """
+        results = {}
+        for query in set(queries):
+            counts = trigram_counts(query)
+            norm = math.sqrt(sum(num * num for num in counts.values()))
+            dots = {}
+            for gram, num in counts.items():
+                for cand_id, cand_num in self.postings.get(gram, ()):
+                    dots[cand_id] = dots.get(cand_id, 0) + num * cand_num
+            results[query] = None
+            if not dots or not norm:
+                continue
+            # ties go to the earlier candidate
+            cand_id, score = max(
+                ((cand_id, 100 * dot / (norm * self.norms[cand_id]))
+                 for cand_id, dot in dots.items()),
+                key=lambda item: (item[1], -item[0]))
+            if score >= threshold:
+                results[query] = (self.candidates[cand_id], round(score))
+        return results
+
+
+def match_all(queries, candidates, threshold=THRESHOLD):
+    """
+    Match a batch of names against a list of candidates. See
+    TrigramMatrix.match_all.
+
+    :param queries: iterable of names to match.
+    :param candidates: iterable of candidate names.
+    :param threshold: (optional) lowest acceptable score, out of 100.
+    """
+    return TrigramMatrix(candidates).match_all(queries, threshold)
@@ -1,55 +1,235 @@
-"""Functions for scraping mutopia info."""
-import requests
-from bs4 import BeautifulSoup
+"""
+Functions for scraping mutopia info.
+
+The vocabularies scraped from mutopia's contribute and advanced search pages
+are kept in a cache file and reused for ttl() seconds. After that the pages are
+revalidated with their ETag/Last-Modified, so an unchanged page costs a 304.
+Offline, the cache is used regardless of its age, or the snapshot shipped
+with lilyskel if there is no cache.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from lilyskel import cache
+from lilyskel import db_interface
 from lilyskel import exceptions
+from lilyskel import extract
+from lilyskel import fetch
+from lilyskel import fuzzy
+from lilyskel import matching
+
+CONTRIBUTE_URL = "http://www.mutopiaproject.org/contribute.html"
+ADVSEARCH_URL = "http://www.mutopiaproject.org/advsearch.html"
+CACHE_NAME = 'mutopia.json'
+# seconds before the cached vocabularies are revalidated, see ttl()
+DEFAULT_TTL = 7 * 24 * 60 * 60
+TTL = None
+
+CACHE_VERSION = 4
+# the vocabularies as parsed from both pages, for offline use
+SNAPSHOT = Path(Path(__file__).parents[0], 'mutopia_snapshot.json')
 
-SITE = None
-SITE2 = None
 LICENSES = None
 COMPOSERS = None
 INSTRUMENTS = None
 STYLES = None
+# contents of the cache file, read once per process
+CACHE = None
+# field name -> frozenset of allowed values, from the contribute table
+FIELDS = None
+# normalized name -> mutopia instrument name, see match_instrument
+INSTRUMENT_INDEX = None
+INSTRUMENT_LOCK = threading.Lock()
+# trigram index of the composer list, see composer_index
+COMPOSER_INDEX = None
+# fuzzy.Choices of the instruments, see instrument_choices
+INSTRUMENT_CHOICES = None
+# kind -> hash of its current list, see list_version
+VERSIONS = {}
+# our instrument names that mutopia spells differently (normalized)
+INSTRUMENT_ALIASES = {
+    'french_horn': 'horn',
+}
+
+
+def _parse_contribute(response):
+    """
+    Parse the contribute page's header table into field -> list of values.
+    Fields without a list of allowed values are left out.
+    """
+    table, = extract.from_response(response, [extract.target('table')])
+    fields = {}
+    for row in table.find_all('tr'):
+        cells = row.find_all('td')
+        if len(cells) < 2:
+            continue
+        name, description = cells[0].get_text().strip(), cells[1]
+        # special case for licenses, which are a list
+        items = description.find_all('li')
+        if items:
+            fields[name] = [item.text.replace('"', '').strip()
+                            for item in items]
+            continue
+        # this will clean out some preceding text
+        breaktext = description.get_text().split(':\n')
+        if len(breaktext) > 1:
+            fields[name] = [item.strip() for item in breaktext[1].split(', ')]
+    return {'fields': fields}
+
+
+def _parse_advsearch(response):
+    """Parse the instruments out of the advanced search page."""
+    inst_elements, = extract.from_response(
+        response, [extract.target('select', {'id': 'adv-instr-sel'})])
+    return {'instruments': [item['value'] for item
+                            in inst_elements.find_all('option')]}
+
 
+PAGES = {
+    'contribute': (CONTRIBUTE_URL, _parse_contribute),
+    'advsearch': (ADVSEARCH_URL, _parse_advsearch),
+}
+# one lock per page so that a getter called while the same page is being
+# fetched in another thread waits for that fetch instead of starting its own.
+PAGE_LOCKS = {name: threading.Lock() for name in PAGES}
+CACHE_LOCK = threading.RLock()
 
-def _scrape_mutopia():
-    """Grab the table off mutopia contributing."""
+
+def ttl():
+    """Returns the seconds the cached vocabularies are reused for, from
+    $LILYSKEL_MUTOPIA_TTL or a week."""
+    # pylint: disable=global-statement
+    global TTL
+    if TTL is None:
+        try:
+            TTL = int(os.environ.get('LILYSKEL_MUTOPIA_TTL', DEFAULT_TTL))
+        except ValueError:
+            TTL = DEFAULT_TTL
+    return TTL
+
+
+def _load_cache():
+    """Read the cache file, once."""
     # pylint: disable=global-statement
-    global SITE
-    if not SITE:
-        SITE = requests.get("http://www.mutopiaproject.org/contribute.html")
-    site_html = BeautifulSoup(SITE.content, 'html.parser')
-    return site_html.table.find_all('td')
-
-
-def _get_mutopia_table_data(field):
-    """Get data out of the mutopia contributing table."""
-    table = _scrape_mutopia()
-    for index, item in enumerate(table):
-        if field in item.get_text():
-            return table[index + 1]
+    global CACHE
+    with CACHE_LOCK:
+        if CACHE is None:
+            CACHE = cache.load(CACHE_NAME) or {}
+            if CACHE.get('version') != CACHE_VERSION:
+                CACHE = {'version': CACHE_VERSION}
+        return CACHE
+
+
+def _page(name):
+    """Returns the vocabularies of a page, revalidating them if stale."""
+    with PAGE_LOCKS[name]:
+        cached = _load_cache().get(name)
+        if cached and (fetch.is_offline()
+                       or time.time() - cached.get('fetched', 0) < ttl()):
+            return cached
+        if fetch.is_offline():
+            return _snapshot(name)
+        return _revalidate(name, cached)
+
+
+def _snapshot(name):
+    """Returns the bundled vocabularies of a page."""
+    with SNAPSHOT.open('r', encoding='utf-8') as snapshot:
+        return json.load(snapshot)[name]
+
+
+def _revalidate(name, cached, snapshot=True):
+    """
+    Fetch a page, conditionally if we have cached data for it, and update the
+    cache. If the page can't be fetched in time, stale cached data is used, or
+    the bundled snapshot if there is none.
+
+    :param snapshot: (optional) False to raise instead of using the snapshot.
+    """
+    url, parser = PAGES[name]
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    try:
+        response = fetch.get(url, headers=headers, stream=True)
+        if cached and response.status_code == 304:
+            response.close()
+            entry = dict(cached)
+        else:
+            # only the parsed vocabularies are kept, not the page. Reading
+            # it fails too if the deadline passes.
+            entry = parser(response)
+            entry['etag'] = response.headers.get('ETag')
+            entry['last_modified'] = response.headers.get('Last-Modified')
+    except exceptions.FetchError:
+        if not cached and not snapshot:
+            raise
+        fetch.count('fallbacks')
+        return cached or _snapshot(name)
+    entry['fetched'] = time.time()
+    with CACHE_LOCK:
+        _load_cache()[name] = entry
+        cache.dump(CACHE_NAME, CACHE)
+    return entry
+
+
+def refresh(force=False):
+    """
+    Revalidate all the cached vocabularies now, regardless of ttl().
+
+    :param force: if True, download the pages even if they are unchanged.
+    """
+    # pylint: disable=global-statement
+    global LICENSES, STYLES, COMPOSERS, INSTRUMENTS, FIELDS, INSTRUMENT_INDEX
+    global COMPOSER_INDEX, INSTRUMENT_CHOICES
+    for name in PAGES:
+        with PAGE_LOCKS[name]:
+            cached = None if force else _load_cache().get(name)
+            _revalidate(name, cached, snapshot=False)
+    LICENSES = STYLES = COMPOSERS = INSTRUMENTS = FIELDS = None
+    INSTRUMENT_INDEX = COMPOSER_INDEX = INSTRUMENT_CHOICES = None
+    VERSIONS.clear()
+
+
+def _fields():
+    """Returns the field -> frozenset(values) index, building it once."""
+    # pylint: disable=global-statement
+    global FIELDS
+    if FIELDS is None:
+        FIELDS = {name: frozenset(values) for name, values
+                  in _page('contribute')['fields'].items()}
+    return FIELDS
+
+
+def get_field(field):
+    """
+    Returns the allowed values of a field in mutopia's contribute table.
+
+    :param field: the name of the field, e.g. 'style'
+    :return: frozenset of values
+    """
+    fields = _fields()
+    if field in fields:
+        return fields[field]
+    for name, values in fields.items():
+        if field in name:
+            return values
     raise exceptions.MutopiaError("'{field}' was not found".format(
         field=field))
 
 
 def validate_mutopia(field, data):
     """Validates mutopia fields against accepted mutopia input."""
-    # special case for licenses
-    if field == 'license':
-        licenses = get_licenses()
-        if data not in licenses:
-            raise exceptions.MutopiaError(
-                '{data} was not found in {field}'.format(data=data,
-                                                         field=field))
-        else:
-            return
-
-    text = _get_mutopia_table_data(field=field)
-    # this will clean out some preceding text
-    breaktext = text.get_text().split(':\n')
-    cleantext = breaktext[1]
-    data_list = [item.strip() for item in cleantext.split(', ')]
-    if data not in data_list:
-        raise exceptions.MutopiaError(f'{data} was not found in {field}')
+    if data not in get_field(field):
+        raise exceptions.MutopiaError(
+            '{data} was not found in {field}'.format(data=data, field=field))
 
 
 def get_licenses():
@@ -57,10 +237,7 @@ def get_licenses():
     global LICENSES
     if LICENSES:
         return LICENSES
-    text = _get_mutopia_table_data(field='license')
-    licenses = text.find_all('li')
-    # some text cleaning
-    LICENSES = [license.text.replace('"', '') for license in licenses]
+    LICENSES = _page('contribute')['fields']['license']
     return LICENSES
 
 
@@ -68,10 +245,7 @@ def get_styles():
     global STYLES
     if STYLES:
         return STYLES
-    text = _get_mutopia_table_data('style')
-    breaktext = text.text.split(':\n')
-    cleantext = breaktext[1]
-    STYLES = [item.strip() for item in cleantext.split(', ')]
+    STYLES = _page('contribute')['fields']['style']
     return STYLES
 
 
@@ -80,25 +254,159 @@ def get_composers():
     global COMPOSERS
     if COMPOSERS:
         return COMPOSERS
-    text = _get_mutopia_table_data(field='mutopiacomposer')
-    breaktext = text.get_text().split(':\n')
-    cleantext = breaktext[1]
-    COMPOSERS = [item.strip() for item in cleantext.split(', ')]
-    # some text cleaning
+    COMPOSERS = _page('contribute')['fields']['mutopiacomposer']
     return COMPOSERS
 
 
+def composer_index():
+    """Returns a TrigramIndex of the mutopia composers, building it once."""
+    # pylint: disable=global-statement
+    global COMPOSER_INDEX
+    if COMPOSER_INDEX is None:
+        COMPOSER_INDEX = matching.TrigramIndex(get_composers())
+    return COMPOSER_INDEX
+
+
 def get_instruments():
     """Gets the allowed instruments from mutopia."""
     global INSTRUMENTS
     if INSTRUMENTS:
         return INSTRUMENTS
-    global SITE2
-    if not SITE2:
-        SITE2 = requests.get("http://www.mutopiaproject.org/advsearch.html")
-    html = BeautifulSoup(SITE2.content, 'html.parser')
-    inst_elements = html.find(id='adv-instr-sel')
-    INSTRUMENTS = []
-    for item in inst_elements.find_all('option'):
-        INSTRUMENTS.append(item['value'])
+    INSTRUMENTS = _page('advsearch')['instruments']
     return INSTRUMENTS
+
+
+def instrument_choices():
+    """Returns the mutopia instruments prepared for fuzzy scoring, once."""
+    # pylint: disable=global-statement
+    global INSTRUMENT_CHOICES
+    if INSTRUMENT_CHOICES is None:
+        INSTRUMENT_CHOICES = fuzzy.Choices(get_instruments())
+    return INSTRUMENT_CHOICES
+
+
+def _normalize(name):
+    """Lowercase and unify separators, so 'French Horn' is 'french_horn'."""
+    return re.sub(r'[-_\s]+', '_', name.lower()).strip('_')
+
+
+def list_version(kind):
+    """
+    Returns a short hash of the current composer or instrument list. Guesses
+    stored in the db are only reused while it is unchanged.
+
+    :param kind: 'composer' or 'instrument'
+    """
+    if kind not in VERSIONS:
+        names = get_composers() if kind == 'composer' else get_instruments()
+        VERSIONS[kind] = hashlib.sha1(
+            json.dumps(names).encode('utf-8')).hexdigest()[:12]
+    return VERSIONS[kind]
+
+
+def prune_matches(db):
+    """
+    Remove the guesses stored in db that were made against outdated lists.
+
+    :param db: a TinyDB object
+    :return: the number of guesses removed.
+    """
+    return db_interface.prune_name_matches(
+        db, {kind: list_version(kind) for kind in ('composer', 'instrument')})
+
+
+def _instrument_index():
+    """Returns the exact and alias index of mutopia instrument names."""
+    # pylint: disable=global-statement
+    global INSTRUMENT_INDEX
+    if INSTRUMENT_INDEX is None:
+        index = {_normalize(name): (name, 100) for name in get_instruments()}
+        for alias, target in INSTRUMENT_ALIASES.items():
+            if target in index:
+                index.setdefault(alias, index[target])
+        INSTRUMENT_INDEX = index
+    return INSTRUMENT_INDEX
+
+
+def match_instrument(name, db=None):
+    """
+    Returns the mutopia instrument name for one of our instrument names. See
+    match_instruments.
+
+    :param name: the instrument name, e.g. 'clarinet_in_bb'
+    :param db: (optional) a TinyDB object with stored guesses.
+    """
+    return match_instruments([name], db=db)[name]
+
+
+def match_instruments(names, db=None):
+    """
+    Returns the mutopia instrument names for a batch of our instrument names.
+
+    Exact and alias matches, also after dropping a transposition like
+    '_in_bb', are looked up in an index. The other names are deduplicated and
+    scored against mutopia's list together in one pass (see
+    matching.TrigramMatrix). Only names that no instrument resembles enough
+    are left to fuzzy.extract_one. Each result is kept with the cached
+    vocabulary, so every instrument of the same name, in this or a later
+    process, reuses it until mutopia's list changes.
+
+    :param names: iterable of instrument names.
+    :param db: (optional) a TinyDB object. Guesses stored in its name_matches
+        table are used before scoring, and new guesses are stored there.
+    :return: dict of name -> mutopia name.
+    """
+    keys = {name: _normalize(name) for name in names}
+    with INSTRUMENT_LOCK:
+        index = _instrument_index()
+        missing = set()
+        for key in set(keys.values()):
+            base = re.sub(r'_in_[a-h](flat|sharp|[bsf#])?$', '', key)
+            if key not in index and base in index:
+                index[key] = index[base]
+            elif key not in index:
+                missing.add(key)
+        if missing and db is not None:
+            _load_matches(db, missing, index)
+        if missing:
+            _match_missing(missing, index)
+            if db is not None:
+                version = list_version('instrument')
+                with db_interface.batch(db):
+                    for key in missing:
+                        db_interface.save_name_match(
+                            db, 'instrument', key, *index[key], version)
+        return {name: index[key][0] for name, key in keys.items()}
+
+
+def _load_matches(db, keys, index):
+    """Move the keys with a current guess in db from keys into index."""
+    version = list_version('instrument')
+    for key in list(keys):
+        stored = db_interface.load_name_match(db, 'instrument', key, version)
+        if stored is not None:
+            index[key] = stored
+            keys.discard(key)
+
+
+def _match_missing(keys, index):
+    """Score the keys not in the memo of the cached vocabulary into index."""
+    entry = _page('advsearch')
+    matches = entry.setdefault('matches', {})
+    todo = keys.difference(matches)
+    if todo:
+        _score_instruments(todo, matches)
+        with CACHE_LOCK:
+            if _load_cache().get('advsearch') is entry:
+                cache.dump(CACHE_NAME, CACHE)
+    for key in keys:
+        index[key] = tuple(matches[key])
+
+
+def _score_instruments(keys, matches):
+    """Find the mutopia instruments for normalized names, into matches."""
+    scored = matching.match_all(keys, get_instruments())
+    for key in keys:
+        if scored[key] is None:
+            scored[key] = fuzzy.extract_one(key, instrument_choices())
+        matches[key] = list(scored[key])
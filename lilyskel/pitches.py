@@ -0,0 +1,247 @@
+"""
+Note names and modes that lilypond accepts.
+
+These ship with lilyskel so that validating a key never needs the network.
+refresh() regenerates them from the lilypond documentation into the local
+cache, which then takes precedence over the bundled tables.
+
+The note names of each language are read from the installed lilypond's
+define-note-names.scm and cached per lilypond version. Without an installation
+the bundled per-language tables are used.
+"""
+import itertools
+import re
+import unicodedata
+from pathlib import Path
+from lilyskel import cache
+from lilyskel import exceptions
+from lilyskel import fetch
+from lilyskel import lyinstall
+
+CACHE_NAME = 'pitches.json'
+NOTES_URL = ('http://lilypond.org/doc/v2.18/Documentation/notation/'
+             'writing-pitches')
+MODES_URL = ('http://lilypond.org/doc/v2.18/Documentation/notation/'
+             'displaying-pitches')
+
+# base note names and accidental suffixes of all the languages in the
+# "Note names in other languages" table.
+BASE_NOTES = ('c', 'd', 'e', 'f', 'g', 'a', 'b', 'h',
+              'do', 're', 'ré', 'mi', 'fa', 'sol', 'la', 'si')
+SUFFIXES = ('', 'is', 'es', 'isis', 'eses', 's', 'f', 'ss', 'ff', 'x',
+            'sharp', 'flat', 'sharpsharp', 'flatflat', 'd', 'b', 'dd', 'bb',
+            'iss', 'ess', 'ississ', 'essess', 'k', 'kk')
+NOTES = frozenset(base + suffix for base, suffix
+                  in itertools.product(BASE_NOTES, SUFFIXES))
+MODES = frozenset(['major', 'minor', 'ionian', 'dorian', 'phrygian', 'lydian',
+                   'mixolydian', 'aeolian', 'locrian'])
+
+PITCHNAMES_CACHE = 'pitchnames.json'
+
+
+def _spellings(bases, suffixes, extra=()):
+    return frozenset([base + suffix for base, suffix
+                      in itertools.product(bases, suffixes)] + list(extra))
+
+
+_SOLFEGE = ('do', 're', 'mi', 'fa', 'sol', 'la', 'si')
+_GERMAN = ('c', 'd', 'e', 'f', 'g', 'a', 'h')
+# note names of each language, from the "Note names in other languages" table
+# of the lilypond notation reference.
+BUNDLED_LANGUAGES = {
+    'nederlands': _spellings(
+        'cdefgab', ('', 'is', 'es', 'isis', 'eses', 'ih', 'eh', 'isih',
+                    'eseh'), ['es', 'as', 'eses', 'ases']),
+    'catalan': _spellings(_SOLFEGE, ('', 'd', 's', 'b', 'dd', 'ss', 'bb',
+                                     'qd', 'qb', 'tqd', 'tqb')),
+    'deutsch': _spellings(
+        _GERMAN[:-1], ('', 'is', 'es', 'isis', 'eses', 'ih', 'eh', 'isih',
+                       'eseh'), ['h', 'his', 'hisis', 'hih', 'hisih', 'b',
+                                 'heses', 'es', 'as', 'eses', 'ases']),
+    'english': _spellings('cdefgab', ('', 's', 'f', 'ss', 'x', 'ff', 'sharp',
+                                      'flat', 'sharpsharp', 'flatflat', 'qs',
+                                      'qf', 'tqs', 'tqf')),
+    'espanol': _spellings(_SOLFEGE, ('', 's', 'b', 'ss', 'x', 'bb', 'cs',
+                                     'cb', 'tcs', 'tcb')),
+    'francais': _spellings(_SOLFEGE + ('ré',), ('', 'd', 'b', 'dd', 'x', 'bb',
+                                                'sd', 'sb', 'dsd', 'bsb')),
+    'italiano': _spellings(_SOLFEGE, ('', 'd', 'b', 'dd', 'bb', 'sd', 'sb',
+                                      'dsd', 'bsb')),
+    'norsk': _spellings(
+        _GERMAN, ('', 'iss', 'is', 'ess', 'es', 'ississ', 'isis', 'essess',
+                  'eses'), ['b', 'bes', 'bess', 'as', 'ass', 'ases', 'assess']),
+    'portugues': _spellings(_SOLFEGE, ('', 's', 'b', 'ss', 'bb', 'sqt', 'bqt',
+                                       'stqt', 'btqt')),
+    'suomi': _spellings(_GERMAN, ('', 'is', 'es', 'isis', 'eses'),
+                        ['b', 'bb', 'as', 'ases']),
+    'svenska': _spellings(_GERMAN, ('', 'iss', 'ess', 'ississ', 'essess'),
+                          ['b', 'ass', 'assess']),
+    'vlaams': _spellings(_SOLFEGE, ('', 'k', 'b', 'kk', 'bb')),
+}
+BUNDLED_LANGUAGES['català'] = BUNDLED_LANGUAGES['catalan']
+BUNDLED_LANGUAGES['español'] = BUNDLED_LANGUAGES['espanol']
+BUNDLED_LANGUAGES['français'] = BUNDLED_LANGUAGES['francais']
+BUNDLED_LANGUAGES['português'] = BUNDLED_LANGUAGES['portugues']
+NOTES = NOTES.union(*BUNDLED_LANGUAGES.values())
+# language -> frozenset of note names, for this process
+LANGUAGE_NOTES = {}
+
+_LANGUAGE_START = re.compile(
+    r'^\s*\((?P<alist>[^\s().;]+)\s*\.\s*\(\s*(;.*)?$'
+    r'|\(define(-public)?\s+pitchnames-(?P<define>[^\s()]+)')
+_PITCH = re.compile(r'\(\s*([^\s().;]+)\s*\.\s*,\(ly:make-pitch')
+
+
+def load():
+    """
+    Returns the (notes, modes) tables, from the cache if refresh() has been
+    run, otherwise the bundled ones.
+    """
+    cached = cache.load(CACHE_NAME)
+    if cached and cached.get('notes') and cached.get('modes'):
+        return frozenset(cached['notes']), frozenset(cached['modes'])
+    return NOTES, MODES
+
+
+def parse_note_names(text):
+    """
+    Parse the contents of lilypond's define-note-names.scm.
+
+    Handles the language-pitch-names alist of current versions, with its
+    `(nederlands . (` blocks, and the `(define pitchnames-nederlands` lists of
+    older ones.
+
+    :return: dict of language -> list of note names
+    """
+    languages = {}
+    language = None
+    for line in text.splitlines():
+        start = _LANGUAGE_START.search(line)
+        if start:
+            language = start.group('alist') or start.group('define')
+            languages.setdefault(language, [])
+            continue
+        if language is not None:
+            languages[language].extend(_PITCH.findall(line))
+    return {lang: notes for lang, notes in languages.items() if notes}
+
+
+def installed_note_names():
+    """
+    Returns the note names of each language of the lilypond installation,
+    parsed once per lilypond version and cached.
+
+    :return: dict of language -> list of note names, empty without lilypond.
+    """
+    try:
+        installation = lyinstall.probe()
+    except exceptions.LilypondError:
+        return {}
+    cached = cache.load(PITCHNAMES_CACHE) or {}
+    if installation.version in cached:
+        return cached[installation.version]
+    names = {}
+    if installation.datadir is not None:
+        scm = Path(installation.datadir, 'scm', 'define-note-names.scm')
+        with scm.open('rb') as scmfile:
+            names = parse_note_names(scmfile.read().decode('utf-8'))
+    cached[installation.version] = names
+    cache.dump(PITCHNAMES_CACHE, cached)
+    return names
+
+
+def _fold(name):
+    """Lowercase and strip accents, so that 'Español' matches 'espanol'."""
+    return ''.join(char for char in unicodedata.normalize('NFKD', name.lower())
+                   if not unicodedata.combining(char))
+
+
+def language_notes(language):
+    """
+    Returns the note names valid in a language.
+
+    :param language: a lilypond note name language. None means all languages.
+    :return: frozenset of note names
+    """
+    if language is None:
+        return load()[0]
+    if language in LANGUAGE_NOTES:
+        return LANGUAGE_NOTES[language]
+    notes = None
+    for table in (installed_note_names(), BUNDLED_LANGUAGES):
+        folded = {_fold(lang): names for lang, names in table.items()}
+        if _fold(language) in folded:
+            notes = frozenset(folded[_fold(language)])
+            break
+    if notes is None:
+        # an unknown language can't be checked any better than this
+        notes = load()[0]
+    LANGUAGE_NOTES[language] = notes
+    return notes
+
+
+def refresh():
+    """
+    Regenerate the tables from the lilypond documentation and cache them.
+
+    :return: (notes, modes)
+    """
+    notes = scrape_notes()
+    modes = scrape_modes()
+    cache.dump(CACHE_NAME, {'notes': sorted(notes), 'modes': sorted(modes)})
+    return notes, modes
+
+
+def scrape_notes():
+    """Build the note names from the tables in the lilypond docs."""
+    import bs4
+    docpage = fetch.get(NOTES_URL)
+    # the tables are picked by their text, so the whole page is needed, but
+    # only the tables are built into a tree.
+    soup = bs4.BeautifulSoup(docpage.text, 'html.parser',
+                             parse_only=bs4.SoupStrainer('table'))
+    tables = soup.find_all('table')
+    note_name_table = None
+    for table in tables:
+        if "Note Names" in table.text:
+            note_name_table = table
+            break
+    note_name_p = note_name_table.find_all('p')
+    base_note_names = []
+    for item in note_name_p:
+        item_as_list = item.text.strip().split(' ')
+        if len(item_as_list) == 8:
+            base_note_names.extend(item_as_list)
+    base_note_names = list(set(base_note_names))
+    for table in tables:
+        if "sharp" in table.text:
+            curr_table = table
+            break
+    note_suffixes_p = curr_table.find_all('p')
+    note_suffixes_table = []
+    for item in note_suffixes_p:
+        if '-' in item.text:
+            clean = item.text.strip().replace('-', '').split('/')
+            note_suffixes_table.extend(clean)
+    note_suffixes_table = list(set(note_suffixes_table))
+    note_suffixes_table.append('')
+    return frozenset(pair[0] + pair[1] for pair
+                     in itertools.product(base_note_names,
+                                          note_suffixes_table))
+
+
+def scrape_modes():
+    """Get the modes from the lilypond docs."""
+    import bs4
+    docpage2 = fetch.get(MODES_URL)
+    soup = bs4.BeautifulSoup(docpage2.text, "html.parser",
+                             parse_only=bs4.SoupStrainer('p'))
+    all_ps = soup.find_all('p')
+    curr_p = None
+    for a_p in all_ps:
+        if 'mode' in a_p.text and 'key signature' in a_p.text:
+            curr_p = a_p
+            break
+    mode_ps = curr_p.find_all('code')
+    return frozenset(item.text.replace('\\', '') for item in mode_ps
+                     if '\\' in item.text)
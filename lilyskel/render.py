@@ -2,16 +2,28 @@
 import re
 import os
 from pathlib import Path
-from jinja2 import Environment, PackageLoader
+from lilyskel.lynames import LyName
 
 
-ENV = Environment(loader=PackageLoader('lilyskel', 'templates'))
+# The jinja environment is created on first use so that importing this module
+# (e.g. for `lilyskel --help`) doesn't pay for jinja2.
+ENV = None
 FLAGS = {
     'key_in_partname': False,
     'compress_full_bar_rests': False,
 }
 
 
+def get_env():
+    """Return the template environment, creating it if necessary."""
+    # pylint: disable=global-statement
+    global ENV
+    if ENV is None:
+        from jinja2 import Environment, PackageLoader
+        ENV = Environment(loader=PackageLoader('lilyskel', 'templates'))
+    return ENV
+
+
 def make_global(lyglobal, piece, location=Path('.')):
     # global_template = ENV.get_template('global.ily')
 
@@ -27,7 +39,7 @@ def make_global(lyglobal, piece, location=Path('.')):
     os.makedirs(dirpath)
 
     # notes files that need to be included
-    global_template = ENV.get_template('global.ily')
+    global_template = get_env().get_template('global.ily')
     include_paths = []
     for movement in piece.movements:
         render = global_template.render(piece=piece, lyglobal=lyglobal, movement=movement)
@@ -55,7 +67,7 @@ def make_instrument(instrument, lyglobal, piece, flags=FLAGS,
             to current working directory. Relative paths are prefered.
    :returns: paths to include in an instrument includes file
     """
-    instemplate = ENV.get_template('ins_part.ly')
+    instemplate = get_env().get_template('ins_part.ly')
 
     name_prefix = make_name_prefix(piece)
     partfilename = instrument.part_file_name(prefix=name_prefix)
@@ -90,7 +102,7 @@ def make_instrument(instrument, lyglobal, piece, flags=FLAGS,
 
 
 def _render_notes(dirpath, piece, instrument, movement):
-    notestemplate = ENV.get_template('notes.ily')
+    notestemplate = get_env().get_template('notes.ily')
     render = notestemplate.render(piece=piece, instrument=instrument,
                                   movement=movement)
     filepath = Path(dirpath, instrument.mov_file_name(movement.num))
@@ -114,7 +126,7 @@ def render_includes(includepaths, piece, extra_includes=[],
     """
     old_dir = os.getcwd()
     os.chdir(location)
-    template = ENV.get_template('includes.ily')
+    template = get_env().get_template('includes.ily')
     render = template.render(piece=piece, extra_includes=extra_includes,
                              includepaths=includepaths)
     includepath = Path('includes.ily')
@@ -126,7 +138,7 @@ def render_includes(includepaths, piece, extra_includes=[],
 
 def render_defs(piece, location=Path('.')):
     """Renders the defs file."""
-    template = ENV.get_template('defs.ily')
+    template = get_env().get_template('defs.ily')
     defspath = Path(location, 'defs.ily')
     render = template.render(piece=piece)
 
@@ -146,7 +158,7 @@ def make_name_prefix(piece):
 
 def render_score(piece, instruments, lyglobal, path_prefix=Path('.')):
     """Renders the score."""
-    template = ENV.get_template('score.ly')
+    template = get_env().get_template('score.ly')
     name_prefix = make_name_prefix(piece)
     filename = name_prefix + '_score.ly'
     render = template.render(piece=piece, filename=filename, lyglobal=lyglobal,
@@ -155,3 +167,29 @@ def render_score(piece, instruments, lyglobal, path_prefix=Path('.')):
 
     with open(score_path, 'w') as scorefile:
         scorefile.write(render)
+
+
+def render_all(piece, location=Path('.'), flags=FLAGS, extra_includes=[]):
+    """
+    Renders the complete file skeleton for a piece.
+
+    :param piece: an info.Piece object.
+    :param location: the directory to put the files into.
+    :param flags: the part rendering flags. (see make_instrument)
+    :param extra_includes: more includes defined by the user.
+    """
+    location = Path(location)
+    os.makedirs(location, exist_ok=True)
+    lyglobal = LyName('global')
+    include_paths = []
+    global_file = make_global(lyglobal, piece, location=location)
+    include_paths.extend(global_file)
+    for instrument in piece.instruments:
+        new_includes = make_instrument(instrument=instrument, lyglobal=lyglobal,
+                                       piece=piece, location=location,
+                                       flags=flags)
+        include_paths.extend(new_includes)
+    render_includes(include_paths, piece, extra_includes=extra_includes,
+                    location=location)
+    render_defs(piece, location=location)
+    render_score(piece, piece.instruments, lyglobal, path_prefix=location)
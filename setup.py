@@ -25,14 +25,13 @@ setup(
         'titlecase',
         'bs4',
         'requests>=2.20',
-        'fuzzywuzzy[speedup]',
         'jinja2',
         'ruamel.yaml',
         'click',
         'prompt-toolkit>=2.0.1',
         'better_exceptions'
     ],
-    tests_require=['pytest', 'pytest-cov'],
+    tests_require=['pytest', 'pytest-cov', 'fuzzywuzzy[speedup]'],
     package=find_packages(),
     entry_points={
         'console_scripts': [
@@ -10,6 +10,7 @@ from jinja2 import Environment, PackageLoader
 from tinydb import TinyDB
 from lilyskel import lynames
 from lilyskel import info
+from lilyskel import mutopia
 
 
 here = Path(__file__)
@@ -32,6 +33,55 @@ def defaultdb(tmpdir_factory):
     return TinyDB(Path(tmpdir_, 'default_db.json'))
 
 
+class FakeResponse:
+    """Stands in for a requests response."""
+    def __init__(self, content, status_code=200, headers=None):
+        self.content = content
+        self.text = content.decode('utf-8', errors='replace')
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.encoding = 'utf-8'
+        self.read = 0
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            self.read = start + chunk_size
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_mutopia(monkeypatch, tmpdir):
+    """
+    Serves the mutopia pages from files in tests/ with an empty cache.
+    Returns the list of (url, request headers) that were requested.
+    """
+    import requests
+    pages = {
+        mutopia.CONTRIBUTE_URL: Path(basedir, 'tests', 'mutopia_contribute.html'),
+        mutopia.ADVSEARCH_URL: Path(basedir, 'tests', 'mutopia_advsearch.html'),
+    }
+    requested = []
+
+    def fake_get(session, url, headers=None, **kwargs):
+        requested.append((url, headers or {}))
+        if (headers or {}).get('If-None-Match') == '"v1"':
+            return FakeResponse(b'', status_code=304)
+        with pages[url].open('rb') as page:
+            return FakeResponse(page.read(), headers={'ETag': '"v1"'})
+
+    monkeypatch.setattr(requests.Session, 'get', fake_get)
+    monkeypatch.setenv('LILYSKEL_CACHE_DIR', str(Path(tmpdir, 'cache')))
+    for name in ['LICENSES', 'COMPOSERS', 'INSTRUMENTS', 'STYLES', 'CACHE',
+                 'FIELDS', 'INSTRUMENT_INDEX', 'COMPOSER_INDEX',
+                 'INSTRUMENT_CHOICES']:
+        monkeypatch.setattr(mutopia, name, None)
+    monkeypatch.setattr(mutopia, 'VERSIONS', {})
+    return requested
+
+
 @pytest.fixture
 def prompt_commands():
     with Path(basedir, 'tests', 'lilyskel_command.txt').open('r') as commandfile:
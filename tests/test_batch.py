@@ -0,0 +1,102 @@
+"""Tests for building and compiling with the worker pool."""
+from pathlib import Path
+from unittest import mock
+from lilyskel import batch
+from lilyskel import lyinstall
+from lilyskel import render
+from lilyskel import yaml_interface
+
+
+def test_preload():
+    """Preloading should compile the templates."""
+    batch.preload()
+    assert len(render.ENV.cache) == len(
+        render.ENV.list_templates(extensions=['ly', 'ily']))
+
+
+def test_build_all(piece1, piece2, tmpdir):
+    """Test building several configs at once."""
+    configs = []
+    for num, piece in enumerate([piece1, piece2, piece1]):
+        config = Path(tmpdir, 'config{}.yaml'.format(num))
+        yaml_interface.write_config(config, piece)
+        configs.append(config)
+    results = batch.build_all(configs, target_root=Path(tmpdir, 'out'),
+                              workers=2)
+    assert sorted(results) == sorted((str(config), None)
+                                     for config in configs)
+    assert Path(tmpdir, 'out', 'config1', 'O15_score.ly').exists()
+    assert Path(tmpdir, 'out', 'config2', 'defs.ily').exists()
+
+
+def test_build_default_target(piece1, piece2, tmpdir):
+    """Without a target root each config is built in its own directory."""
+    configs = []
+    for name, piece in [('first', piece1), ('second', piece2)]:
+        config = Path(tmpdir, name + '.yaml')
+        yaml_interface.write_config(config, piece)
+        configs.append(config)
+    results = batch.build_all(configs, workers=2)
+    assert sorted(results) == sorted((str(config), None)
+                                     for config in configs)
+    assert Path(tmpdir, 'first', 'defs.ily').exists()
+    assert Path(tmpdir, 'second', 'O15_score.ly').exists()
+
+
+def test_build_same_target(piece1, tmpdir, monkeypatch):
+    """Configs that would be built in one directory aren't built twice."""
+    monkeypatch.chdir(tmpdir)
+    configs = []
+    for folder in ['a', 'b']:
+        Path(tmpdir, folder).mkdir()
+        config = Path(folder, 'same.yaml')
+        yaml_interface.write_config(config, piece1)
+        configs.append(config)
+    monkeypatch.setattr(batch, 'get_pool', mock.Mock(wraps=batch.get_pool))
+    results = dict(batch.build_all(configs, target_root='out', workers=1))
+    assert results[str(configs[0].resolve())] is None
+    assert 'already built from' in results[str(configs[1].resolve())]
+    batch.get_pool.assert_called_once()
+
+
+def test_build_after_failure(piece1, piece2, tmpdir, monkeypatch):
+    """A failed job shouldn't leave its worker in the wrong directory."""
+    monkeypatch.chdir(tmpdir)
+    configs = []
+    for name, piece in [('first', piece1), ('other', piece2)]:
+        config = Path(name + '.yaml')
+        yaml_interface.write_config(config, piece)
+        configs.append(config)
+    batch.build_all(configs[:1], target_root='out', workers=1)
+    # building first.yaml again fails once rendering has changed directory.
+    results = dict(batch.build_all(configs, target_root='out', workers=1))
+    assert 'make_global' in results[str(configs[0].resolve())]
+    assert results[str(configs[1].resolve())] is None
+    assert Path(tmpdir, 'out', 'other', 'defs.ily').exists()
+
+
+def test_compile_all(tmpdir, monkeypatch):
+    """Test running a (fake) lilypond over several files."""
+    binary = Path(tmpdir, 'lilypond')
+    with binary.open('w') as script:
+        script.write('#!/bin/sh\n'
+                     'grep -q error "$1" && exit 1\n'
+                     'touch "$(basename "$1" .ly).pdf"\n')
+    binary.chmod(0o755)
+    monkeypatch.setattr(lyinstall, 'SELECTED', str(binary))
+    # compiling doesn't need the templates, languages or vocabularies
+    monkeypatch.setattr(batch, 'preload', mock.Mock(
+        side_effect=AssertionError))
+    lyfiles = []
+    for name in ['one', 'two', 'bad']:
+        lyfile = Path(tmpdir, 'scores', name + '.ly')
+        lyfile.parents[0].mkdir(exist_ok=True)
+        with lyfile.open('w') as ly:
+            ly.write('error' if name == 'bad' else '{ c }')
+        lyfiles.append(lyfile)
+    results = dict(batch.compile_all(lyfiles, workers=2))
+    assert results[str(lyfiles[0])] is None
+    assert results[str(lyfiles[1])] is None
+    assert results[str(lyfiles[2])] is not None
+    assert Path(tmpdir, 'scores', 'one.pdf').exists()
+    assert not Path(tmpdir, 'scores', 'bad.pdf').exists()
@@ -0,0 +1,82 @@
+"""Tests for importing rows into the database."""
+from pathlib import Path
+from click.testing import CliRunner
+from tinydb import TinyDB
+from lilyskel import bulk_import
+from lilyskel import db_interface
+from lilyskel.interface.cli import cli
+from lilyskel.lynames import Ensemble
+
+
+def test_import_file(tmpdir):
+    """Rows are checked, deduplicated and inserted in batches."""
+    test_db = TinyDB(Path(tmpdir, 'db.json'))
+    db_interface.insert(test_db.table('instruments'), {'name': 'violin'})
+    csvfile = Path(tmpdir, 'instruments.csv')
+    csvfile.write_text(
+        "name,clef,keyboard,family\n"
+        "Violin,treble,,strings\n"
+        "Viola,alto,no,strings\n"
+        "Violoncello,bass,false,strings\n"
+        "Harpsichord,treble,yes,keyboards\n"
+        "Organ,treble bass bass,yes,keyboards\n"
+        "Viola,alto,,strings\n"
+        "kazoo,squeaky,,\n"
+        ",bass,,\n")
+    report = bulk_import.import_file(test_db, 'instruments', csvfile,
+                                     batch_size=2)
+    assert (report.added, report.duplicates, report.invalid) == (4, 2, 2)
+    assert report.errors == ["line 8: 'squeaky' is not a valid clef",
+                             "line 9: 'name' is required"]
+    harpsichord = db_interface.load_name_from_table('harpsichord', test_db,
+                                                    'instruments')
+    assert harpsichord['keyboard'] is True
+    assert harpsichord['family'] == 'keyboards'
+    assert db_interface.load_name_from_table('organ', test_db, 'instruments')[
+        'clef'] == ['treble', 'bass', 'bass']
+
+    jsonfile = Path(tmpdir, 'ensembles.jsonl')
+    jsonfile.write_text(
+        '{"name": "String Trio", "instruments": ["violin", "viola", '
+        '"violoncello"]}\n'
+        '\n'
+        '{"name": "violin_duo", "instruments": [{"name": "violin", '
+        '"number": 1}, "violin:2"]}\n'
+        '{"name": "band", "instruments": ["kazoo"]}\n'
+        '{"name": "broken"\n')
+    report = bulk_import.import_file(test_db, 'ensembles', jsonfile)
+    assert (report.added, report.duplicates, report.invalid) == (2, 0, 2)
+    assert report.errors[0] == "line 4: not in the instruments table: kazoo"
+    assert report.errors[1].startswith("line 5: not valid JSON")
+    duo = Ensemble.load_from_db('violin_duo', test_db)
+    assert [ins.part_name() for ins in duo.instruments] == ['Violin I',
+                                                           'Violin II']
+
+    report = bulk_import.import_rows(test_db, 'composers', [
+        (1, {'name': 'Johann Sebastian Bach', 'mutopianame': 'BachJS'}),
+        (2, {'name': 'Bach', 'opus': 'BWV'}),
+        (3, {'name': 1750})])
+    assert (report.added, report.invalid) == (1, 2)
+    assert report.errors[1] == "line 3: the name must be a string"
+    report = bulk_import.import_rows(test_db, 'tempowords', [
+        (1, {'word': 'Feroce'}), (2, {'word': 'Feroce'}), (3, {})])
+    assert (report.added, report.duplicates, report.invalid) == (1, 1, 1)
+
+
+def test_import_command(tmpdir):
+    """Test the db import command."""
+    db_path = Path(tmpdir, 'db.json')
+    infile = Path(tmpdir, 'words.json')
+    infile.write_text('{"word": "dolce"}\n{"word": "dolce"}\n')
+    runner = CliRunner()
+    result = runner.invoke(cli, ['db', '-p', str(db_path), 'import',
+                                 'titlewords', str(infile)])
+    assert result.exit_code == 2
+    assert "looks like a JSON file" in result.output
+    result = runner.invoke(cli, ['db', '-p', str(db_path), 'import',
+                                 'titlewords', str(infile), '-f', 'jsonl'])
+    assert result.exit_code == 0
+    assert result.output == ("Added 1 rows to titlewords, skipped 1 "
+                             "duplicates and 0 invalid rows.\n")
+    assert db_interface.explore_table(
+        TinyDB(db_path).table('titlewords')) == ['dolce']
@@ -1,3 +1,6 @@
+import re
+import subprocess
+import sys
 from click.testing import CliRunner
 from pathlib import Path
 from unittest import mock
@@ -38,3 +41,32 @@ def test_lilyskel_init(tmpdir_factory, monkeypatch):
         m.setattr("lilyskel.interface.cli.prompt", mock_prompt2)
         result = runner.invoke(cli, ['init', test_name2, '-p', str(folder)])
         assert result.exit_code == 1
+
+
+HEAVY_MODULES = ['bs4', 'requests', 'fuzzywuzzy', 'prompt_toolkit', 'titlecase',
+                 'better_exceptions', 'jinja2', 'num2words']
+
+
+def test_cli_import_budget():
+    """Importing the cli (and what build needs) must stay cheap."""
+    check = ("import sys, lilyskel.interface.cli, lilyskel.yaml_interface, "
+             "lilyskel.render; "
+             "print(','.join(m for m in {!r} if m in sys.modules))".format(
+                 HEAVY_MODULES))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', check],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert result.stdout.decode().strip() == '',\
+        "heavy modules should only be imported by the commands that use them"
+    cli_time = re.search(r'\|\s*(\d+) \| lilyskel.interface.cli$',
+                         result.stderr.decode(), re.M)
+    # cumulative microseconds, generous enough for a slow CI machine.
+    assert int(cli_time.group(1)) < 150000
+
+
+def test_help_does_not_open_db(tmpdir):
+    """--help on the db group should not touch the database."""
+    db_path = Path(tmpdir, 'subdir', 'db.json')
+    runner = CliRunner()
+    result = runner.invoke(cli, ['db', '-p', str(db_path), '--help'])
+    assert result.exit_code == 0
+    assert not db_path.exists()
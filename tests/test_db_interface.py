@@ -4,6 +4,7 @@ import os
 import pytest
 from unittest import mock
 from tinydb import TinyDB
+from tinydb.database import Table
 from lilyskel import db_interface
 from lilyskel import exceptions
 
@@ -22,7 +23,8 @@ def test_init_db(mock_db, mock_exists, mock_makedirs):
     mock_exists.return_value = False
     db_interface.init_db(),
     mock_db.assert_called_once_with(
-        Path(home, '.local', 'share', 'lilyskel', 'db.json'))
+        Path(home, '.local', 'share', 'lilyskel', 'db.json'),
+        storage=mock.ANY)
     mock_makedirs.assert_called_once_with(
         Path(home, '.local', 'share', 'lilyskel'))
 
@@ -32,7 +34,8 @@ def test_init_db(mock_db, mock_exists, mock_makedirs):
     mock_exists.return_value = True
     db_interface.init_db(),
     mock_db.assert_called_once_with(
-        Path(home, '.local', 'share', 'lilyskel', 'db.json'))
+        Path(home, '.local', 'share', 'lilyskel', 'db.json'),
+        storage=mock.ANY)
     mock_makedirs.assert_not_called()
 
     # test custom
@@ -41,7 +44,7 @@ def test_init_db(mock_db, mock_exists, mock_makedirs):
     mock_exists.return_value = False
     db_interface.init_db('/one/two/three.json'),
     mock_db.assert_called_once_with(
-        Path('/one', 'two', 'three.json'))
+        Path('/one', 'two', 'three.json'), storage=mock.ANY)
     mock_makedirs.assert_called_once_with(Path('/one', 'two'))
 
 
@@ -174,3 +177,147 @@ def test_load_name_from_table(livedb):
                     db_interface.load_name_from_table('string_quartet',
                                                       livedb, 'ensembles')),\
         "Should be able to load an ensemble correctly."
+
+
+def test_name_matches(tmpdir):
+    """Test storing, loading and pruning guessed mutopia names."""
+    test_db = TinyDB(Path(tmpdir, 'db.json'))
+    db_interface.save_name_match(test_db, 'instrument', 'alto_sax',
+                                 'Saxophone', 62, 'v1')
+    db_interface.save_name_match(test_db, 'composer', 'J. S. Bach',
+                                 'BachJS', 90, 'c1')
+    assert db_interface.load_name_match(
+        test_db, 'instrument', 'alto_sax', 'v1') == ('Saxophone', 62)
+    assert db_interface.load_name_match(
+        test_db, 'instrument', 'alto_sax', 'v2') is None
+    db_interface.save_name_match(test_db, 'instrument', 'alto_sax',
+                                 'Alto Saxophone', 80, 'v2')
+    assert len(test_db.table('name_matches')) == 2
+    assert db_interface.prune_name_matches(
+        test_db, {'instrument': 'v2', 'composer': 'c2'}) == 1
+    assert db_interface.load_name_match(
+        test_db, 'instrument', 'alto_sax', 'v2') == ('Alto Saxophone', 80)
+
+
+def test_name_index(tmpdir, monkeypatch):
+    """Names are looked up in an index kept current by the write functions."""
+    test_db = TinyDB(Path(tmpdir, 'db.json'))
+    table = test_db.table('instruments')
+    db_interface.insert_multiple(table, [{'name': 'violin', 'clef': 'treble'},
+                                         {'name': 'viola', 'clef': 'alto'}])
+    assert db_interface.load_name_from_table('viola', test_db,
+                                             'instruments')['clef'] == 'alto'
+    assert db_interface.name_index(table) is db_interface.name_index(table)
+    doc_id = db_interface.insert(table, {'name': 'cello', 'clef': 'bass'})
+    assert db_interface.name_index(table)['cello'].doc_id == doc_id
+    db_interface.update(table, {'clef': 'tenor'}, doc_ids=[doc_id])
+    db_interface.remove(table, doc_ids=[1])
+    assert set(db_interface.name_index(table)) == {'viola', 'cello'}
+
+    monkeypatch.setattr(Table, 'all', mock.Mock(side_effect=AssertionError))
+    monkeypatch.setattr(Table, 'get', mock.Mock(side_effect=AssertionError))
+    assert db_interface.load_name_from_table('cello', test_db,
+                                             'instruments')['clef'] == 'tenor'
+    with pytest.raises(exceptions.DataNotFoundError):
+        db_interface.load_name_from_table('violin', test_db, 'instruments')
+
+
+def test_name_index_outside_writes(tmpdir):
+    """Names are normalized, and writes that bypass the index are seen."""
+    test_db = db_interface.init_db(Path(tmpdir, 'db.json'))
+    table = test_db.table('instruments')
+    db_interface.insert(table, {'name': 'English Horn', 'clef': 'treble'})
+    assert db_interface.load_name_from_table(
+        'english_horn', test_db, 'instruments')['clef'] == 'treble'
+    table.insert({'name': 'viola', 'clef': 'alto'})
+    assert 'viola' in db_interface.name_index(table)
+    other = db_interface.init_db(Path(tmpdir, 'db.json'))
+    other.table('instruments').insert({'name': 'cello', 'clef': 'bass'})
+    assert db_interface.load_name_from_table('cello', test_db,
+                                             'instruments')['clef'] == 'bass'
+    assert [data['name'] for data in db_interface.search_table(
+        table, 'clef', 'bass')] == ['cello']
+    db_interface.insert(table, {'name': 'tuba', 'clef': 'bass'})
+    assert len(db_interface.search_table(table, 'clef', 'bass')) == 2
+
+
+def test_load_ensemble_without_scans(livedb, monkeypatch):
+    """Loading an ensemble reads each table once."""
+    from lilyskel.lynames import Ensemble
+    reads = mock.Mock(wraps=Table.all)
+    monkeypatch.setattr(Table, 'all', lambda self: reads(self))
+    monkeypatch.setattr(Table, 'get', mock.Mock(side_effect=AssertionError))
+    monkeypatch.setattr(db_interface, 'NAME_INDEXES',
+                        db_interface.weakref.WeakKeyDictionary())
+    for _ in range(3):
+        ensemble = Ensemble.load_from_db('string_quartet', livedb)
+    assert len(ensemble.instruments) == 4
+    assert reads.call_count == 2
+
+
+def test_field_index(tmpdir, livetable):
+    """Substring search through the trigram index finds what a scan does."""
+    from tinydb import Query
+    q = Query()
+    for field, term in [('name', 'vio'), ('clef', 'bass'), ('name', 'a'),
+                        ('family', 'strings'), ('name', ''),
+                        ('name', 'nothing')]:
+        assert db_interface.search_table(livetable, field, term) == \
+            livetable.search(q[field].test(lambda val: term in val)), term
+
+    test_db = TinyDB(Path(tmpdir, 'db.json'))
+    table = test_db.table('ensembles')
+    db_interface.insert(table, {'name': 'string_trio',
+                                'instruments': ['violin', 'viola', 'cello']})
+    index = db_interface.field_index(table, 'name')
+    assert db_interface.field_index(table, 'name') is index
+    assert db_interface.explore_table(table, search=('instruments',
+                                                     'viola')) == ['string_trio']
+    db_interface.insert(table, {'name': 'string_quartet'})
+    assert db_interface.explore_table(table, search=('name', 'string')) == [
+        'string_trio', 'string_quartet']
+    db_interface.remove(table, doc_ids=[1])
+    assert db_interface.field_index(table, 'name') is not index
+    assert db_interface.explore_table(table, search=('name', 'trio')) == []
+
+
+def test_batch(tmpdir):
+    """Writes in a batch reach the file once, at the end."""
+    path = Path(tmpdir, 'sub', 'db.json')
+    test_db = db_interface.init_db(path)
+    table = test_db.table('instruments')
+    db_interface.insert(table, {'name': 'violin'})
+    assert 'violin' in path.read_text()
+    storage = test_db._storage.storage
+    with mock.patch.object(storage, 'write', wraps=storage.write) as write:
+        with db_interface.batch(test_db):
+            db_interface.insert(table, {'name': 'viola'})
+            with db_interface.batch(test_db):
+                db_interface.insert(table, {'name': 'cello'})
+            assert len(table) == 3
+            assert 'viola' not in path.read_text()
+        write.assert_called_once()
+    assert set(db_interface.explore_table(TinyDB(path).table(
+        'instruments'))) == {'violin', 'viola', 'cello'}
+    assert not list(Path(tmpdir, 'sub').glob('*.tmp'))
+
+    with pytest.raises(RuntimeError):
+        with db_interface.batch(test_db):
+            db_interface.insert(table, {'name': 'bass'})
+            assert 'bass' in db_interface.name_index(table)
+            raise RuntimeError
+    assert 'bass' not in path.read_text()
+    assert 'bass' not in db_interface.name_index(table)
+    assert len(table) == 3
+    test_db.close()
+
+    os.chmod(str(path), 0o644)
+    test_db = db_interface.init_db(path)
+    db_interface.insert(test_db.table('instruments'), {'name': 'harp'})
+    assert path.stat().st_mode & 0o777 == 0o644
+
+    plain_db = TinyDB(Path(tmpdir, 'plain.json'))
+    with db_interface.batch(plain_db) as batched:
+        assert batched is plain_db
+        db_interface.insert(plain_db.table('words'), {'word': 'dolce'})
+        assert 'dolce' in Path(tmpdir, 'plain.json').read_text()
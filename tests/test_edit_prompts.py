@@ -1,5 +1,7 @@
 import prompt_toolkit
 import pytest
+import threading
+import time
 from pathlib import Path
 from unittest import mock
 import lilyskel
@@ -87,7 +89,7 @@ def test_edit_prompt_empty_config(monkeypatch, tmpdir_factory, defaultdb, pathsa
 
         mock_prompt1.assert_any_call("Enter Lilypond Language: ", completer=mock.ANY, validator=mock.ANY)
         mock_mutopia_prompt.assert_called_once_with(None)
-        mock_movement_prompt.assert_called_once_with([])
+        mock_movement_prompt.assert_called_once_with([], 'english', db=defaultdb)
         mock_existing_instruments.assert_any_call([], mock.ANY, mock_ensemble_prompt)
         mock_existing_instruments.assert_any_call([], mock.ANY, mock_instrument_prompt)
         mock_header_prompt.assert_any_call(None, mock.ANY)
@@ -114,6 +116,71 @@ def test_edit_prompt_read_config(tmpdir_factory, piece2, defaultdb, pathsave_not
     assert 'tempo: Adagio' in data
 
 
+def test_prefetch(monkeypatch, tmpdir):
+    """Prompts should wait for an in-flight prefetch instead of refetching."""
+    from lilyskel.interface import edit_prompts
+    from lilyskel import mutopia
+    release = threading.Event()
+    entry = {'fields': {'license': ['Public Domain'], 'style': ['Baroque']},
+             'instruments': ['Violin'], 'fetched': time.time()}
+
+    def slow_revalidate(name, cached):
+        release.wait(5)
+        mutopia._load_cache()[name] = entry
+        return entry
+    mock_revalidate = mock.MagicMock(side_effect=slow_revalidate)
+    monkeypatch.setenv('LILYSKEL_CACHE_DIR', str(Path(tmpdir, 'cache')))
+    for name in ['LICENSES', 'STYLES', 'INSTRUMENTS', 'FIELDS']:
+        monkeypatch.setattr(mutopia, name, None)
+    monkeypatch.setattr(mutopia, 'CACHE', {'version': mutopia.CACHE_VERSION})
+    monkeypatch.setattr(mutopia, '_revalidate', mock_revalidate)
+    threads = edit_prompts.prefetch()
+    styles = []
+    prompt = threading.Thread(target=lambda: styles.append(
+        mutopia.get_styles()))
+    prompt.start()
+    prompt.join(0.2)
+    assert prompt.is_alive(), "the prompt should wait for the prefetch"
+    assert styles == []
+    release.set()
+    prompt.join(5)
+    assert styles == [['Baroque']]
+    for thread in threads:
+        thread.join()
+    assert mutopia.get_instruments() == ['Violin']
+    assert mock_revalidate.call_count == 2, "each page should be fetched once"
+
+
+def test_get_tempo_words(monkeypatch, tmpdir, defaultdb):
+    """Tempo words come from the bundled file, a local file and the db."""
+    from lilyskel.interface import edit_prompts
+    extra = Path(tmpdir, 'tempos.txt')
+    extra.write_text('Allegro\nFurioso\n\n')
+    monkeypatch.setenv('LILYSKEL_TEMPO_WORDS', str(extra))
+    monkeypatch.setattr(edit_prompts, 'TEMPO_WORDS', [])
+    words = edit_prompts.get_tempo_words()
+    assert {'Adagio', 'Schnell', 'Furioso'} <= set(words)
+    assert len(words) == len(set(words)), "there should be no duplicates"
+    defaultdb.table('tempowords').insert({'word': 'Feroce'})
+    defaultdb.table('tempowords').insert({'word': 'Adagio'})
+    words = edit_prompts.get_tempo_words(defaultdb)
+    assert 'Feroce' in words
+    assert len(words) == len(set(words))
+
+
+def test_prefix_completer():
+    """Test completing from the prefix index."""
+    completer = lilyskel.interface.common.PrefixCompleter(
+        ['Allegro', 'Allegretto', 'Adagio', 'allegro', 'Allegro'])
+    assert [comp.text for comp in completer.get_completions(
+        TestDocument('ALLEGR'), None)] == ['Allegro', 'Allegretto', 'allegro']
+    completions = list(completer.get_completions(
+        TestDocument('Allegro ma non ada'), None))
+    assert [comp.text for comp in completions] == ['Adagio']
+    assert completions[0].start_position == -3
+    assert not list(completer.get_completions(TestDocument('x'), None))
+
+
 class TestDocument(object):
     def __init__(self, text):
         self.text = text
@@ -0,0 +1,55 @@
+"""Tests for extracting elements from streamed pages."""
+from pathlib import Path
+from lilyskel import extract
+from .conftest import FakeResponse
+
+basedir = Path(__file__).parents[1]
+
+
+def test_extract_targets():
+    """Targets are found in order and unclosed tags don't end them early."""
+    page = ('<html><body><p>intro<h2 id="here">Here</h2>'
+            '<table><tr><td>a &amp; b<td><ul><li>one<li>two</ul></td></tr>'
+            '<tr><td><table><tr><td>nested</td></tr></table></td></tr>'
+            '</table><br/><select id="pick"><option value="x">X</select>')
+    table, select, missing = extract.from_chunks(
+        [page[i:i + 7] for i in range(0, len(page), 7)],
+        [extract.target('table'),
+         extract.target('select', {'id': 'pick'}),
+         extract.target('div')])
+    assert 'a & b' in table.get_text()
+    assert 'nested' in table.get_text()
+    assert len(table.find_all('li')) == 2
+    assert select.option['value'] == 'x'
+    assert missing is None
+
+
+def test_extract_stops_reading():
+    """Reading should stop once the last target is complete."""
+    with Path(basedir, 'tests', 'mutopia_advsearch.html').open('rb') as page:
+        content = page.read() + b'<p>padding</p>' * 10000
+    response = FakeResponse(content)
+    select, = extract.from_response(
+        response, [extract.target('select', {'id': 'adv-instr-sel'})],
+        chunk_size=1024)
+    assert 'Violin' in [option['value'] for option
+                        in select.find_all('option')]
+    assert response.read < len(content) / 10
+
+
+def test_extract_encoding():
+    """Pages are decoded by their declared or detected charset."""
+    page = ('<html><body><select><option value="Dvořák">Dvořák</option>'
+            '</select></body></html>')
+    for content, headers in [
+            (page.encode('utf-8'), {'Content-Type': 'text/html'}),
+            (('<meta charset="windows-1250">' + page).encode('cp1250'),
+             {'Content-Type': 'text/html'}),
+            (page.encode('utf-16'), {'Content-Type':
+                                     'text/html; charset=UTF-16'})]:
+        response = FakeResponse(content, headers=headers)
+        response.encoding = 'ISO-8859-1' if 'charset=' not in \
+            headers['Content-Type'] else 'UTF-16'
+        select, = extract.from_response(response, [extract.target('select')],
+                                        chunk_size=16)
+        assert select.option['value'] == 'Dvořák', headers
@@ -0,0 +1,158 @@
+"""Tests for the shared http client."""
+from unittest import mock
+import pytest
+import requests
+from lilyskel import exceptions
+from lilyskel import fetch
+from lilyskel import mutopia
+
+
+@pytest.fixture
+def fake_session(monkeypatch):
+    """A session whose get returns or raises the items in side_effect."""
+    session = mock.MagicMock()
+    monkeypatch.setattr(fetch, 'SESSION', session)
+    monkeypatch.setattr(fetch, 'BACKOFF', 0)
+    monkeypatch.setattr(fetch, 'STATS', dict.fromkeys(fetch.STATS, 0))
+    return session
+
+
+def response(status_code):
+    resp = mock.MagicMock()
+    resp.status_code = status_code
+    return resp
+
+
+def test_get(fake_session):
+    """Test a plain and a conditional request."""
+    fake_session.get.side_effect = [response(200), response(304)]
+    assert fetch.get('http://a', timeout=2).status_code == 200
+    fake_session.get.assert_called_with('http://a', headers=None, timeout=2,
+                                        stream=False)
+    assert fetch.get('http://a', headers={'If-None-Match': 'x'}).status_code\
+        == 304
+    stats = fetch.stats()
+    assert (stats['requests'], stats['misses'], stats['hits']) == (2, 1, 1)
+    assert stats['mean_latency'] >= 0
+
+
+def test_get_retries(fake_session):
+    """Connection errors and server errors are retried a bounded number of
+    times, client errors are not."""
+    fake_session.get.side_effect = [requests.ConnectionError(),
+                                    response(503), response(200)]
+    assert fetch.get('http://a').status_code == 200
+    assert fetch.stats()['retries'] == 2
+
+    fake_session.get.side_effect = [requests.Timeout()] * (fetch.RETRIES + 1)
+    with pytest.raises(exceptions.FetchError):
+        fetch.get('http://a')
+
+    fake_session.get.reset_mock()
+    fake_session.get.side_effect = [response(404)]
+    with pytest.raises(exceptions.FetchError, match='404'):
+        fetch.get('http://a')
+    fake_session.get.assert_called_once()
+    assert fetch.stats()['failures'] == 2
+
+
+def test_get_deadline(fake_session):
+    """No attempt is made once the deadline has passed."""
+    fake_session.get.side_effect = requests.Timeout()
+    with pytest.raises(exceptions.FetchError, match='deadline'):
+        fetch.get('http://a', deadline=0)
+    fake_session.get.assert_not_called()
+
+
+def test_get_closes_failures(fake_session):
+    """Refused responses give their connection back."""
+    failed = [response(503), response(404)]
+    fake_session.get.side_effect = failed
+    with pytest.raises(exceptions.FetchError, match='404'):
+        fetch.get('http://a', stream=True)
+    for resp in failed:
+        resp.close.assert_called_once_with()
+
+
+def test_read_deadline(fake_session, monkeypatch):
+    """Reading a streamed body stops when the deadline passes."""
+    slow = response(200)
+    slow.iter_content.return_value = iter([b'a', b'b', b'c'])
+    fake_session.get.side_effect = [slow]
+    now = [0]
+    monkeypatch.setattr(fetch.time, 'monotonic', lambda: now[0])
+    chunks = fetch.iter_content(fetch.get('http://a', deadline=10,
+                                          stream=True), 1)
+    assert next(chunks) == b'a'
+    now[0] = 11
+    with pytest.raises(exceptions.FetchError, match='deadline'):
+        next(chunks)
+    slow.close.assert_called_once_with()
+
+
+def test_mutopia_fallback(fake_mutopia, monkeypatch):
+    """Cached vocabularies are used when mutopia can't be reached."""
+    assert 'Baroque' in mutopia.get_styles()
+    monkeypatch.setattr(mutopia, 'TTL', 0)
+    monkeypatch.setattr(mutopia, 'STYLES', None)
+    monkeypatch.setattr(fetch, 'get', mock.MagicMock(
+        side_effect=exceptions.FetchError('timed out')))
+    assert 'Baroque' in mutopia.get_styles()
+
+
+def test_mutopia_fallback_snapshot(fake_mutopia, monkeypatch):
+    """Without a cache, the snapshot is used when mutopia can't be reached."""
+    monkeypatch.delenv('LILYSKEL_OFFLINE', raising=False)
+    monkeypatch.setattr(fetch, 'OFFLINE', False)
+    monkeypatch.setattr(fetch, 'get', mock.MagicMock(
+        side_effect=exceptions.FetchError('timed out')))
+    monkeypatch.setitem(fetch.STATS, 'fallbacks', 0)
+    assert 'Baroque' in mutopia.get_styles()
+    mutopia.validate_mutopia(field='mutopiacomposer', data='BachJS')
+    assert fetch.STATS['fallbacks'] == 2
+    assert not mutopia._load_cache().get('contribute')
+    with pytest.raises(exceptions.FetchError):
+        mutopia.refresh()
+
+
+def test_offline(fake_session, monkeypatch):
+    """Offline, nothing is requested."""
+    monkeypatch.setenv('LILYSKEL_OFFLINE', '1')
+    with pytest.raises(exceptions.OfflineError, match='offline'):
+        fetch.get('http://a')
+    fake_session.get.assert_not_called()
+    monkeypatch.setenv('LILYSKEL_OFFLINE', '0')
+    assert not fetch.is_offline()
+    monkeypatch.setattr(fetch, 'OFFLINE', False)
+    fetch.set_offline()
+    assert fetch.is_offline()
+
+
+def test_mutopia_offline(fake_mutopia, monkeypatch):
+    """Offline, mutopia data comes from the cache or the bundled snapshot."""
+    monkeypatch.setenv('LILYSKEL_OFFLINE', '1')
+    assert 'Baroque' in mutopia.get_styles()
+    assert 'Violin' in mutopia.get_instruments()
+    mutopia.validate_mutopia(field='mutopiacomposer', data='BachJS')
+    assert not fake_mutopia
+    with pytest.raises(exceptions.OfflineError):
+        mutopia.refresh()
+
+    monkeypatch.delenv('LILYSKEL_OFFLINE')
+    monkeypatch.setattr(mutopia, 'STYLES', None)
+    mutopia.get_styles()
+    monkeypatch.setenv('LILYSKEL_OFFLINE', '1')
+    monkeypatch.setattr(mutopia, 'TTL', 0)
+    monkeypatch.setattr(mutopia, 'STYLES', None)
+    monkeypatch.setattr(mutopia, 'SNAPSHOT', None)
+    assert 'Baroque' in mutopia.get_styles(), "expired cache should be used"
+    assert len(fake_mutopia) == 1
+
+
+def test_cli_offline(monkeypatch):
+    """--offline should switch off the network."""
+    from click.testing import CliRunner
+    from lilyskel.interface.cli import cli
+    monkeypatch.setattr(fetch, 'OFFLINE', False)
+    result = CliRunner().invoke(cli, ['--offline', 'mutopia', 'refresh'])
+    assert isinstance(result.exception, exceptions.OfflineError)
@@ -0,0 +1,61 @@
+"""Tests for the built-in fuzzy scorer."""
+import json
+from pathlib import Path
+import pytest
+from lilyskel import fuzzy
+
+srcdir = Path(Path(__file__).parents[1], 'lilyskel')
+
+
+def test_scores():
+    """Test the parts of the weighted ratio."""
+    assert fuzzy.full_process(' Viola-da_Gamba! ') == 'viola da_gamba'
+    assert fuzzy.lcs_length('violin', 'viola') == 4
+    assert fuzzy.lcs_length('', 'viola') == 0
+    assert fuzzy.ratio('violin', 'viola') == 73
+    assert fuzzy.ratio('', '') == 100
+    assert fuzzy.ratio('', 'viola') == 0
+    assert fuzzy.matching_blocks('abc', 'xxabc') == [(0, 2, 3), (3, 5, 0)]
+    assert fuzzy.partial_ratio('bach', 'johann sebastian bach') == 100
+    assert fuzzy.wratio('Bach, J.S.', 'J.S. Bach') == 95
+    assert fuzzy.wratio('', 'Bach') == 0
+
+
+def test_extract():
+    """Test choosing the best matches."""
+    choices = fuzzy.Choices(['Viola', 'Violin', 'Viola da Gamba', 'Cello'])
+    assert len(choices) == 4
+    assert fuzzy.extract_one('violin', choices) == ('Violin', 100)
+    assert fuzzy.extract_one('violoncello', ['Viola', 'Cello'])[0] == 'Cello'
+    assert fuzzy.extract_one('oboe', choices, score_cutoff=80) is None
+    assert fuzzy.extract_one('oboe', []) is None
+    best = fuzzy.extract('viola', choices, limit=2)
+    assert [choice for choice, _ in best] == ['Viola', 'Viola da Gamba']
+    assert len(fuzzy.extract('viola', choices, limit=None)) == 4
+    assert fuzzy.extract('viola', choices, score_cutoff=91) == [('Viola',
+                                                                 100)]
+
+
+def test_fuzzywuzzy_parity():
+    """The bundled names are matched exactly as fuzzywuzzy matches them."""
+    fuzz = pytest.importorskip('fuzzywuzzy.fuzz')
+    from fuzzywuzzy import process
+    with Path(srcdir, 'mutopia_snapshot.json').open() as snapshot:
+        snapshot = json.load(snapshot)
+    with Path(srcdir, 'default_db.json').open() as default:
+        default = json.load(default)
+    pairs = [
+        ([item['name'] for item in default['instruments'].values()],
+         snapshot['advsearch']['instruments']),
+        ([item['name'] for item in default['composers'].values()],
+         snapshot['contribute']['fields']['mutopiacomposer']),
+    ]
+    for queries, choices in pairs:
+        prepared = fuzzy.Choices(choices)
+        for query in queries:
+            assert fuzzy.extract_one(query, prepared) == \
+                process.extractOne(query, choices), query
+        for query in queries[:5]:
+            for choice in choices:
+                assert fuzzy.wratio(query, choice) == \
+                    fuzz.WRatio(query, choice), (query, choice)
@@ -1,4 +1,5 @@
 """Tests for info classes."""
+import copy
 import re
 import attr
 import pytest
@@ -207,6 +208,27 @@ class TestHeaders():
         assert headers2_loaded.mutopiaheaders.license == \
            headers2.mutopiaheaders.license
 
+    def test_headers_load_stored_mutopia(self, headers2, test_ins, monkeypatch):
+        """Stored mutopia names are reused until the instruments change."""
+        headersdict = headers2.dump()
+        instruments = [info.Instrument.load(ins) for ins
+                       in headersdict['mutopiaheaders']['instrument_list']]
+        headersdict['mutopiaheaders']['instruments'] = 'Stored'
+        with monkeypatch.context() as m:
+            m.setattr(info.Composer, 'get_mutopia_name', mock.MagicMock(
+                side_effect=AssertionError('resolved again')))
+            loaded = info.Headers.load(copy.deepcopy(headersdict),
+                                       instruments)
+        assert loaded.mutopiaheaders.instruments == 'Stored'
+        assert loaded.mutopiaheaders.composer ==\
+            headers2.mutopiaheaders.composer
+
+        test_ins.mutopianame = 'Violin'
+        loaded = info.Headers.load(copy.deepcopy(headersdict),
+                                   instruments[1:] + [test_ins])
+        assert loaded.mutopiaheaders.instruments != 'Stored',\
+            "a changed instrument list should be resolved again"
+
 
 def test_movement_load(six_movs):
     """Test loading movements from a dict"""
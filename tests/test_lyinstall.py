@@ -0,0 +1,124 @@
+"""Tests for finding and probing lilypond installations."""
+import os
+import subprocess
+from pathlib import Path
+import pytest
+from lilyskel import lyinstall
+from lilyskel import exceptions
+
+NOTE_NAMES = """
+    ;; Language: Nederlands --------------------------------------------;
+    ;; Language: Deutsch -----------------------------------------------;
+    ;; Language: English -----------------------------------------------;
+"""
+
+
+def make_lilypond(prefix, version):
+    """Make a fake lilypond install under prefix."""
+    bindir = Path(prefix, 'bin')
+    os.makedirs(bindir, exist_ok=True)
+    binary = Path(bindir, 'lilypond')
+    with binary.open('w') as script:
+        script.write("#!/bin/sh\necho 'GNU LilyPond {}'\n".format(version))
+    binary.chmod(0o755)
+    scmdir = Path(prefix, 'share', 'lilypond', version, 'scm')
+    os.makedirs(scmdir, exist_ok=True)
+    with Path(scmdir, 'define-note-names.scm').open('w') as scm:
+        scm.write(NOTE_NAMES)
+    return binary
+
+
+@pytest.fixture
+def fake_lilypond(tmpdir, monkeypatch):
+    """A fake lilypond on PATH and an empty cache."""
+    binary = make_lilypond(Path(tmpdir, 'usr'), '2.18.2')
+    monkeypatch.setenv('PATH', str(binary.parents[0]))
+    monkeypatch.setenv('LILYSKEL_CACHE_DIR', str(Path(tmpdir, 'cache')))
+    monkeypatch.delenv('LILYSKEL_LILYPOND', raising=False)
+    monkeypatch.setattr(lyinstall, 'PROBED', {})
+    monkeypatch.setattr(lyinstall, 'SELECTED', None)
+    return binary
+
+
+def test_probe(fake_lilypond):
+    """Test probing a lilypond installation."""
+    installation = lyinstall.probe()
+    assert installation.version == '2.18.2'
+    assert installation.binary == os.path.realpath(fake_lilypond)
+    assert installation.datadir.endswith(os.path.join('lilypond', '2.18.2'))
+    assert installation.languages == ['nederlands', 'deutsch', 'english']
+
+
+def test_probe_cached(fake_lilypond, monkeypatch):
+    """A second probe, even in a new process, should not run lilypond."""
+    lyinstall.probe()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("lilypond should not be run again")
+
+    monkeypatch.setattr(lyinstall, 'PROBED', {})
+    monkeypatch.setattr(subprocess, 'run', fail)
+    assert lyinstall.probe().version == '2.18.2'
+
+
+def test_probe_invalidated(fake_lilypond, monkeypatch):
+    """Changing the binary's mtime should probe it again."""
+    lyinstall.probe()
+    monkeypatch.setattr(lyinstall, 'PROBED', {})
+    with fake_lilypond.open('w') as script:
+        script.write("#!/bin/sh\necho 'GNU LilyPond 2.19.0'\n")
+    os.utime(fake_lilypond, (1, 1))
+    assert lyinstall.probe().version == '2.19.0'
+
+
+def test_probe_without_datadir(fake_lilypond, tmpdir, monkeypatch):
+    """A probe without data isn't kept, and the bundled languages are used."""
+    from lilyskel import info
+    from lilyskel import pitches
+    datadir = Path(fake_lilypond.parents[1], 'share', 'lilypond', '2.18.2')
+    moved = Path(tmpdir, 'data')
+    datadir.rename(moved)
+    monkeypatch.delenv('LILYPOND_DATADIR', raising=False)
+    assert lyinstall.probe().datadir is None
+    assert info.get_valid_languages() == sorted(pitches.BUNDLED_LANGUAGES)
+    assert 'english' in info.get_valid_languages()
+    assert not lyinstall.cache.load(lyinstall.CACHE_NAME)
+    monkeypatch.setenv('LILYPOND_DATADIR', str(moved))
+    assert lyinstall.probe().languages == ['nederlands', 'deutsch', 'english']
+    monkeypatch.setattr(lyinstall, 'PROBED', {})
+    assert lyinstall.probe().datadir == str(moved)
+
+
+def test_find_datadir(tmpdir, monkeypatch):
+    """A binary without a prefix directory has no data directory there."""
+    monkeypatch.delenv('LILYPOND_DATADIR', raising=False)
+    assert lyinstall.find_datadir('/lilypond', '0.0.0') is None
+    datadir = Path(tmpdir, 'share', 'lilypond', '0.0.0')
+    os.makedirs(Path(datadir, 'scm'))
+    Path(datadir, 'scm', 'define-note-names.scm').touch()
+    monkeypatch.setenv('LILYPOND_DATADIR', str(datadir))
+    assert lyinstall.find_datadir('/lilypond', '0.0.0') == datadir
+
+
+def test_select(fake_lilypond, tmpdir):
+    """Test choosing between several installations."""
+    other = make_lilypond(Path(tmpdir, 'opt'), '2.24.1')
+    assert lyinstall.probe().version == '2.18.2'
+    lyinstall.select(str(other))
+    assert lyinstall.probe().version == '2.24.1'
+    lyinstall.select(None)
+    assert lyinstall.probe().version == '2.18.2'
+
+
+def test_find_binaries(fake_lilypond, monkeypatch):
+    """Versioned binaries on PATH should be found too."""
+    versioned = Path(fake_lilypond.parents[0], 'lilypond-2.24')
+    versioned.symlink_to(fake_lilypond)
+    Path(fake_lilypond.parents[0], 'lilypond-book').touch(mode=0o755)
+    assert lyinstall.find_binaries() == [os.path.realpath(fake_lilypond)]
+
+
+def test_not_installed(fake_lilypond, monkeypatch):
+    monkeypatch.setenv('PATH', '')
+    with pytest.raises(exceptions.LilypondError):
+        lyinstall.probe()
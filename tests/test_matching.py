@@ -0,0 +1,104 @@
+"""Tests for the name matching indexes."""
+from unittest import mock
+from lilyskel import info
+from lilyskel import matching
+from lilyskel import mutopia
+
+
+def test_trigram_index():
+    """Test shortlisting and substring search."""
+    index = matching.TrigramIndex(['Johann Sebastian Bach', 'Johannes Brahms',
+                                   'Carl Philipp Emanuel Bach', 'Ravel'])
+    index.add('Ravel')
+    assert len(index) == 4
+    assert matching.trigrams('Bach') == {'bac', 'ach'}
+    assert matching.trigrams('Ba') == {'ba'}
+    assert index.shortlist('brahms', limit=1) == ['Johannes Brahms']
+    assert set(index.shortlist('J.S. Bach', limit=2)) == {
+        'Johann Sebastian Bach', 'Carl Philipp Emanuel Bach'}
+    assert index.shortlist('xyz') == []
+    assert index.containing('Bach') == ['Johann Sebastian Bach',
+                                        'Carl Philipp Emanuel Bach']
+    assert index.containing('bach') == []
+    assert index.containing('Jo') == ['Johann Sebastian Bach',
+                                      'Johannes Brahms']
+    assert index.containing('') == index.names
+
+
+def test_name_keys():
+    """Spelling variants share a phonetic key."""
+    assert matching.fold('Čajkovskij, P.') == 'chajkovskijp'
+    assert matching.surname('BeethovenLv') == 'Beethoven'
+    assert matching.surname('Ludwig van Beethoven') == 'Beethoven'
+    for variants in [['Tchaikovsky', 'Chaikovsky', 'Čajkovskij',
+                      'TchaikovskyPI'],
+                     ['Rachmaninoff', 'Rachmaninov', 'Rakhmaninov'],
+                     ['Dvořák', 'DvorakA'],
+                     ['Schönberg', 'Schoenberg']]:
+        assert len({matching.phonetic(matching.surname(variant))
+                    for variant in variants}) == 1, variants
+    assert matching.phonetic('Bach') != matching.phonetic('Brahms')
+
+    index = matching.TrigramIndex(['TchaikovskyPI', 'RachmaninoffS',
+                                   'BachJS', 'BachCPE'])
+    assert index.lookup('Pyotr Ilyich Čajkovskij') == ['TchaikovskyPI']
+    assert index.lookup('bachjs') == ['BachJS'], "folded names come first"
+    assert index.lookup('Sergei Rakhmaninov') == ['RachmaninoffS']
+    assert index.lookup('Bach') == ['BachJS', 'BachCPE']
+    assert index.lookup('Mozart') == []
+
+    assert matching.initials('C. P. E. Bach') == 'cpe'
+    assert matching.initials('BeethovenLv') == 'lv'
+    assert matching.initials('Bach') == ''
+    index = matching.TrigramIndex(['Franz Joseph Strauss', 'StraussJ'])
+    assert index.lookup('Richard Strauss') == [], "not the same person"
+    assert index.lookup('Johann Strauss') == ['StraussJ']
+    assert 'Franz Joseph Strauss' in index.lookup('Strauß')
+    match = matching.best_match('Richard Strauss', index)
+    assert match is None or match[1] < 100
+    assert matching.index_of(['a', 'b']) is matching.index_of(['a', 'b'])
+
+
+def test_composer_guess_shortlist(monkeypatch, fake_mutopia):
+    """Without a key match only the shortlisted mutopia composers are fuzzy
+    scored."""
+    composers = mutopia.get_composers()
+    from lilyskel import fuzzy
+    monkeypatch.setattr(matching.TrigramIndex, 'lookup', lambda *args: [])
+    with mock.patch.object(fuzzy, 'extract_one',
+                           wraps=fuzzy.extract_one) as extract:
+        composer = info.Composer('Johannes Brahms')
+        assert composer.get_mutopia_name(guess=True) == 'BrahmsJ'
+    choices = extract.call_args[0][1]
+    assert choices.choices[0] == 'BrahmsJ'
+    assert len(choices) <= matching.SHORTLIST < len(composers)
+    assert mutopia.composer_index() is mutopia.composer_index()
+    index = mutopia.composer_index()
+    assert index.choices(['BrahmsJ']).prepared[0] is \
+        index.choices(['BrahmsJ', 'BachJS']).prepared[0]
+
+
+def test_match_all():
+    """Test matching a batch of names by trigram cosine similarity."""
+    candidates = ['Violin', 'Viola', 'Cello', 'Clarinet', 'Bass']
+    assert matching.trigram_counts('Bass_Clarinet')['s c'] == 1
+    matches = matching.match_all(
+        ['violin', 'clarinet_in_bb', 'violin', 'xylophone', 'double bass'],
+        candidates)
+    assert set(matches) == {'violin', 'clarinet_in_bb', 'xylophone',
+                            'double bass'}
+    assert matches['violin'] == ('Violin', 100)
+    assert matches['clarinet_in_bb'][0] == 'Clarinet'
+    assert matches['double bass'][0] == 'Bass'
+    assert matches['xylophone'] is None
+    assert matching.match_all(['double bass'], candidates,
+                              threshold=90) == {'double bass': None}
+
+
+def test_composer_variants(livedb, fake_mutopia):
+    """Composers are found under other spellings."""
+    assert info.Composer('Pjotr Iljitsch Tschaikowski').get_mutopia_name(
+        guess=True) == 'TchaikovskyPI'
+    bach = info.Composer.load_from_db('johann sebastian bach', livedb)
+    assert bach.mutopianame == 'BachJS'
+    assert info.Composer.load_from_db('J. S. Bach', livedb) == bach
@@ -2,35 +2,23 @@
 import pytest
 from lilyskel import mutopia
 from lilyskel import exceptions
+from lilyskel import lynames
 
 
-def test_scrape_mutopia():
-    """Test mutopia scraping."""
-    tabledata = mutopia._scrape_mutopia()
-    sitefirstrun = mutopia.SITE
-    for item in tabledata:
-        assert 'td' in str(item),\
-           "Should only return td elements from the table."
-    mutopia._scrape_mutopia()
-    assert sitefirstrun is mutopia.SITE, ("One downloaded, the site should set"
-                                          " the SITE global and not download "
-                                          "again.")
+def test_field_index(fake_mutopia):
+    """Test the index of the contribute table."""
+    assert 'Baroque' in mutopia.get_field('style')
+    assert 'Creative Commons Attribution 4.0' in mutopia.get_field('license')
+    assert 'BachJS' in mutopia.get_field('mutopiacomposer')
+    assert isinstance(mutopia.get_field('style'), frozenset)
+    assert mutopia.get_field('style') is mutopia.get_field('style'),\
+        "The index should only be built once."
+    assert set(mutopia.FIELDS) == {'mutopiacomposer', 'style', 'license'},\
+        "Fields without a list of values should be left out."
+    assert len(fake_mutopia) == 1
 
-
-def test_get_mutopia_table_data():
-    """Test getting data from the table."""
-    data1 = mutopia._get_mutopia_table_data('style')
-    assert 'Baroque' in data1.get_text(), "This should contain the styles."
-    data2 = mutopia._get_mutopia_table_data('license')
-    assert 'Creative Commons' in data2.get_text(),\
-        "This should contain the licenses"
-    data3 = mutopia._get_mutopia_table_data('mutopiacomposer')
-    assert 'BachJS' in data3.get_text(), "This should contain the composers"
-
-    with pytest.raises(exceptions.MutopiaError, match='.* was not found',
-                       message=('Expect MutopiaError if the field is not found'
-                                ' in the table.')):
-        mutopia._get_mutopia_table_data('nonexistent')
+    with pytest.raises(exceptions.MutopiaError, match='.* was not found'):
+        mutopia.get_field('nonexistent')
 
 
 def test_validate_mutopia():
@@ -77,3 +65,152 @@ def test_get_instruments():
     assert {'Violin', 'Cello', 'Flute', 'Clarinet', 'Trumpet'}.issubset(
         set(mutopia.get_instruments())),\
         "These instruments are allowed and should be in the list."
+
+
+def test_vocabulary_cache(fake_mutopia, monkeypatch):
+    """The vocabularies should be cached on disk and revalidated."""
+    assert 'Baroque' in mutopia.get_styles()
+    assert 'Public Domain' in mutopia.get_licenses()
+    assert 'BachJS' in mutopia.get_composers()
+    assert 'Violin' in mutopia.get_instruments()
+    assert len(fake_mutopia) == 2, "one request per page"
+
+    # a new process reads the cache instead of downloading
+    for name in ['LICENSES', 'COMPOSERS', 'INSTRUMENTS', 'STYLES', 'CACHE',
+                 'FIELDS', 'INSTRUMENT_INDEX']:
+        monkeypatch.setattr(mutopia, name, None)
+    mutopia.validate_mutopia(field='style', data='Classical')
+    mutopia.validate_mutopia(field='mutopiacomposer', data='BachJS')
+    assert 'Cello' in mutopia.get_instruments()
+    assert len(fake_mutopia) == 2, "cached vocabularies should be used"
+
+    # expired entries are revalidated with their ETag
+    monkeypatch.setattr(mutopia, 'TTL', 0)
+    monkeypatch.setattr(mutopia, 'STYLES', None)
+    assert 'Baroque' in mutopia.get_styles()
+    url, headers = fake_mutopia[-1]
+    assert url == mutopia.CONTRIBUTE_URL
+    assert headers['If-None-Match'] == '"v1"'
+
+
+def test_ttl(monkeypatch):
+    """The TTL is read from the environment when first needed."""
+    monkeypatch.setattr(mutopia, 'TTL', None)
+    monkeypatch.setenv('LILYSKEL_MUTOPIA_TTL', '60')
+    assert mutopia.ttl() == 60
+    monkeypatch.setattr(mutopia, 'TTL', None)
+    monkeypatch.setenv('LILYSKEL_MUTOPIA_TTL', 'a day')
+    assert mutopia.ttl() == mutopia.DEFAULT_TTL
+
+
+def test_refresh(fake_mutopia):
+    """Test refreshing the vocabularies."""
+    mutopia.refresh()
+    assert len(fake_mutopia) == 2
+    mutopia.refresh()
+    assert all(headers.get('If-None-Match') for _, headers
+               in fake_mutopia[2:]), "refresh should be conditional"
+    mutopia.refresh(force=True)
+    assert not any(headers for _, headers in fake_mutopia[4:])
+    assert 'Flute' in mutopia.get_instruments()
+
+
+def test_match_instrument(fake_mutopia, monkeypatch):
+    """Exact and alias names skip scoring, the rest is memoized."""
+    from unittest import mock
+    from lilyskel import matching
+    match_all = mock.MagicMock(wraps=matching.match_all)
+    monkeypatch.setattr(matching, 'match_all', match_all)
+    assert mutopia.match_instrument('violin') == 'Violin'
+    assert mutopia.match_instrument('clarinet_in_bb') == 'Clarinet'
+    assert mutopia.match_instrument('French Horn') == 'Horn'
+    match_all.assert_not_called()
+
+    section = [lynames.Instrument.numbered_name('violino piccolo', num)
+               for num in range(1, 17)]
+    names = {ins.get_mutopia_name() for ins in section}
+    assert len(names) == 1
+    assert match_all.call_count == 1, "a section should cost one match"
+
+    # a new process gets the match from the cache
+    for name in ['INSTRUMENTS', 'CACHE', 'INSTRUMENT_INDEX']:
+        monkeypatch.setattr(mutopia, name, None)
+    assert mutopia.match_instrument('violino piccolo') in names
+    assert match_all.call_count == 1
+
+
+def test_match_instruments(fake_mutopia, monkeypatch):
+    """A batch is scored in one pass, fuzzy matching only gets the
+    leftovers."""
+    from unittest import mock
+    from lilyskel import matching
+    from lilyskel import fuzzy
+    match_all = mock.MagicMock(wraps=matching.match_all)
+    monkeypatch.setattr(matching, 'match_all', match_all)
+    extract_one = mock.MagicMock(return_value=('Drums', 50))
+    monkeypatch.setattr(fuzzy, 'extract_one', extract_one)
+    names = ['violin', 'bass_clarinet', 'english_horn', 'bass clarinet',
+             'zzzz', 'violoncello']
+    assert mutopia.match_instruments(names) == {
+        'violin': 'Violin', 'bass_clarinet': 'Clarinet',
+        'english_horn': 'Horn', 'bass clarinet': 'Clarinet',
+        'zzzz': 'Drums', 'violoncello': 'Cello'}
+    assert match_all.call_count == 1
+    assert sorted(match_all.call_args[0][0]) == [
+        'bass_clarinet', 'english_horn', 'violoncello', 'zzzz']
+    extract_one.assert_called_once_with('zzzz', mutopia.instrument_choices())
+    assert mutopia.instrument_choices().choices == mutopia.get_instruments()
+
+
+def test_stored_matches(fake_mutopia, tmpdir, monkeypatch):
+    """Guesses are stored in the db and used while the lists are current."""
+    from unittest import mock
+    from tinydb import TinyDB
+    from lilyskel import info
+    from lilyskel import matching
+    test_db = TinyDB(str(tmpdir.join('db.json')))
+    assert mutopia.match_instruments(['violin', 'violoncello'],
+                                     db=test_db)['violoncello'] == 'Cello'
+    assert [data['query'] for data in test_db.table('name_matches')] == [
+        'violoncello'], "only scored guesses are stored"
+    assert info.Composer('Johannes Brahms').get_mutopia_name(
+        guess=True, db=test_db) == 'BrahmsJ'
+
+    # another process
+    monkeypatch.setattr(mutopia, 'INSTRUMENT_INDEX', None)
+    mutopia.CACHE['advsearch'].pop('matches')
+    monkeypatch.setattr(matching, 'match_all', mock.MagicMock())
+    monkeypatch.setattr(matching, 'best_match', mock.MagicMock())
+    assert mutopia.match_instrument('violoncello', db=test_db) == 'Cello'
+    assert info.Composer('Johannes Brahms').get_mutopia_name(
+        guess=True, db=test_db) == 'BrahmsJ'
+    matching.match_all.assert_not_called()
+    matching.best_match.assert_not_called()
+
+    assert mutopia.prune_matches(test_db) == 0
+    monkeypatch.setitem(mutopia.VERSIONS, 'instrument', 'changed')
+    assert mutopia.prune_matches(test_db) == 1
+    assert len(test_db.table('name_matches')) == 1
+
+
+def test_catalog_index(tmpdir, monkeypatch, piece1, capsys):
+    """Test indexing a catalog dump and finding pieces in it."""
+    from pathlib import Path
+    from lilyskel import catalog
+    monkeypatch.setenv('LILYSKEL_CACHE_DIR', str(Path(tmpdir, 'cache')))
+    monkeypatch.setattr(catalog, 'INDEX', None)
+    assert catalog.find('BeethovenLv', 'Op. 67', 'Symphony No. 5') == []
+    catalog_dir = Path(Path(__file__).parents[0], 'mutopia_catalog')
+    # the beethoven symphony is in an rdf and an html file, but counts once
+    assert catalog.build_index(catalog_dir) == 2
+    monkeypatch.setattr(catalog, 'INDEX', None)
+    found = catalog.find('Ludwig van Beethoven', 'Opus 67', 'Symphony no 5')
+    assert found == [{'composer': 'BeethovenLv', 'opus': 'Opus 67',
+                      'title': 'Symphony No. 5',
+                      'id': 'Mutopia-2011/03/10-1776'}]
+    assert catalog.find('BeethovenLv', 'Op. 68', 'Symphony No. 5') == []
+
+    assert catalog.duplicates(piece1) == []
+    piece1.opus = 'BWV 1'
+    catalog.warn_duplicates(piece1)
+    assert 'Mutopia-2019/01/01-2000' in capsys.readouterr().out
@@ -0,0 +1,133 @@
+"""Tests for the bundled note and mode tables."""
+from pathlib import Path
+import pytest
+from lilyskel import cache
+from lilyskel import info
+from lilyskel import pitches
+
+
+@pytest.fixture
+def empty_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('LILYSKEL_CACHE_DIR', str(Path(tmpdir, 'cache')))
+    monkeypatch.setattr(info, 'ALLOWED_NOTES', None)
+    monkeypatch.setattr(info, 'ALLOWED_MODES', None)
+
+
+def test_bundled_tables(empty_cache, monkeypatch):
+    """Without a cache the bundled tables are used, without the network."""
+    monkeypatch.delattr("requests.sessions.Session.request")
+    notes, modes = pitches.load()
+    assert notes is pitches.NOTES
+    assert modes is pitches.MODES
+    for note in ['c', 'cis', 'bes', 'bf', 'fsharp', 'dob', 'fisis', 'hessess']:
+        assert note in notes
+    assert 'major' in modes and 'locrian' in modes
+    assert isinstance(info.get_allowed_notes(), frozenset)
+    info.Movement(num=1, key=('ees', 'dorian'))
+
+
+def test_refresh(empty_cache, monkeypatch):
+    """Refreshed tables are cached and take precedence."""
+    monkeypatch.setattr(pitches, 'scrape_notes',
+                        lambda: frozenset(['c', 'cis']))
+    monkeypatch.setattr(pitches, 'scrape_modes',
+                        lambda: frozenset(['major']))
+    assert pitches.refresh() == (frozenset(['c', 'cis']),
+                                 frozenset(['major']))
+    assert cache.load(pitches.CACHE_NAME) == {'notes': ['c', 'cis'],
+                                              'modes': ['major']}
+    assert info.get_allowed_notes() == frozenset(['c', 'cis'])
+    assert info.get_allowed_modes() == frozenset(['major'])
+
+
+NOTE_NAMES = r"""
+(define-public language-pitch-names
+  `(
+    ;; Language: Nederlands --------------------------------------------;
+    (nederlands . (
+                   (ceses . ,(ly:make-pitch -1 0 DOUBLE-FLAT))
+                   (cis . ,(ly:make-pitch -1 0 SHARP))
+                   (ees . ,(ly:make-pitch -1 2 FLAT))
+                   ))
+    ;; Language: English -----------------------------------------------;
+    (english . (
+                (c . ,(ly:make-pitch -1 0 NATURAL))
+                (cs . ,(ly:make-pitch -1 0 SHARP))
+                (c-sharp . ,(ly:make-pitch -1 0 SHARP))
+                ))
+    (español . (
+                (dob . ,(ly:make-pitch -1 0 FLAT))
+                ))
+    ))
+"""
+
+OLD_NOTE_NAMES = r"""
+(define-public pitchnames-deutsch `(
+    (ceses . ,(ly:make-pitch -1 0 DOUBLE-FLAT))
+    (h . ,(ly:make-pitch -1 6 NATURAL))
+))
+(define-public pitchnames-svenska `(
+    (ciss . ,(ly:make-pitch -1 0 SHARP))
+))
+"""
+
+
+def test_parse_note_names():
+    """Test parsing both layouts of define-note-names.scm."""
+    assert pitches.parse_note_names(NOTE_NAMES) == {
+        'nederlands': ['ceses', 'cis', 'ees'],
+        'english': ['c', 'cs', 'c-sharp'],
+        'español': ['dob'],
+    }
+    assert pitches.parse_note_names(OLD_NOTE_NAMES) == {
+        'deutsch': ['ceses', 'h'],
+        'svenska': ['ciss'],
+    }
+
+
+def test_language_notes(empty_cache, tmpdir, monkeypatch):
+    """Installed note names are used and cached per version, otherwise the
+    bundled tables."""
+    from lilyskel import lyinstall
+    from .test_lyinstall import make_lilypond
+    binary = make_lilypond(Path(tmpdir, 'usr'), '2.22.1')
+    scm = Path(tmpdir, 'usr', 'share', 'lilypond', '2.22.1', 'scm',
+               'define-note-names.scm')
+    with scm.open('w') as scmfile:
+        scmfile.write(NOTE_NAMES)
+    monkeypatch.setenv('PATH', str(binary.parents[0]))
+    monkeypatch.delenv('LILYSKEL_LILYPOND', raising=False)
+    monkeypatch.setattr(lyinstall, 'PROBED', {})
+    monkeypatch.setattr(lyinstall, 'SELECTED', None)
+    monkeypatch.setattr(pitches, 'LANGUAGE_NOTES', {})
+
+    assert 'español' in lyinstall.probe().languages
+    assert pitches.language_notes('english') == frozenset(
+        ['c', 'cs', 'c-sharp'])
+    assert pitches.language_notes('Espanol') == frozenset(['dob'])
+    assert cache.load(pitches.PITCHNAMES_CACHE)['2.22.1']['nederlands'] == [
+        'ceses', 'cis', 'ees']
+    # not in this installation
+    assert 'his' in pitches.language_notes('deutsch')
+    assert 'bes' not in pitches.language_notes('deutsch')
+
+    monkeypatch.setenv('PATH', '')
+    monkeypatch.setattr(lyinstall, 'PROBED', {})
+    monkeypatch.setattr(pitches, 'LANGUAGE_NOTES', {})
+    english = pitches.language_notes('english')
+    assert {'cs', 'bf', 'fsharp', 'ex', 'aqs'} <= english
+    assert 'cis' not in english
+    assert pitches.language_notes('klingon') == pitches.NOTES
+
+
+def test_piece_key_language(piece1, monkeypatch):
+    """Movement keys must be note names of the piece's language."""
+    import pytest
+    monkeypatch.setattr(pitches, 'LANGUAGE_NOTES', {
+        'english': pitches.BUNDLED_LANGUAGES['english'],
+        'nederlands': pitches.BUNDLED_LANGUAGES['nederlands']})
+    piece1.movements[0].key = info.KeySignature('cis', 'major')
+    with pytest.raises(AttributeError, match='not a note name in english'):
+        piece1.validate()
+    piece1.language = 'nederlands'
+    piece1.validate()
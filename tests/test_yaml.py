@@ -32,3 +32,25 @@ def test_empty_piece(tmpdir):
     testfile3.open("w").close()
     with pytest.raises(ValueError):
         yaml_interface.read_config(testfile3)
+
+
+def test_read_trusted(piece2, tmpdir, monkeypatch):
+    """A trusted read runs no validators until validate() is called."""
+    from unittest import mock
+    import attr
+    from lilyskel import info
+    testfile = Path(tmpdir, "trusted.yaml")
+    yaml_interface.write_config(testfile, piece2)
+    with monkeypatch.context() as m:
+        for getter in ['get_allowed_notes', 'get_allowed_modes',
+                       'get_valid_languages']:
+            m.setattr(info, getter, mock.MagicMock(
+                side_effect=AssertionError('validator was run')))
+        trusted = yaml_interface.read_config(testfile, trusted=True)
+    assert trusted.dump() == piece2.dump()
+    assert attr.get_run_validators(), "validators should be back on"
+
+    trusted.validate()
+    trusted.movements[1].key = info.KeySignature('xyz', 'major')
+    with pytest.raises(AttributeError):
+        trusted.validate()